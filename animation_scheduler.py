@@ -0,0 +1,105 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import logging
+import time
+
+# How often running animations are advanced
+TICK_RATE = 15 # ms
+
+# Animations are (frames, delay, start_time, shown_step, show_frame, finished)
+# lists, these are the indexes of each value in those lists
+FRAMES_INDEX = 0
+DELAY_INDEX = 1
+START_TIME_INDEX = 2
+SHOWN_STEP_INDEX = 3
+SHOW_FRAME_INDEX = 4
+FINISHED_INDEX = 5
+
+# Plays every animation on a canvas from the Tk loop. A single after() timer
+# runs while any animation is active and moves each one to the frame it
+# should be on according to the time it started, so a busy Tk loop makes
+# animations skip frames instead of slowing down. Skipped frames are counted
+# as dropped.
+class AnimationScheduler():
+    def __init__(self, widget):
+        self._widget = widget
+        self._logger = logging.getLogger("shootoff")
+        self._animations = {}
+        self._timer = None
+        self._dropped_frames = 0
+
+    # Plays frames (a list of frame indexes) on key, showing one every delay
+    # seconds by calling show_frame(key, frame). finished(key) is called after
+    # the last frame is shown. An animation that is already playing on key
+    # is cancelled.
+    def start(self, key, frames, delay, show_frame, finished=None):
+        self.cancel(key)
+
+        if len(frames) == 0:
+            return
+
+        self._animations[key] = [list(frames), delay, time.time(), 0,
+            show_frame, finished]
+        show_frame(key, frames[0])
+
+        if len(frames) == 1:
+            self._finish(key)
+        elif self._timer is None:
+            self._timer = self._widget.after(TICK_RATE, self._tick)
+
+    # Stops the animation playing on key where it is without calling its
+    # finished callback
+    def cancel(self, key):
+        self._animations.pop(key, None)
+
+        if not self._animations and self._timer is not None:
+            self._widget.after_cancel(self._timer)
+            self._timer = None
+
+    def is_playing(self, key):
+        return key in self._animations
+
+    # Returns how many frames have been skipped because the Tk loop
+    # couldn't keep up
+    def get_dropped_frames(self):
+        return self._dropped_frames
+
+    def _tick(self):
+        self._timer = None
+        now = time.time()
+
+        for key, animation in self._animations.items():
+            # An earlier callback may have cancelled this animation
+            if key not in self._animations:
+                continue
+
+            frames = animation[FRAMES_INDEX]
+            step = min(int((now - animation[START_TIME_INDEX]) / animation[DELAY_INDEX]),
+                len(frames) - 1)
+
+            if step <= animation[SHOWN_STEP_INDEX]:
+                continue
+
+            dropped = step - animation[SHOWN_STEP_INDEX] - 1
+            if dropped > 0:
+                self._dropped_frames += dropped
+                self._logger.debug("Animation dropped %d frames.", dropped)
+
+            animation[SHOWN_STEP_INDEX] = step
+            animation[SHOW_FRAME_INDEX](key, frames[step])
+
+            if step == len(frames) - 1:
+                self._finish(key)
+
+        # A callback may have started a new animation, which schedules
+        # the timer itself
+        if self._animations and self._timer is None:
+            self._timer = self._widget.after(TICK_RATE, self._tick)
+
+    def _finish(self, key):
+        animation = self._animations.pop(key)
+
+        if animation[FINISHED_INDEX] is not None:
+            animation[FINISHED_INDEX](key)
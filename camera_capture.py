@@ -0,0 +1,211 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import cv2
+import numpy
+from threading import Condition, Thread
+import time
+
+DEFAULT_RING_SIZE = 4
+MAX_MISSED_FRAMES = 25
+
+NO_FRAME = (-1, 0, None)
+
+# A fixed size ring of frame buffers that are allocated once, when the first
+# frame arrives, and then reused for the life of the capture. There is exactly
+# one writer (the capture thread) and any number of readers that each keep
+# track of the last sequence number they consumed. No lock is taken: the writer
+# invalidates a slot before overwriting it and publishes the new sequence
+# number only after the frame is complete, so a reader can always tell whether
+# the slot it looked at still holds the frame it asked for.
+#
+# Frames handed out by the ring are only valid until the camera wraps around
+# the whole ring. Readers that need a frame for longer than that must copy it.
+class FrameRingBuffer():
+    def __init__(self, size=DEFAULT_RING_SIZE):
+        self._size = size
+        self._frames = [None] * size
+        self._timestamps = [0] * size
+        self._sequences = [-1] * size
+        self._latest_sequence = -1
+
+        # Only used to wake up readers that are waiting on a new frame,
+        # frames are never read or written under this lock
+        self._published = Condition()
+
+    def get_size(self):
+        return self._size
+
+    # Returns the buffer the frame with the given sequence number should
+    # be written into and marks the slot as being written. The buffer is
+    # None until the ring has seen a frame of the right shape.
+    def begin_write(self, sequence, shape=None):
+        index = sequence % self._size
+        self._sequences[index] = -1
+
+        frame = self._frames[index]
+        if frame is None and shape is not None:
+            frame = numpy.empty(shape, numpy.uint8)
+            self._frames[index] = frame
+
+        return frame
+
+    def publish(self, sequence, frame, timestamp):
+        index = sequence % self._size
+        self._frames[index] = frame
+        self._timestamps[index] = timestamp
+        self._sequences[index] = sequence
+        self._latest_sequence = sequence
+
+        with self._published:
+            self._published.notify_all()
+
+    # Blocks until the frame with the given sequence number (or a later one)
+    # has been published or until timeout seconds have passed. Returns the
+    # latest sequence number.
+    def wait_for(self, sequence, timeout):
+        with self._published:
+            if self._latest_sequence < sequence:
+                self._published.wait(timeout)
+
+        return self._latest_sequence
+
+    def get_latest_sequence(self):
+        return self._latest_sequence
+
+    # Returns a (sequence, timestamp, frame) tuple for the newest complete
+    # frame or NO_FRAME if nothing has been captured yet
+    def get_latest(self):
+        sequence = self._latest_sequence
+        if sequence < 0:
+            return NO_FRAME
+
+        frame = self.get(sequence)
+        if frame is None:
+            return NO_FRAME
+
+        return (sequence,) + frame
+
+    # Returns a (timestamp, frame) tuple for the frame with the given sequence
+    # number or None if the writer has already lapped it
+    def get(self, sequence):
+        index = sequence % self._size
+        timestamp = self._timestamps[index]
+        frame = self._frames[index]
+
+        if not self.is_valid(sequence):
+            return None
+
+        return (timestamp, frame)
+
+    # Returns True if the frame with the given sequence number is still
+    # intact in the ring. Readers that hold onto a frame while processing it
+    # check this afterwards to find out if their result is trustworthy.
+    def is_valid(self, sequence):
+        return self._sequences[sequence % self._size] == sequence
+
+# Owns the video camera and reads it on a dedicated thread so that a slow
+# camera never stalls the Tk event loop. Every frame is timestamped as soon as
+# it is grabbed and published to a FrameRingBuffer that the feed display and
+# the shot detector consume independently.
+class CameraCapture():
+    def __init__(self, vidcam, logger, ring_size=DEFAULT_RING_SIZE):
+        self._vidcam = vidcam
+        self._logger = logger
+        self._ring_buffer = FrameRingBuffer(ring_size)
+        self._missed_frames = 0
+        self._disconnected = False
+        self._shutdown = False
+        self._capture_thread = None
+
+        self._cv = cv2.VideoCapture(vidcam)
+
+    def is_opened(self):
+        return self._cv.isOpened()
+
+    # Camera properties should only be changed before start is called
+    def get(self, prop):
+        return self._cv.get(prop)
+
+    def set(self, prop, value):
+        return self._cv.set(prop, value)
+
+    def grab(self):
+        return self._cv.grab()
+
+    def get_vidcam(self):
+        return self._vidcam
+
+    def get_ring_buffer(self):
+        return self._ring_buffer
+
+    def get_latest_frame(self):
+        return self._ring_buffer.get_latest()
+
+    def is_disconnected(self):
+        return self._disconnected
+
+    def start(self):
+        self._capture_thread = Thread(target=self._capture_loop,
+            name="capture_thread_%d" % self._vidcam)
+        self._capture_thread.daemon = True
+        self._capture_thread.start()
+
+    def stop(self):
+        self._shutdown = True
+
+        if self._capture_thread is not None:
+            self._capture_thread.join()
+            self._capture_thread = None
+
+        self._cv.release()
+
+    def _capture_loop(self):
+        sequence = 0
+        shape = None
+
+        while not self._shutdown:
+            if not self._cv.grab():
+                if self._missed_frame():
+                    break
+                continue
+
+            # The frame was sampled when it was grabbed, decoding it
+            # is just overhead
+            timestamp = time.time()
+
+            frame = self._ring_buffer.begin_write(sequence, shape)
+            if frame is None:
+                rval, frame = self._cv.retrieve()
+            else:
+                rval, frame = self._cv.retrieve(frame)
+
+            if not rval or frame is None:
+                if self._missed_frame():
+                    break
+                continue
+
+            self._missed_frames = 0
+            shape = frame.shape
+
+            self._ring_buffer.publish(sequence, frame, timestamp)
+            sequence += 1
+
+    # Returns True if we missed so many frames in a row that the camera
+    # is probably gone
+    def _missed_frame(self):
+        self._missed_frames += 1
+        self._logger.debug("Missed %d webcam frames. If we miss too many ShootOFF " +
+            "will stop processing shots.", self._missed_frames)
+
+        if self._missed_frames >= MAX_MISSED_FRAMES:
+            self._logger.critical("Missed %d webcam frames. The camera is probably " +
+                "disconnected so ShootOFF will stop processing shots.",
+                self._missed_frames)
+            self._disconnected = True
+            return True
+
+        # Don't spin on a camera that is failing
+        time.sleep(.01)
+        return False
@@ -2,20 +2,24 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+from animation_scheduler import AnimationScheduler
+import image_frame_cache
 import math
-from PIL import Image, ImageTk
 import platform
-import re
-from tag_parser import TagParser
+from region_metadata import RegionMetadata
+import target_geometry
+from target_geometry import TargetGeometryIndex
 from target_pickler import TargetPickler
-from threading import Thread
-import time
 
-DURATION_INDEX = 0
-FIRST_IMAGE_INDEX = 1
-FIRST_PHOTOIMAGE_INDEX = 2
-LAST_IMAGE_INDEX = 3
-FRAMES_INDEX = 4
+# How long to wait after the last key press while resizing an image region
+# before all of its frames are scaled at full quality
+IMAGE_RESIZE_DELAY = 300 # ms
+
+# Pending image resizes are (size, timer, preview) tuples, these are the
+# indexes of each value in those tuples
+RESIZE_SIZE_INDEX = 0
+RESIZE_TIMER_INDEX = 1
+RESIZE_PREVIEW_INDEX = 2
 
 # This class manages operations common to the webcam feed canvas
 # and the target editor canvas
@@ -99,6 +103,8 @@ class CanvasManager():
                 oval = converter(region, fill, tags)
                 self._canvas.tag_raise(higher, oval)
                 self._canvas.delete(region)
+                self._geometry.replace(region, oval, self._canvas.type(oval),
+                    self._canvas.coords(oval))
 
         # Restore z-order otherwise targets with ovals disappear
         # on projector arena
@@ -139,6 +145,8 @@ class CanvasManager():
             elif event.keysym == "Left":
                 event.widget.move(self._selection, -1, 0)
 
+            self.update_geometry(self._selection)
+
     def scale_region(self, event):
         if (not self._selection or 
             self.is_background(self._selection)):
@@ -148,7 +156,7 @@ class CanvasManager():
         is_polygon = len(c) > 6
         
         for region in self._canvas.find_withtag(self._selection):
-            is_image = "_shape:image" in self._canvas.gettags(region)
+            is_image = self._metadata.has_tag(region, "_shape:image")
             if is_image:
                 break
            
@@ -161,7 +169,7 @@ class CanvasManager():
                 for region in self._canvas.find_withtag(self._selection):
                     c = event.widget.coords(region)
                     is_polygon = len(c) > 6
-                    is_image = "_shape:image" in self._canvas.gettags(region)
+                    is_image = self._metadata.has_tag(region, "_shape:image")
                     if is_image:
                         self._scale_region(event, c, is_polygon, is_image, region, 20)
                     else: 
@@ -169,6 +177,8 @@ class CanvasManager():
         else:
             self._scale_region(event, c, is_polygon, is_image, self._selection)
 
+        self.update_geometry(self._selection)
+
     def _scale_region(self, event, c, is_polygon, is_image, region, size_incr=1):
         # The region is scaled by a ratio, so we need to know the current
         # dimension so that we can calculate the ratio needed to scale
@@ -180,8 +190,10 @@ class CanvasManager():
         if is_polygon:
             width = max(c[::2]) - min(c[::2])
             height = max(c[1::2]) - min(c[1::2])
+        elif is_image and region in self._pending_resizes:
+            width, height = self._pending_resizes[region][RESIZE_SIZE_INDEX]
         elif is_image:
-            b = self._image_regions_images[region][FIRST_IMAGE_INDEX].getbbox()
+            b = self._image_regions_images[region].get_frame(0).getbbox()
             width = b[2] - b[0]
             height = b[3] - b[1]
         else:
@@ -230,117 +242,105 @@ class CanvasManager():
                 if (scale_factor > 0): 
                     event.widget.scale(region, c[0], c[1], scale_factor, 1)
 
-        if is_image:
-            tags = TagParser.parse_tags(self._canvas.gettags(region))
-            self.cache_image_frames(region, tags["_path"], width, height)
-            self._canvas.itemconfig(region, image=self._image_regions_images[region][FIRST_PHOTOIMAGE_INDEX])
+        if is_image and width > 0 and height > 0:
+            self._preview_image_size(region, (width, height))
 
-    def cache_image_frames(self, shape, image_path, width=None, height=None):   
-        image = Image.open(image_path)
-        frames = []
-                
-        try:
-            while True:
-                if width != None and height != None:
-                    frames.append(image.copy().resize((width,height), Image.NEAREST))
-                else:
-                    frames.append(image.copy())
-                image.seek(len(frames))
-        except EOFError:
-            pass
-
-        if len(frames) == 1: 
-            self._image_regions_images[shape] = (0, frames[0], ImageTk.PhotoImage(frames[0]), frames[0], None)
-            return self._image_regions_images[shape][FIRST_PHOTOIMAGE_INDEX]
-
-        if "duration" in image.info:
-            if image.info["duration"] != 0:
-                animation_delay = float(image.info["duration"]) / 1000.0
-            else: 
-                animation_delay = .1
-        else:
-            animation_delay = .1
+    # Holding down a resize key repeats it quickly, so while the keys are
+    # repeating only a roughly scaled first frame is shown. All of the frames
+    # are scaled properly once no key has been pressed for IMAGE_RESIZE_DELAY.
+    def _preview_image_size(self, region, size):
+        self._cancel_resize(region)
 
-        first = frames[0].convert('RGBA')
-        frame_images = [ImageTk.PhotoImage(first)]
+        tags = self._metadata.get_tags(region)
+        source = image_frame_cache.get_shared_cache().get(tags["_path"])
+        preview = source.get_preview(0, size)
+        self._canvas.itemconfig(region, image=preview)
 
-        temp = frames[0]
-        for img in frames[1:]:
-            temp.paste(img)
-            frame = temp.convert('RGBA')
-            frame_images.append(ImageTk.PhotoImage(frame))
+        timer = self._canvas.after(IMAGE_RESIZE_DELAY, self._finish_resize, region)
+        self._pending_resizes[region] = (size, timer, preview)
 
-        self._image_regions_images[shape] = (animation_delay, first, ImageTk.PhotoImage(first), frames[len(frames) - 1].convert('RGBA'), frame_images)
+    def _finish_resize(self, region):
+        width, height = self._pending_resizes.pop(region)[RESIZE_SIZE_INDEX]
 
-        return self._image_regions_images[shape][FIRST_PHOTOIMAGE_INDEX]
+        tags = self._metadata.get_tags(region)
+        self.cache_image_frames(region, tags["_path"], width, height)
+        self._canvas.itemconfig(region, image=self._image_regions_images[region].get_photoimage(0))
+        self.update_geometry(region)
 
-    # finish_frame is ImageTk.PhotoImage or None (if none, assume last frame)
-    def animate(self, region, finish_frame=None, reverse=False):
-        Thread(target=self._animate, args=(region, finish_frame, reverse)).start()
+    def _cancel_resize(self, region):
+        if region in self._pending_resizes:
+            self._canvas.after_cancel(self._pending_resizes.pop(region)[RESIZE_TIMER_INDEX])
 
-    def _animate(self, region, finish_frame, reverse):
+    # Frames are shared with every other canvas showing the same image at
+    # the same size and are decoded as they are needed
+    def cache_image_frames(self, shape, image_path, width=None, height=None):   
+        size = None
+        if width != None and height != None:
+            size = (width, height)
+
+        self._image_regions_images[shape] = image_frame_cache.get_shared_cache().get(
+            image_path, size)
+        self._current_frames[shape] = 0
+        self._update_image_mask(shape)
+
+        return self._image_regions_images[shape].get_photoimage(0)
+
+    # finish_frame is ImageTk.PhotoImage or None (if none, assume last frame).
+    # It is only ever the region's first frame.
+    def animate(self, region, finish_frame=None, reverse=False):
         # Don't try to animate images that have only one frame
-        if self._image_regions_images[region][DURATION_INDEX] == 0:
+        if self._image_regions_images[region].get_duration() == 0:
             return
 
-        frames = list(self._image_regions_images[region][FRAMES_INDEX])
+        # The animation is played as a list of frame indexes
+        frames = range(self._image_regions_images[region].get_frame_count())
         
-        ran_reversed = False
-        if str(self._canvas.itemcget(region, "image")) != str(self._image_regions_images[region][FIRST_PHOTOIMAGE_INDEX]):
+        if not self.is_on_first_frame(region):
             # Don't repeat a non-reversable animation if the target is on the last frame
             if not reverse:
                 return
             else:  # If it's a reversable frame and we are on the last frame, then reverse the animation
-                ran_reversed = True
                 frames.reverse()
 
-        self._play_animation(region, frames, 
-            self._image_regions_images[region][DURATION_INDEX], 0, finish_frame)
+        if finish_frame != None:
+            frames.append(0)
 
-        if reverse and ran_reversed:
-            self._image_regions_images[region] = (
-                                                    self._image_regions_images[region][DURATION_INDEX],
-                                                    self._image_regions_images[region][FIRST_IMAGE_INDEX],
-                                                    self._canvas.itemcget(region, "image"),
-                                                    self._image_regions_images[region][LAST_IMAGE_INDEX],
-                                                    self._image_regions_images[region][FRAMES_INDEX]
-                                                 )
+        self._animations.start(region, frames,
+            self._image_regions_images[region].get_duration(), self._show_frame,
+            self._animation_finished)
 
-        self._canvas.tag_lower("background")
-        self._canvas.tag_lower("visible:false", "background")
+    def cancel_animation(self, region):
+        self._animations.cancel(region)
 
-    def _play_animation(self, region, frames, delay, index, finish_frame):
-        if index == len(frames):
-            if finish_frame != None:
-                time.sleep(delay)
-                self._canvas.itemconfig(region, image=finish_frame)
+    def _show_frame(self, region, frame):
+        self._canvas.itemconfig(region, image=self._image_regions_images[region].get_photoimage(frame))
+        self._set_current_frame(region, frame)
 
-            return 
+    def _animation_finished(self, region):
+        self._canvas.tag_lower("background")
+        self._canvas.tag_lower("visible:false", "background")
 
-        self._canvas.itemconfig(region, image=frames[index])
+    def _set_current_frame(self, region, frame):
+        self._current_frames[region] = frame
+        self._update_image_mask(region)
 
-        time.sleep(delay)
-        self._play_animation(region, frames, delay, index+1, finish_frame) 
+    # Returns True if the image region is showing the first frame of its
+    # animation (or only has one frame)
+    def is_on_first_frame(self, region):
+        return self._current_frames.get(region, 0) == 0
 
-    def execute_region_commands(self, region, command_list, operations):
+    def execute_region_commands(self, region, operations):
         # Don't run commands if the region is a non-reversable image that is on the last frame
-        if ("command:reverse" not in self._canvas.gettags(region) and "_shape:image" in self._canvas.gettags(region) and 
-            str(self._canvas.itemcget(region, "image")) != str(self._image_regions_images[region][FIRST_PHOTOIMAGE_INDEX])):
+        if (not self._metadata.has_tag(region, "command:reverse") and
+            self._metadata.has_tag(region, "_shape:image") and 
+            not self.is_on_first_frame(region)):
             return
 
-        args = []
-
-        for command in command_list:
-            # Parse the command name and arguments arguments are expected to
-            # be comma separated and in between paren:
-            # command_name(arg0,arg1,...,argN)
-            pattern = r'(\w[\w\d_]*)\((.*)\)$'
-            match = re.match(pattern, command)
-            if match:
-                command = match.groups()[0]
-                if len(match.groups()) > 0:
-                    args = match.groups()[1].split(",")
+        # Commands were parsed into (command, args) tuples when the
+        # region's tags were cached
+        commands = self._metadata.get_commands(region)
 
+        for command, args in commands:
             # Run the commands
             if command == "reset":
                 operations.reset()
@@ -350,19 +350,16 @@ class CanvasManager():
 
             if command == "animate":
                 reverse = False
-                if "reverse" in command_list:
+                if ("reverse", []) in commands:
                     reverse = True
 
                 if len(args) != 0:
-                    tags = TagParser.parse_tags(self._canvas.gettags(region))
+                    internal_name = "_internal_name:" + self._metadata.get_tags(region)["_internal_name"]
 
-                    for region in self._canvas.find_withtag("name:" + args[0]):
+                    for named_region in self._canvas.find_withtag("name:" + args[0]):
                         # Animate the named region
-                        internal_name = "_internal_name:" + tags["_internal_name"]
-                        current_tags = self._canvas.gettags(region)
-
-                        if internal_name in current_tags:  
-                            self.animate(region, None, reverse)         
+                        if self._metadata.has_tag(named_region, internal_name):  
+                            self.animate(named_region, None, reverse)         
                 else:
                     self.animate(region, None, reverse)
 
@@ -378,26 +375,57 @@ class CanvasManager():
             targets.append(target_data)
 
             for region in target_regions:
-                tags = TagParser.parse_tags(
-                    self._canvas.gettags(region))
+                tags = dict(self._metadata.get_tags(region))
                 target_data["regions"].append(tags)
 
         return targets
 
-    def is_transparent_pixel(self, region, x, y):
-        bbox = self._canvas.bbox(region)
-        x = x - bbox[0]
-        y = y - bbox[1]
- 
-        if str(self._canvas.itemcget(region, "image")) == str(self._image_regions_images[region][FIRST_PHOTOIMAGE_INDEX]):
-            hit_location_color = self._image_regions_images[region][FIRST_IMAGE_INDEX].getpixel((x, y))
-        else:
-            hit_location_color = self._image_regions_images[region][LAST_IMAGE_INDEX].getpixel((x, y))
+    # Returns the index of the geometry of every target region added to
+    # this canvas, which is what shots are hit tested against
+    def get_geometry(self):
+        return self._geometry
 
-        if (type(hit_location_color) is tuple and hit_location_color[3] == 0):
-            return True
+    # Returns the geometry of every target region on the canvas that
+    # contains (x, y), topmost region first as the regions are drawn
+    def hit_test(self, x, y):
+        return self._geometry.hit_test(x, y, self._canvas.find_all())
+
+    def _region_coords(self, region):
+        # Image coords are just their anchor point, so use their bounding box
+        if self._canvas.type(region) == "image":
+            return self._canvas.bbox(region)
+
+        return self._canvas.coords(region)
+
+    # Returns the cached tags and commands of the regions on this canvas
+    def get_metadata(self):
+        return self._metadata
+
+    def _index_region(self, region):
+        tags = self._metadata.get_tags(region)
+        kind = target_geometry.shape_kind(tags["_shape"])
+
+        self._geometry.add(region, kind, self._region_coords(region), tags)
+
+        if kind == target_geometry.IMAGE:
+            self._update_image_mask(region)
 
-        return False        
+    # Updates the geometry of every region in selection after it was moved
+    # or scaled on the canvas
+    def update_geometry(self, selection):
+        for region in self._canvas.find_withtag(selection):
+            if region in self._geometry:
+                self._geometry.update_coords(region, self._region_coords(region))
+
+    # Images can only be hit on the opaque pixels of the frame they are
+    # showing. The masks are computed when the frames are cached, so this
+    # just points the region's geometry at the current frame's mask.
+    def _update_image_mask(self, region):
+        if region not in self._geometry:
+            return
+
+        self._geometry.set_mask(region, self._image_regions_images[region].get_mask(
+            self._current_frames.get(region, 0)))
 
     def is_animated(self, regions):
         for region in regions:
@@ -411,7 +439,9 @@ class CanvasManager():
         image_regions = self._canvas.find_withtag("_shape:image")
 
         for region in image_regions:
-            self._canvas.itemconfig(region, image=self._image_regions_images[region][FIRST_PHOTOIMAGE_INDEX])
+            self._animations.cancel(region)
+            self._canvas.itemconfig(region, image=self._image_regions_images[region].get_photoimage(0))
+            self._set_current_frame(region, 0)
 
     def is_background(self, selection):
         if "background" in self._canvas.gettags(selection):
@@ -419,7 +449,8 @@ class CanvasManager():
 
         return False
 
-    def add_target(self, name, image_regions_images):
+    # If position is given, the top left corner of the target is put there
+    def add_target(self, name, image_regions_images, position=None):
         # The target count is just supposed to prevent target naming collisions,
         # not keep track of how many active targets there are
         target_name = "_internal_name:target" + str(self._target_count)
@@ -427,10 +458,28 @@ class CanvasManager():
 
         target_pickler = TargetPickler()
         (region_object, regions) = target_pickler.load(
-            name, self._canvas, self, target_name)
+            name, self._canvas, self, target_name, position)
+
+        for region in regions:
+            self._index_region(region)
 
         return target_name
 
+    def delete_target(self, target_name):
+        regions = self._canvas.find_withtag(target_name)
+
+        self._canvas.delete(target_name)
+        self._geometry.remove_target(target_name)
+        self._metadata.invalidate(regions)
+
+        # Let go of the target's image frames so the frame cache can free
+        # them once they haven't been used for a while
+        for region in regions:
+            self._animations.cancel(region)
+            self._cancel_resize(region)
+            self._image_regions_images.pop(region, None)
+            self._current_frames.pop(region, None)
+
     def __init__(self, canvas, images):
         canvas.bind('<Up>', self.move_region)
         canvas.bind('<Down>', self.move_region)
@@ -447,3 +496,8 @@ class CanvasManager():
         self._selection = None
         self._target_count = 0
         self._image_regions_images = images
+        self._geometry = TargetGeometryIndex()
+        self._metadata = RegionMetadata(canvas)
+        self._current_frames = {}
+        self._animations = AnimationScheduler(canvas)
+        self._pending_resizes = {}
@@ -0,0 +1,219 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import ConfigParser
+import cv2
+import os
+import time
+
+CAPTURE_MODES_FILE = "capture_modes.conf"
+
+# Modes are tried in this order. Compressed MJPG modes come first because
+# many USB cameras can only deliver their full frame rate with them.
+CANDIDATE_MODES = (
+    (1280, 720, 60, "MJPG"),
+    (800, 600, 60, "MJPG"),
+    (640, 480, 60, "MJPG"),
+    (1280, 720, 30, "MJPG"),
+    (640, 480, 30, "MJPG"),
+    (640, 480, 60, "YUYV"),
+    (640, 480, 30, "YUYV"),
+)
+
+# Modes are (width, height, fps, fourcc) tuples, these are the indexes
+# of each value in those tuples
+WIDTH_INDEX = 0
+HEIGHT_INDEX = 1
+FPS_INDEX = 2
+FOURCC_INDEX = 3
+
+# Modes with less resolution than this are only used if nothing
+# else works. If no mode works and the camera's own mode is smaller than
+# this, the camera is asked for this resolution like it was before capture
+# modes were negotiated.
+MIN_WIDTH = 640
+MIN_HEIGHT = 480
+
+# The camera properties a mode changes, they are put back the way they were
+# if no mode works
+MODE_PROPERTIES = (cv2.cv.CV_CAP_PROP_FOURCC, cv2.cv.CV_CAP_PROP_FRAME_WIDTH,
+    cv2.cv.CV_CAP_PROP_FRAME_HEIGHT, cv2.cv.CV_CAP_PROP_FPS)
+
+PROBE_FRAMES = 15
+PROBE_TIMEOUT = 2 # s
+
+# Frame rates that are this close are considered equal, in which case the
+# mode with less pixels wins because it is cheaper to process
+FPS_TOLERANCE = 5
+
+# Picks the capture mode for a camera that gives the best detection latency.
+# Each candidate mode is applied to the camera and the frame rate the camera
+# actually delivers is measured, because drivers happily accept modes they
+# can't keep up with. The winner is cached per camera index so that probing
+# only happens the first time a camera is used.
+class CaptureModeNegotiator():
+    def __init__(self, camera, logger, modes_file=CAPTURE_MODES_FILE):
+        self._camera = camera
+        self._logger = logger
+        self._modes_file = modes_file
+        self._config = ConfigParser.SafeConfigParser()
+        self._config.read(modes_file)
+        self._section = "vidcam%d" % camera.get_vidcam()
+
+    # Applies the best capture mode to the camera and returns a
+    # (width, height, fps, fourcc) tuple describing the mode the camera is
+    # in. fps is the measured frame rate when the mode was probed. If no mode
+    # works the camera is left in its original mode and None is returned.
+    def negotiate(self, reprobe=False):
+        if not reprobe:
+            cached = self._cached_mode()
+            if cached is not None and self._apply_mode(cached[0]):
+                self._logger.debug("Using cached capture mode %dx%d@%d %s",
+                    *cached[1])
+                return cached[1]
+
+        self._logger.info("Probing capture modes for webcam %d, this only " +
+            "happens the first time a webcam is used.", self._camera.get_vidcam())
+
+        original_properties = [(prop, self._camera.get(prop))
+            for prop in MODE_PROPERTIES]
+
+        best_mode = None
+        best_requested = None
+        best_score = None
+        probed = set()
+
+        for requested in CANDIDATE_MODES:
+            if not self._apply_mode(requested):
+                continue
+
+            mode = self._current_mode(requested[FOURCC_INDEX])
+            if mode in probed:
+                continue
+            probed.add(mode)
+
+            fps = self._measure_fps()
+            if fps is None:
+                continue
+
+            self._logger.debug("Capture mode %dx%d %s delivered %.1f fps",
+                mode[WIDTH_INDEX], mode[HEIGHT_INDEX], mode[FOURCC_INDEX], fps)
+
+            score = self._score(mode, fps)
+            if best_score is None or score > best_score:
+                best_score = score
+                best_mode = (mode[WIDTH_INDEX], mode[HEIGHT_INDEX], int(round(fps)),
+                    mode[FOURCC_INDEX])
+                best_requested = requested
+
+        # Failures aren't cached so that the modes are probed again the next
+        # time the camera is used
+        if best_mode is None:
+            self._logger.warning("None of the probed capture modes worked, " +
+                "using the webcam's default mode.")
+            self._restore_default_mode(original_properties)
+            return None
+
+        # Go back to the winner, the camera is in whatever mode we tried last
+        self._apply_mode(best_requested)
+        self._cache_mode(best_requested, best_mode)
+
+        self._logger.info("Selected capture mode %dx%d@%d %s", *best_mode)
+        return best_mode
+
+    def _restore_default_mode(self, original_properties):
+        # Backends report properties they don't support as 0 or -1
+        for prop, value in original_properties:
+            if value > 0:
+                self._camera.set(prop, value)
+
+        width = self._camera.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)
+        height = self._camera.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)
+
+        if width < MIN_WIDTH and height < MIN_HEIGHT:
+            self._logger.info("Webcam %d resolution is %dx%d, attempting to " +
+                "increase it to %dx%d", self._camera.get_vidcam(), width, height,
+                MIN_WIDTH, MIN_HEIGHT)
+            self._camera.set(cv2.cv.CV_CAP_PROP_FRAME_WIDTH, MIN_WIDTH)
+            self._camera.set(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT, MIN_HEIGHT)
+
+    def _score(self, mode, fps):
+        big_enough = (mode[WIDTH_INDEX] >= MIN_WIDTH and
+            mode[HEIGHT_INDEX] >= MIN_HEIGHT)
+        return (big_enough, int(fps / FPS_TOLERANCE),
+            -mode[WIDTH_INDEX] * mode[HEIGHT_INDEX])
+
+    # Returns True if the camera accepted the mode's resolution
+    def _apply_mode(self, mode):
+        self._camera.set(cv2.cv.CV_CAP_PROP_FOURCC,
+            cv2.cv.CV_FOURCC(*mode[FOURCC_INDEX]))
+        self._camera.set(cv2.cv.CV_CAP_PROP_FRAME_WIDTH, mode[WIDTH_INDEX])
+        self._camera.set(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT, mode[HEIGHT_INDEX])
+        self._camera.set(cv2.cv.CV_CAP_PROP_FPS, mode[FPS_INDEX])
+
+        current = self._current_mode(mode[FOURCC_INDEX])
+        return (current[WIDTH_INDEX] == mode[WIDTH_INDEX] and
+            current[HEIGHT_INDEX] == mode[HEIGHT_INDEX])
+
+    # Not every backend reports the FOURCC it is using, so we go by the one
+    # we asked for
+    def _current_mode(self, fourcc):
+        return (int(self._camera.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)),
+            int(self._camera.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)), fourcc)
+
+    # Returns the frame rate the camera delivers in its current mode or None
+    # if it doesn't deliver frames at all
+    def _measure_fps(self):
+        # The first frame after a mode change is often slow while the
+        # camera reconfigures itself
+        if not self._camera.grab():
+            return None
+
+        start = time.time()
+        frames = 0
+
+        while frames < PROBE_FRAMES and time.time() - start < PROBE_TIMEOUT:
+            if self._camera.grab():
+                frames += 1
+
+        elapsed = time.time() - start
+        if frames == 0 or elapsed == 0:
+            return None
+
+        return frames / elapsed
+
+    # Returns a (requested_mode, mode) tuple where requested_mode is what
+    # has to be applied to the camera and mode has the measured frame rate
+    def _cached_mode(self):
+        if not self._config.has_section(self._section):
+            return None
+
+        try:
+            requested = (self._config.getint(self._section, "width"),
+                self._config.getint(self._section, "height"),
+                self._config.getint(self._section, "fps"),
+                self._config.get(self._section, "fourcc"))
+            measured_fps = self._config.getint(self._section, "measuredfps")
+        except (ConfigParser.NoOptionError, ValueError):
+            return None
+
+        return (requested, requested[:FPS_INDEX] + (measured_fps,) +
+            requested[FOURCC_INDEX:])
+
+    def _cache_mode(self, requested, mode):
+        if not self._config.has_section(self._section):
+            self._config.add_section(self._section)
+
+        self._config.set(self._section, "width", str(requested[WIDTH_INDEX]))
+        self._config.set(self._section, "height", str(requested[HEIGHT_INDEX]))
+        self._config.set(self._section, "fps", str(requested[FPS_INDEX]))
+        self._config.set(self._section, "fourcc", requested[FOURCC_INDEX])
+        self._config.set(self._section, "measuredfps", str(mode[FPS_INDEX]))
+
+        try:
+            with open(self._modes_file, "w") as modes_file:
+                self._config.write(modes_file)
+        except IOError:
+            self._logger.warning("Couldn't save the capture mode cache to %s",
+                os.path.abspath(self._modes_file))
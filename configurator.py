@@ -1,18 +1,27 @@
 import argparse
+import laser_color
 import logging
 from preferences_editor import PreferencesEditor
 import sys
 
 DEBUG = "debug"
 DETECTION_RATE = "detectionrate" #ms
+DISPLAY_RATE = "displayrate" #ms
+FRAME_DRIVEN_DETECTION = "framedrivendetection"
+BACKGROUND_SUBTRACTION = "backgroundsubtraction"
+DETECTION_PROCESSES = "detectionprocesses" # 0 == detect on threads
 LASER_INTENSITY = "laserintensity"
 MARKER_RADIUS = "markerradius"
 IGNORE_LASER_COLOR = "ignorelasercolor"
+LASER_COLOR_CLASSIFIER = "lasercolorclassifier"
 USE_VIRTUAL_MAGAZINE = "usevirtualmagazine"
 VIRTUAL_MAGAZINE = "virtualmagazine"
 USE_MALFUNCTIONS = "usemalfunctions"
 MALFUNCTION_PROBABILITY = "malfunctionprobability"
 VIDCAM = "vidcam" # first detected == 0
+EXTRA_VIDCAMS = "extravidcams" # comma separated list
+MAX_VIDCAM = 15
+PROBE_CAMERA = "probecamera"
 
 class Configurator():
     def _check_rate(self, rate):
@@ -22,6 +31,20 @@ class Configurator():
                 "greater than 0")
         return value  
 
+    def _check_display_rate(self, rate):
+        value = int(rate)
+        if value < 1:
+            raise argparse.ArgumentTypeError("DISPLAY_RATE must be a number " +
+                "greater than 0")
+        return value
+
+    def _check_processes(self, processes):
+        value = int(processes)
+        if value < 0:
+            raise argparse.ArgumentTypeError("DETECTION_PROCESSES must be a " +
+                "number greater than or equal to 0")
+        return value
+
     def _check_intensity(self, intensity):
         value = int(intensity)
         if value < 1 or value > 255:
@@ -38,18 +61,37 @@ class Configurator():
         
     def _check_vidcam(self, vidcam):
         value = int(vidcam)
-        if value < 0 or value > 2:
+        if value < 0 or value > MAX_VIDCAM:
             raise argparse.ArgumentTypeError("VIDCAM must be a number " +
-                "between 0 and 2")
+                "between 0 and %d" % MAX_VIDCAM)
         return value
 
+    def _check_extra_vidcams(self, vidcams):
+        try:
+            values = parse_vidcams(vidcams)
+        except ValueError:
+            raise argparse.ArgumentTypeError("EXTRA_VIDCAMS must be a comma " +
+                "separated list of numbers")
+
+        for value in values:
+            self._check_vidcam(value)
+        return values
+
     def _check_ignore_laser_color(self, ignore_laser_color):
         ignore_laser_color = ignore_laser_color.lower()
-        if ignore_laser_color != "red" and ignore_laser_color != "green":
+        if (ignore_laser_color != "red" and ignore_laser_color != "green" and
+            ignore_laser_color != "blue"):
             raise argparse.ArgumentTypeError("IGNORE_LASER_COLOR must be a string " +
-                "equal to either \"green\" or \"red\" without quotes")
+                "equal to either \"green\", \"red\", or \"blue\" without quotes")
         return ignore_laser_color  
 
+    def _check_laser_color_classifier(self, classifier):
+        classifier = classifier.lower()
+        if classifier not in laser_color.CLASSIFIERS:
+            raise argparse.ArgumentTypeError("LASER_COLOR_CLASSIFIER must be " +
+                "one of: " + ", ".join(laser_color.CLASSIFIERS))
+        return classifier
+
     def _check_virtual_magazine(self, virtual_magazine):
         value = int(virtual_magazine)
         if value < 1 or value > 45:
@@ -77,8 +119,24 @@ class Configurator():
             help="turn on debug log messages")
         parser.add_argument("-r", "--detection-rate", type=self._check_rate,
             help="sets the rate at which shots are detected in milliseconds. " +
-                "this should be set to about the length of time your laser trainer " +
-                "stays on for each shot, typically about 100 ms")
+                "lasers are tracked between detections so a laser that stays on " +
+                "is only counted once; this should be shorter than the length of " +
+                "time your laser trainer stays on for each shot")
+        parser.add_argument("-s", "--display-rate", type=self._check_display_rate,
+            help="sets how often the webcam feed is redrawn in milliseconds. " +
+                "this doesn't affect shot detection, so it can be set higher " +
+                "than the detection rate to save CPU time")
+        parser.add_argument("-e", "--frame-driven-detection", action="store_true",
+            help="detect shots on every frame the webcam captures instead of " +
+                "polling for them at the detection rate")
+        parser.add_argument("-b", "--background-subtraction", action="store_true",
+            help="detect lasers by how much brighter they are than a running " +
+                "average of the feed instead of with a fixed intensity threshold. " +
+                "use this when there is glare or bright light on the feed")
+        parser.add_argument("-w", "--detection-processes", type=self._check_processes,
+            help="detect shots on every frame using this many worker processes " +
+                "so that detection can use more than one CPU core. 0 detects " +
+                "shots on threads in the main process (the default)")
         parser.add_argument("-i", "--laser-intensity", type=self._check_intensity, 
             help="sets the intensity threshold for detecting the laser [1,255]. " +
                 "this should be as high as you can set it while still detecting " +
@@ -86,11 +144,25 @@ class Configurator():
         parser.add_argument("-m", "--marker-radius", type=self._check_radius,
             help="sets the radius of shot markers in pixels [1,20]")
         parser.add_argument("-v", "--vidcam", type=self._check_vidcam,
-            help="sets video camera to use [0,2]")
+            help="sets video camera to use [0,%d]" % MAX_VIDCAM)
+        parser.add_argument("-x", "--extra-vidcams", type=self._check_extra_vidcams,
+            help="sets a comma separated list of additional video cameras " +
+                "(e.g. one per lane) to detect shots on")
+        parser.add_argument("-p", "--probe-camera", action="store_true",
+            help="ignore the cached capture mode for the video camera and probe " +
+                "its resolutions and frame rates again")
+        # startup_profiler reads this flag from sys.argv itself so that it can
+        # time imports, it is only here so that argparse accepts it
+        parser.add_argument("--profile-startup", action="store_true",
+            help="log how long each import and stage of startup takes")
         parser.add_argument("-c", "--ignore-laser-color",
             type=self._check_ignore_laser_color,
-            help="sets the color of laser that should be ignored by ShootOFF (green " +
-                "or red). No color is ignored by default")
+            help="sets the color of laser that should be ignored by ShootOFF (green, " +
+                "red, or blue). No color is ignored by default")
+        parser.add_argument("-l", "--laser-color-classifier",
+            type=self._check_laser_color_classifier,
+            help="sets how laser colors are recognized: ratio (default), hsv, " +
+                "or lookup (uses a color table trained for the camera)")
         parser.add_argument("-u", "--use-virtual-magazine",
             type=self._check_virtual_magazine,
             help="turns on the virtual magazine and sets the number rounds it holds")
@@ -101,10 +173,23 @@ class Configurator():
         args = parser.parse_args()
 
         preferences[DEBUG] = args.debug
+        preferences[PROBE_CAMERA] = args.probe_camera
 
         if args.detection_rate:
             preferences[DETECTION_RATE] = int(args.detection_rate)
 
+        if args.display_rate:
+            preferences[DISPLAY_RATE] = int(args.display_rate)
+
+        if args.frame_driven_detection:
+            preferences[FRAME_DRIVEN_DETECTION] = True
+
+        if args.background_subtraction:
+            preferences[BACKGROUND_SUBTRACTION] = True
+
+        if args.detection_processes is not None:
+            preferences[DETECTION_PROCESSES] = args.detection_processes
+
         if args.laser_intensity:
             preferences[LASER_INTENSITY] = int(args.laser_intensity)
 
@@ -114,9 +199,15 @@ class Configurator():
         if args.vidcam >= 0:
             preferences[VIDCAM] = int(args.vidcam)
 
+        if args.extra_vidcams is not None:
+            preferences[EXTRA_VIDCAMS] = args.extra_vidcams
+
         if args.ignore_laser_color:
             preferences[IGNORE_LASER_COLOR] = args.ignore_laser_color
 
+        if args.laser_color_classifier:
+            preferences[LASER_COLOR_CLASSIFIER] = args.laser_color_classifier
+
         if args.use_virtual_magazine:
             preferences[USE_VIRTUAL_MAGAZINE] = True
             preferences[VIRTUAL_MAGAZINE] = int(args.use_virtual_magazine)
@@ -155,3 +246,7 @@ class Configurator():
         logger.addHandler(stdhandler)
 
         return logger
+
+# Turns a comma separated string of video camera indexes into a list
+def parse_vidcams(vidcams):
+    return [int(vidcam) for vidcam in vidcams.split(",") if vidcam.strip()]
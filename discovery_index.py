@@ -0,0 +1,132 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import imp
+import json
+import logging
+import os
+
+DEFAULT_INDEX_PATH = "discovery_index.json"
+INDEX_VERSION = 1
+
+TARGET_DIRS = ("targets",)
+ANIMATED_TARGET_DIRS = ("animated_targets",)
+PROTOCOLS_DIR = "training_protocols"
+
+# Finds the targets and training protocols that can be picked from the menus.
+# What was found is saved between runs along with the modification times it
+# was found at, so targets are only listed again when a target directory
+# changes and protocols are only imported to get their info when they
+# change. Otherwise protocols are not imported until they are loaded.
+class DiscoveryIndex():
+    def __init__(self, index_path=DEFAULT_INDEX_PATH):
+        self._index_path = index_path
+        self._logger = logging.getLogger("shootoff")
+        self._dirty = False
+
+        self._index = self._read_index()
+        if self._index is None:
+            self._index = {"version": INDEX_VERSION, "targets": {}, "protocols": {}}
+            self._dirty = True
+
+    def _read_index(self):
+        if not os.path.isfile(self._index_path):
+            return None
+
+        try:
+            with open(self._index_path, "r") as index_file:
+                index = json.load(index_file)
+        except (IOError, ValueError) as e:
+            self._logger.debug("Ignoring unreadable discovery index: %s", e)
+            return None
+
+        if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+            return None
+
+        return index
+
+    # Returns the paths of every target file, optionally including the
+    # animated ones
+    def get_targets(self, include_animated=False):
+        target_dirs = TARGET_DIRS
+        if include_animated:
+            target_dirs += ANIMATED_TARGET_DIRS
+
+        targets = []
+        for target_dir in target_dirs:
+            targets.extend(self._list_targets(target_dir))
+
+        return targets
+
+    def _list_targets(self, target_dir):
+        if not os.path.isdir(target_dir):
+            return []
+
+        # Adding, removing, or renaming a target changes its
+        # directory's modification time
+        mtime = os.path.getmtime(target_dir)
+        entry = self._index["targets"].get(target_dir)
+
+        if entry is None or entry["mtime"] != mtime:
+            files = sorted([os.path.join(target_dir, name)
+                for name in os.listdir(target_dir) if name.endswith(".target")])
+            entry = {"mtime": mtime, "files": files}
+            self._index["targets"][target_dir] = entry
+            self._dirty = True
+
+        return entry["files"]
+
+    # Returns a (location, info) tuple for every training protocol, where
+    # info is the dictionary returned by the protocol's get_info()
+    def get_protocols(self):
+        protocols = []
+        found = set()
+
+        for candidate in os.listdir(PROTOCOLS_DIR):
+            location = os.path.join(PROTOCOLS_DIR, candidate)
+            init_path = os.path.join(location, "__init__.py")
+            if not os.path.isfile(init_path):
+                continue
+
+            found.add(location)
+            mtime = os.path.getmtime(init_path)
+            entry = self._index["protocols"].get(location)
+
+            if entry is None or entry["mtime"] != mtime:
+                entry = {"mtime": mtime, "info": load_protocol(location).get_info()}
+                self._index["protocols"][location] = entry
+                self._dirty = True
+
+            protocols.append((location, entry["info"]))
+
+        # Forget protocols that were removed
+        for location in self._index["protocols"].keys():
+            if location not in found:
+                del self._index["protocols"][location]
+                self._dirty = True
+
+        return protocols
+
+    # Writes the index if anything in it changed. Failing to write it only
+    # means things will have to be discovered again on the next run.
+    def save(self):
+        if not self._dirty:
+            return
+
+        try:
+            with open(self._index_path, "w") as index_file:
+                json.dump(self._index, index_file)
+            self._dirty = False
+        except (IOError, TypeError, ValueError) as e:
+            self._logger.debug("Failed to save the discovery index: %s", e)
+
+# Imports and returns the training protocol module at location
+def load_protocol(location):
+    plugin_info = imp.find_module("__init__", [location])
+
+    try:
+        return imp.load_module("__init__", *plugin_info)
+    finally:
+        if plugin_info[0] is not None:
+            plugin_info[0].close()
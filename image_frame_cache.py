@@ -0,0 +1,241 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import collections
+import numpy
+from PIL import Image, ImageTk
+from threading import RLock
+import weakref
+
+# Roughly how much memory the decoded frames of recently used images may use
+# before the least recently used ones are dropped from the cache
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024 # bytes
+
+DEFAULT_FRAME_DELAY = .1 # s
+
+# Each decoded frame is kept as a PIL image, a Tk image, and an alpha mask
+BYTES_PER_PIXEL = 4 + 4 + 1
+
+# Returns a 2D array that is True for every opaque pixel in image or None if
+# the image has no alpha channel (all of its pixels are opaque)
+def alpha_mask(image):
+    if image.mode != "RGBA":
+        return None
+
+    return numpy.array(image.split()[3]) > 0
+
+# The frames of one image file at one size. Frames are only decoded when they
+# are first asked for, and animated images are decoded in order because each
+# frame is drawn on top of the previous ones.
+#
+# source is the ImageFrames of the same file at its own size. When it is
+# given, frames are scaled from the source's decoded frames instead of
+# decoding the file again.
+class ImageFrames():
+    def __init__(self, path, size=None, source=None):
+        self._path = path
+        self._size = size
+        self._source = source
+        self._lock = RLock()
+        self._frame_count = None
+        self._composite = None
+        self._frames = []
+        self._photoimages = []
+        self._masks = []
+
+        if source is not None:
+            self._image = None
+            self._animated = source.get_duration() != 0
+            self._duration = source.get_duration()
+            return
+
+        self._image = Image.open(path)
+
+        # Single frame images are used as they are, animated ones are
+        # converted to RGBA
+        try:
+            self._image.seek(1)
+            self._animated = True
+        except EOFError:
+            self._animated = False
+        self._image.seek(0)
+
+        self._duration = 0
+        if self._animated:
+            self._duration = DEFAULT_FRAME_DELAY
+            if self._image.info.get("duration", 0) != 0:
+                self._duration = float(self._image.info["duration"]) / 1000.0
+
+    def get_path(self):
+        return self._path
+
+    # Returns the delay between frames in seconds or 0 if the image isn't
+    # animated
+    def get_duration(self):
+        return self._duration
+
+    def get_frame_count(self):
+        if self._source is not None:
+            return self._source.get_frame_count()
+
+        with self._lock:
+            if self._frame_count is None:
+                if not self._animated:
+                    self._frame_count = 1
+                else:
+                    self._frame_count = getattr(self._image, "n_frames", None)
+
+                    # Older versions of PIL can only count frames by
+                    # decoding all of them
+                    if self._frame_count is None:
+                        self._decode(None)
+
+            return self._frame_count
+
+    # Returns the PIL image of a frame
+    def get_frame(self, index):
+        self._decode(index)
+        return self._frames[index]
+
+    def get_photoimage(self, index):
+        with self._lock:
+            self._decode(index)
+
+            while len(self._photoimages) <= index:
+                self._photoimages.append(ImageTk.PhotoImage(
+                    self._frames[len(self._photoimages)]))
+
+            return self._photoimages[index]
+
+    def get_mask(self, index):
+        self._decode(index)
+        return self._masks[index]
+
+    # Returns a Tk image of a frame quickly scaled to size. Previews aren't
+    # kept, they are only meant to be shown while a region is being resized.
+    def get_preview(self, index, size):
+        return ImageTk.PhotoImage(self.get_frame(index).resize(size, Image.NEAREST))
+
+    # Returns roughly how many bytes the decoded frames use
+    def get_memory_use(self):
+        if not self._frames:
+            return 0
+
+        width, height = self._frames[0].size
+        return len(self._frames) * width * height * BYTES_PER_PIXEL
+
+    # Decodes frames up to and including index, or every frame if index
+    # is None
+    def _decode(self, index):
+        with self._lock:
+            if self._source is not None:
+                self._scale(index)
+                return
+
+            if self._image is None:
+                if index is not None and index >= len(self._frames):
+                    raise IndexError("%s only has %d frames" %
+                        (self._path, len(self._frames)))
+                return
+
+            while index is None or len(self._frames) <= index:
+                if len(self._frames) > 0:
+                    try:
+                        self._image.seek(len(self._frames))
+                    except EOFError:
+                        self._frame_count = len(self._frames)
+                        self._image = None
+                        if index is None:
+                            return
+                        raise IndexError("%s only has %d frames" %
+                            (self._path, self._frame_count))
+
+                frame = self._image.copy()
+                if self._size is not None:
+                    frame = frame.resize(self._size, Image.NEAREST)
+
+                if self._animated:
+                    if self._composite is None:
+                        self._composite = frame
+                    else:
+                        self._composite.paste(frame)
+                    frame = self._composite.convert("RGBA")
+
+                self._frames.append(frame)
+                self._masks.append(alpha_mask(frame))
+
+                if not self._animated:
+                    self._frame_count = 1
+
+                # The file isn't needed once every frame is decoded
+                if len(self._frames) == self._frame_count:
+                    self._image = None
+                    return
+
+    # Scales the source's frames up to and including index, or every frame
+    # if index is None. The source raises IndexError for missing frames.
+    def _scale(self, index):
+        if index is None:
+            index = self._source.get_frame_count() - 1
+
+        while len(self._frames) <= index:
+            frame = self._source.get_frame(len(self._frames)).resize(self._size,
+                Image.ANTIALIAS)
+
+            self._frames.append(frame)
+            self._masks.append(alpha_mask(frame))
+
+# A process-wide cache of image frames keyed by (path, size) so that every
+# canvas showing the same image at the same size shares one copy of its
+# frames. The cache keeps recently used images around even when nothing
+# shows them until the memory budget is used up. Images that are still in
+# use on a canvas are never freed, but they are shared with anyone else who
+# asks for them.
+class ImageFrameCache():
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self._memory_budget = memory_budget
+        self._lock = RLock()
+        self._recent = collections.OrderedDict()
+        self._live = weakref.WeakValueDictionary()
+
+    # size is a (width, height) tuple or None for the image's own size
+    def get(self, path, size=None):
+        key = (path, size)
+
+        with self._lock:
+            frames = self._live.get(key)
+
+            if frames is None:
+                # Scaled frames are made from the image at its own size, so
+                # resizing a region never reads the file again
+                source = None
+                if size is not None:
+                    source = self.get(path)
+
+                frames = ImageFrames(path, size, source)
+                self._live[key] = frames
+
+            self._recent.pop(key, None)
+            self._recent[key] = frames
+            self._evict()
+
+            return frames
+
+    def _evict(self):
+        memory_use = sum(frames.get_memory_use() for frames in self._recent.values())
+
+        # Always keep the image that was just asked for
+        while memory_use > self._memory_budget and len(self._recent) > 1:
+            key, frames = self._recent.popitem(last=False)
+            memory_use -= frames.get_memory_use()
+
+_shared_cache = None
+
+def get_shared_cache():
+    global _shared_cache
+
+    if _shared_cache is None:
+        _shared_cache = ImageFrameCache()
+
+    return _shared_cache
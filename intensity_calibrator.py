@@ -0,0 +1,210 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import cv2
+import numpy
+from threading import Thread
+import time
+
+IDLE_SAMPLE_TIME = 3 # s
+CALIBRATION_SHOTS = 3
+SHOT_TIMEOUT = 30 # s
+
+# The idle brightness is the brightness this percentage of the idle pixels
+# are at or below, so a few hot pixels or a small reflection don't push it up
+# to the brightest pixel in the feed
+IDLE_PERCENTILE = 99.9
+
+# The dimmest shot has to be at least this much brighter than the idle
+# brightness for a threshold to be picked
+MIN_MARGIN = 10
+
+FRAME_WAIT_TIMEOUT = .5 # s
+
+SAMPLING_IDLE = 0
+WAITING_FOR_SHOTS = 1
+FINISHED = 2
+FAILED = 3
+
+# Finds a laser intensity threshold for the current lighting. The calibrator
+# first builds a histogram of the brightness of every pixel in the feed for
+# IDLE_SAMPLE_TIME seconds while no laser is on, then waits for the user to
+# fire CALIBRATION_SHOTS shots and records how bright each one was. The
+# threshold is put halfway between the idle brightness (see IDLE_PERCENTILE)
+# and the dimmest shot. Pixels that were already that bright while idle are
+# ignored when looking for shots. Calibration runs on its own thread; the Tk
+# loop polls get_state.
+#
+# If collect_color_samples is True, the brightest frame of every shot is kept
+# along with where its brightest pixel was so that a laser color lookup
+# table can be trained on the shots.
+class IntensityCalibrator():
+    def __init__(self, ring_buffer, logger, collect_color_samples=False):
+        self._ring_buffer = ring_buffer
+        self._logger = logger
+        self._collect_color_samples = collect_color_samples
+        self._color_samples = []
+        self._state = SAMPLING_IDLE
+        self._histogram = numpy.zeros((256, 1), numpy.float32)
+        self._idle_level = 0
+        self._idle_brightest = None
+        self._shot_mask = None
+        self._shot_peaks = []
+        self._threshold = None
+        self._failure = None
+        self._shutdown = False
+        self._calibration_thread = None
+
+    def start(self):
+        self._calibration_thread = Thread(target=self._calibration_loop,
+            name="intensity_calibration_thread")
+        self._calibration_thread.daemon = True
+        self._calibration_thread.start()
+
+    def stop(self):
+        self._shutdown = True
+
+        if self._calibration_thread is not None:
+            self._calibration_thread.join()
+            self._calibration_thread = None
+
+    def get_state(self):
+        return self._state
+
+    def get_shot_count(self):
+        return len(self._shot_peaks)
+
+    def get_threshold(self):
+        return self._threshold
+
+    # Returns a (frame, x, y) tuple for every shot where (x, y) is the
+    # brightest pixel of the shot's brightest frame
+    def get_color_samples(self):
+        return self._color_samples
+
+    # Returns a message explaining why calibration failed
+    def get_failure(self):
+        return self._failure
+
+    def _calibration_loop(self):
+        next_sequence = self._ring_buffer.get_latest_sequence() + 1
+        state_start = time.time()
+        pulse_peak = None
+
+        while not self._shutdown and self._state < FINISHED:
+            latest_sequence = self._ring_buffer.wait_for(next_sequence,
+                FRAME_WAIT_TIMEOUT)
+
+            if latest_sequence >= next_sequence:
+                # Skip frames the camera has already overwritten
+                next_sequence = max(next_sequence,
+                    latest_sequence - self._ring_buffer.get_size() + 1)
+                frame = self._ring_buffer.get(next_sequence)
+                next_sequence += 1
+
+                if frame is not None:
+                    gray = cv2.cvtColor(frame[1], cv2.cv.CV_BGR2GRAY)
+
+                    if self._state == SAMPLING_IDLE:
+                        self._sample_idle(gray)
+                    else:
+                        pulse_peak = self._sample_shot(frame[1], gray, pulse_peak)
+
+            if self._state == SAMPLING_IDLE:
+                if time.time() - state_start >= IDLE_SAMPLE_TIME:
+                    self._finish_idle_sampling()
+                    state_start = time.time()
+            elif self._state == WAITING_FOR_SHOTS:
+                if len(self._shot_peaks) >= CALIBRATION_SHOTS:
+                    self._pick_threshold()
+                elif time.time() - state_start >= SHOT_TIMEOUT:
+                    self._fail("Only %d of %d shots were seen. They may not be bright " %
+                        (len(self._shot_peaks), CALIBRATION_SHOTS) +
+                        "enough to tell apart from the rest of the feed.")
+
+    # Adds a frame to the idle histogram and remembers how bright every pixel
+    # has been while idle
+    def _sample_idle(self, gray):
+        self._histogram += cv2.calcHist([gray], [0], None, [256], [0, 256])
+
+        if self._idle_brightest is None:
+            self._idle_brightest = gray.copy()
+        else:
+            numpy.maximum(self._idle_brightest, gray, self._idle_brightest)
+
+    def _finish_idle_sampling(self):
+        cumulative = numpy.cumsum(self._histogram[:, 0])
+
+        if cumulative[-1] == 0:
+            self._fail("No frames were received from the webcam.")
+            return
+
+        self._idle_level = int(numpy.searchsorted(cumulative,
+            cumulative[-1] * IDLE_PERCENTILE / 100))
+        self._logger.debug("Idle brightness during laser intensity calibration " +
+            "was %d (brightest idle pixel was %d).", self._idle_level,
+            int(self._idle_brightest.max()))
+
+        # Only pixels that stayed clearly dimmer than a shot while idle can
+        # be part of a shot
+        self._shot_mask = cv2.threshold(self._idle_brightest,
+            self._idle_level + MIN_MARGIN - 1, 255, cv2.THRESH_BINARY_INV)[1]
+
+        if self._idle_level + MIN_MARGIN > 255:
+            self._fail("Part of the feed is saturated even without a laser, so " +
+                "no intensity threshold can separate shots from it. Try " +
+                "background subtraction instead.")
+            return
+
+        self._state = WAITING_FOR_SHOTS
+
+    # A shot is any frame with a pixel clearly brighter than the idle
+    # brightness that wasn't that bright while idle. Shots last several frames, so we remember the brightest
+    # frame of the shot and record it when the laser goes off again. pulse_peak
+    # is a (peak, color_sample) tuple for the shot in progress, color_sample
+    # is None unless color samples are being collected.
+    def _sample_shot(self, frame, gray, pulse_peak):
+        min_value, peak, min_location, peak_location = cv2.minMaxLoc(gray,
+            self._shot_mask)
+        peak = int(peak)
+
+        if peak >= self._idle_level + MIN_MARGIN:
+            if pulse_peak is not None and pulse_peak[0] >= peak:
+                return pulse_peak
+
+            color_sample = None
+            if self._collect_color_samples:
+                # The ring buffer reuses its frames
+                color_sample = (frame.copy(),) + peak_location
+
+            return (peak, color_sample)
+
+        if pulse_peak is not None:
+            self._shot_peaks.append(pulse_peak[0])
+            if pulse_peak[1] is not None:
+                self._color_samples.append(pulse_peak[1])
+
+            self._logger.debug("Laser intensity calibration shot %d peaked at %d.",
+                len(self._shot_peaks), pulse_peak[0])
+
+        return None
+
+    def _pick_threshold(self):
+        shot_min = min(self._shot_peaks)
+
+        if shot_min - self._idle_level < MIN_MARGIN:
+            self._fail("The shots weren't bright enough to tell apart from the " +
+                "rest of the feed.")
+            return
+
+        self._threshold = min(max(self._idle_level + (shot_min - self._idle_level) / 2, 1), 255)
+        self._state = FINISHED
+
+        self._logger.info("Calibrated laser intensity to %d (idle brightness " +
+            "was %d, dimmest shot was %d).", self._threshold, self._idle_level, shot_min)
+
+    def _fail(self, failure):
+        self._failure = failure
+        self._state = FAILED
+        self._logger.warning("Laser intensity calibration failed: %s", failure)
@@ -0,0 +1,198 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import cv2
+import logging
+import numpy
+import os
+
+RATIO_CLASSIFIER = "ratio"
+HSV_CLASSIFIER = "hsv"
+LOOKUP_CLASSIFIER = "lookup"
+CLASSIFIERS = (RATIO_CLASSIFIER, HSV_CLASSIFIER, LOOKUP_CLASSIFIER)
+
+# The colors a laser can be classified as. These double as the Tk color
+# used for the shot's marker.
+LASER_COLORS = ("red", "green2", "blue")
+
+NO_COLOR = (None, 0.0)
+
+# Every classifier looks at a small window of the BGR webcam frame around a
+# shot (roi) and a mask that says which of the window's pixels belong to the
+# sample. classify returns a (laser_color, confidence) tuple where confidence
+# is between 0 and 1, or NO_COLOR if the sample doesn't look like a laser.
+# Results with a confidence below get_min_confidence() shouldn't be treated
+# as shots.
+
+# The original heuristic: average the sample and look for a component that is
+# at least 2% bigger than the others.
+class RatioClassifier():
+    # Ratio at which a sample is considered to be a certain match
+    FULL_CONFIDENCE_RATIO = 1.5
+
+    # Anything that passes the 2% test is a laser
+    def get_min_confidence(self):
+        return 0.0
+
+    def classify(self, roi, mask):
+        mean_color = cv2.mean(roi, mask)
+
+        # Remember that the frame is in BGR
+        r = mean_color[2]
+        g = mean_color[1]
+        b = mean_color[0]
+
+        # We only detect a color if the largest component is at least
+        # 2% bigger than the other components. This is based on the
+        # heuristic that noise tends to have color values that are very
+        # similar
+        if (g == 0 or b == 0):
+            return NO_COLOR
+
+        if (r / g) > 1.02 and (r / b) > 1.02:
+            return ("red", self._confidence(min(r / g, r / b)))
+
+        if (r == 0 or b == 0):
+            return NO_COLOR
+
+        if (g / r) > 1.02 and (g / b) > 1.02:
+            return ("green2", self._confidence(min(g / r, g / b)))
+
+        return NO_COLOR
+
+    def _confidence(self, ratio):
+        return min((ratio - 1.02) / (self.FULL_CONFIDENCE_RATIO - 1.02), 1.0)
+
+# Votes on the hue of every sufficiently saturated pixel in the sample. The
+# center of a laser dot is usually washed out to white, so only the halo
+# around it carries the color. Confidence is the fraction of saturated pixels
+# that fell in the winning hue range.
+class HSVClassifier():
+    # Hue ranges use OpenCV's 0-179 hue scale. Red wraps around 0.
+    HUE_RANGES = {
+        "red": ((0, 10), (170, 179)),
+        "green2": ((40, 90),),
+        "blue": ((100, 130),),
+    }
+    MIN_SATURATION = 60
+    MIN_VALUE = 60
+
+    def get_min_confidence(self):
+        return .5
+
+    def classify(self, roi, mask):
+        hsv = cv2.cvtColor(roi, cv2.cv.CV_BGR2HSV)
+
+        colored = ((mask > 0) & (hsv[:, :, 1] >= self.MIN_SATURATION) &
+            (hsv[:, :, 2] >= self.MIN_VALUE))
+        hues = hsv[:, :, 0][colored]
+
+        if hues.size == 0:
+            return NO_COLOR
+
+        best_color = None
+        best_votes = 0
+        for color, ranges in self.HUE_RANGES.items():
+            votes = 0
+            for low, high in ranges:
+                votes += numpy.count_nonzero((hues >= low) & (hues <= high))
+
+            if votes > best_votes:
+                best_color = color
+                best_votes = votes
+
+        if best_color is None:
+            return NO_COLOR
+
+        return (best_color, float(best_votes) / hues.size)
+
+# A color lookup table trained on samples from a specific camera. Pixels are
+# quantized into LEVELS^3 (b, g, r) bins and every bin remembers how many
+# training pixels of each laser color landed in it. Classification sums the
+# votes of the sample's pixels. Until the table has been trained (or if the
+# table file can't be read) the ratio classifier is used instead.
+class LookupClassifier():
+    LEVELS = 32
+
+    def __init__(self, table_file=None):
+        self._table_file = table_file
+        self._votes = None
+        self._fallback = RatioClassifier()
+
+        if table_file is not None and os.path.isfile(table_file):
+            self._votes = self._load(table_file)
+
+    # Returns the table stored in table_file or None if it can't be read
+    def _load(self, table_file):
+        try:
+            votes = numpy.load(table_file)
+
+            if (not isinstance(votes, numpy.ndarray) or
+                votes.shape != (len(LASER_COLORS), self.LEVELS ** 3)):
+
+                raise ValueError("not a %d color lookup table" % len(LASER_COLORS))
+        except (IOError, EOFError, ValueError) as e:
+            logging.getLogger("shootoff").warning("Ignoring the unreadable laser " +
+                "color lookup table %s, the ratio classifier will be used until " +
+                "it is trained again: %s", table_file, e)
+            return None
+
+        return votes.astype(numpy.uint32)
+
+    def is_trained(self):
+        return self._votes is not None
+
+    def get_min_confidence(self):
+        if self._votes is None:
+            return self._fallback.get_min_confidence()
+
+        return .5
+
+    # Returns the flattened table bin of every masked pixel in roi
+    def _bins(self, roi, mask):
+        pixels = (roi[mask > 0] / (256 / self.LEVELS)).astype(numpy.intp)
+        return ((pixels[:, 0] * self.LEVELS + pixels[:, 1]) * self.LEVELS +
+            pixels[:, 2])
+
+    # Add the masked pixels in roi to the table as examples of laser_color
+    def train(self, laser_color, roi, mask):
+        if self._votes is None:
+            self._votes = numpy.zeros((len(LASER_COLORS), self.LEVELS ** 3),
+                numpy.uint32)
+
+        self._votes[LASER_COLORS.index(laser_color)] += numpy.bincount(
+            self._bins(roi, mask), minlength=self.LEVELS ** 3).astype(numpy.uint32)
+
+    def save(self, table_file=None):
+        if table_file is None:
+            table_file = self._table_file
+
+        # numpy.save appends .npy if we give it a file name
+        with open(table_file, "wb") as table:
+            numpy.save(table, self._votes)
+
+    def classify(self, roi, mask):
+        if self._votes is None:
+            return self._fallback.classify(roi, mask)
+
+        votes = self._votes[:, self._bins(roi, mask)].sum(axis=1)
+        total = votes.sum()
+
+        if total == 0:
+            return NO_COLOR
+
+        best = votes.argmax()
+        return (LASER_COLORS[best], float(votes[best]) / total)
+
+# Returns the lookup table file used for the given camera
+def lookup_table_file(vidcam):
+    return "laser_colors_%d.lut" % vidcam
+
+def make_classifier(name, vidcam=0):
+    if name == HSV_CLASSIFIER:
+        return HSVClassifier()
+    elif name == LOOKUP_CLASSIFIER:
+        return LookupClassifier(lookup_table_file(vidcam))
+    else:
+        return RatioClassifier()
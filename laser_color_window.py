@@ -0,0 +1,53 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from laser_color import LASER_COLORS
+import Tkinter, ttk
+
+# The label shown for each of the laser colors the detector can tell apart
+LASER_COLOR_LABELS = ("Red", "Green", "Blue")
+
+# Asks which color the laser that is about to be fired is. The color is
+# passed to notifycolor when OK is clicked, nothing is passed if the window
+# is closed instead.
+class LaserColorWindow():
+    def _ok_click(self):
+        self._notify_color(self._color.get())
+        self.destroy()
+
+    def destroy(self):
+        self._window.destroy()
+
+    def build_gui(self, parent):
+        self._window = Tkinter.Toplevel(parent)
+        self._window.transient(parent)
+        self._window.title("Laser Color")
+
+        label = Tkinter.Label(self._window, text="What color is your laser?")
+        label.grid(row=0, column=0, sticky="w")
+
+        self._color = Tkinter.StringVar()
+        self._color.set(LASER_COLORS[0])
+
+        for row, color in enumerate(LASER_COLORS, 1):
+            button = ttk.Radiobutton(self._window,
+                text=LASER_COLOR_LABELS[row - 1], variable=self._color, value=color)
+            button.grid(row=row, column=0, sticky="w")
+
+        ok_button = Tkinter.Button(self._window, text="OK", command=self._ok_click)
+        ok_button.grid(row=len(LASER_COLORS) + 1, column=0)
+
+        # Align this window with it's parent otherwise it ends up all kinds of
+        # crazy places when multiple monitors are used
+        parent_x = parent.winfo_rootx()
+        parent_y = parent.winfo_rooty()
+
+        self._window.geometry("+%d+%d" % (parent_x+20, parent_y+20))
+
+    def get_window(self):
+        return self._window
+
+    def __init__(self, parent, notifycolor):
+        self.build_gui(parent)
+        self._notify_color = notifycolor
@@ -9,14 +9,20 @@ import re
 import Tkinter, ttk
 
 DEFAULT_DETECTION_RATE = 100 #ms
+DEFAULT_DISPLAY_RATE = 66 #ms
+DEFAULT_FRAME_DRIVEN_DETECTION = False
+DEFAULT_BACKGROUND_SUBTRACTION = False
+DEFAULT_DETECTION_PROCESSES = 0
 DEFAULT_LASER_INTENSITY = 230
 DEFAULT_MARKER_RADIUS = 2 #px
 DEFAULT_IGNORE_LASER_COLOR = "none"
+DEFAULT_LASER_COLOR_CLASSIFIER = "ratio"
 DEFAULT_USE_VIRTUAL_MAGAZINE = False
 DEFAULT_VIRTUAL_MAGAZINE = 7
 DEFAULT_USE_MALFUNCTIONS = False
 DEFAULT_MALFUNCTION_PROBABILITY = 10.0
 DEFAULT_VIDCAM = 1
+DEFAULT_EXTRA_VIDCAMS = []
 
 class PreferencesEditor():
     @staticmethod
@@ -32,6 +38,36 @@ class PreferencesEditor():
             except ConfigParser.NoOptionError:
                 preferences[configurator.DETECTION_RATE] = DEFAULT_DETECTION_RATE
 
+            try:
+                preferences[configurator.DISPLAY_RATE] = config.getint("ShootOFF",
+                    configurator.DISPLAY_RATE)
+            except ConfigParser.NoOptionError:
+                preferences[configurator.DISPLAY_RATE] = DEFAULT_DISPLAY_RATE
+
+            try:
+                if (config.get("ShootOFF", configurator.FRAME_DRIVEN_DETECTION).lower() == "true" or
+                    config.get("ShootOFF", configurator.FRAME_DRIVEN_DETECTION) == "1"):
+                    preferences[configurator.FRAME_DRIVEN_DETECTION] = True
+                else:
+                    preferences[configurator.FRAME_DRIVEN_DETECTION] = False
+            except ConfigParser.NoOptionError:
+                preferences[configurator.FRAME_DRIVEN_DETECTION] = DEFAULT_FRAME_DRIVEN_DETECTION
+
+            try:
+                if (config.get("ShootOFF", configurator.BACKGROUND_SUBTRACTION).lower() == "true" or
+                    config.get("ShootOFF", configurator.BACKGROUND_SUBTRACTION) == "1"):
+                    preferences[configurator.BACKGROUND_SUBTRACTION] = True
+                else:
+                    preferences[configurator.BACKGROUND_SUBTRACTION] = False
+            except ConfigParser.NoOptionError:
+                preferences[configurator.BACKGROUND_SUBTRACTION] = DEFAULT_BACKGROUND_SUBTRACTION
+
+            try:
+                preferences[configurator.DETECTION_PROCESSES] = config.getint("ShootOFF",
+                    configurator.DETECTION_PROCESSES)
+            except ConfigParser.NoOptionError:
+                preferences[configurator.DETECTION_PROCESSES] = DEFAULT_DETECTION_PROCESSES
+
             try:
                 preferences[configurator.LASER_INTENSITY] = config.getint("ShootOFF",
                     configurator.LASER_INTENSITY)
@@ -50,12 +86,24 @@ class PreferencesEditor():
             except ConfigParser.NoOptionError:
                 preferences[configurator.VIDCAM] = DEFAULT_VIDCAM
 
+            try:
+                preferences[configurator.EXTRA_VIDCAMS] = configurator.parse_vidcams(
+                    config.get("ShootOFF", configurator.EXTRA_VIDCAMS))
+            except (ConfigParser.NoOptionError, ValueError):
+                preferences[configurator.EXTRA_VIDCAMS] = DEFAULT_EXTRA_VIDCAMS
+
             try:
                 preferences[configurator.IGNORE_LASER_COLOR] = config.get("ShootOFF",
                     configurator.IGNORE_LASER_COLOR)
             except ConfigParser.NoOptionError:
                 preferences[configurator.IGNORE_LASER_COLOR] = DEFAULT_IGNORE_LASER_COLOR
 
+            try:
+                preferences[configurator.LASER_COLOR_CLASSIFIER] = config.get("ShootOFF",
+                    configurator.LASER_COLOR_CLASSIFIER)
+            except ConfigParser.NoOptionError:
+                preferences[configurator.LASER_COLOR_CLASSIFIER] = DEFAULT_LASER_COLOR_CLASSIFIER
+
             try:
 
                 if (config.get("ShootOFF", configurator.USE_VIRTUAL_MAGAZINE).lower() == "true" or
@@ -88,10 +136,16 @@ class PreferencesEditor():
                 preferences[configurator.MALFUNCTION_PROBABILITY] = DEFAULT_MALFUNCTION_PROBABILITY
         else:
             preferences[configurator.DETECTION_RATE] = DEFAULT_DETECTION_RATE
+            preferences[configurator.DISPLAY_RATE] = DEFAULT_DISPLAY_RATE
+            preferences[configurator.FRAME_DRIVEN_DETECTION] = DEFAULT_FRAME_DRIVEN_DETECTION
+            preferences[configurator.BACKGROUND_SUBTRACTION] = DEFAULT_BACKGROUND_SUBTRACTION
+            preferences[configurator.DETECTION_PROCESSES] = DEFAULT_DETECTION_PROCESSES
             preferences[configurator.LASER_INTENSITY] = DEFAULT_LASER_INTENSITY
             preferences[configurator.MARKER_RADIUS] = DEFAULT_MARKER_RADIUS
             preferences[configurator.VIDCAM] = DEFAULT_VIDCAM
+            preferences[configurator.EXTRA_VIDCAMS] = DEFAULT_EXTRA_VIDCAMS
             preferences[configurator.IGNORE_LASER_COLOR] = DEFAULT_IGNORE_LASER_COLOR
+            preferences[configurator.LASER_COLOR_CLASSIFIER] = DEFAULT_LASER_COLOR_CLASSIFIER
             preferences[configurator.USE_VIRTUAL_MAGAZINE] = DEFAULT_USE_VIRTUAL_MAGAZINE
             preferences[configurator.VIRTUAL_MAGAZINE] = DEFAULT_VIRTUAL_MAGAZINE
             preferences[configurator.USE_MALFUNCTIONS] = DEFAULT_USE_MALFUNCTIONS
@@ -100,14 +154,26 @@ class PreferencesEditor():
             config.add_section("ShootOFF")
             config.set("ShootOFF", configurator.DETECTION_RATE, 
                 str(preferences[configurator.DETECTION_RATE]))   
+            config.set("ShootOFF", configurator.DISPLAY_RATE, 
+                str(preferences[configurator.DISPLAY_RATE]))
+            config.set("ShootOFF", configurator.FRAME_DRIVEN_DETECTION, 
+                str(preferences[configurator.FRAME_DRIVEN_DETECTION]))
+            config.set("ShootOFF", configurator.BACKGROUND_SUBTRACTION, 
+                str(preferences[configurator.BACKGROUND_SUBTRACTION]))
+            config.set("ShootOFF", configurator.DETECTION_PROCESSES, 
+                str(preferences[configurator.DETECTION_PROCESSES]))
             config.set("ShootOFF", configurator.LASER_INTENSITY, 
                 str(preferences[configurator.LASER_INTENSITY]))
             config.set("ShootOFF", configurator.MARKER_RADIUS, 
                 str(preferences[configurator.MARKER_RADIUS]))
             config.set("ShootOFF", configurator.VIDCAM, 
                 str(preferences[configurator.VIDCAM]))
+            config.set("ShootOFF", configurator.EXTRA_VIDCAMS, 
+                ",".join(str(vidcam) for vidcam in preferences[configurator.EXTRA_VIDCAMS]))
             config.set("ShootOFF", configurator.IGNORE_LASER_COLOR, 
                 preferences[configurator.IGNORE_LASER_COLOR])  
+            config.set("ShootOFF", configurator.LASER_COLOR_CLASSIFIER, 
+                preferences[configurator.LASER_COLOR_CLASSIFIER])  
             config.set("ShootOFF", configurator.USE_VIRTUAL_MAGAZINE, 
                 str(preferences[configurator.USE_VIRTUAL_MAGAZINE]))  
             config.set("ShootOFF", configurator.VIRTUAL_MAGAZINE, 
@@ -129,6 +195,15 @@ class PreferencesEditor():
         else:
             self._preferences[configurator.DETECTION_RATE] = DEFAULT_DETECTION_RATE
 
+        if self._display_rate_spinbox.get():
+            self._preferences[configurator.DISPLAY_RATE] = int(
+                self._display_rate_spinbox.get())
+        else:
+            self._preferences[configurator.DISPLAY_RATE] = DEFAULT_DISPLAY_RATE
+
+        self._preferences[configurator.FRAME_DRIVEN_DETECTION] = self._frame_driven_detection_state.get()
+        self._preferences[configurator.BACKGROUND_SUBTRACTION] = self._background_subtraction_state.get()
+
         if self._laser_intensity_spinbox.get():
             self._preferences[configurator.LASER_INTENSITY] = int(
                 self._laser_intensity_spinbox.get())
@@ -146,6 +221,11 @@ class PreferencesEditor():
         else:
             self._preferences[configurator.IGNORE_LASER_COLOR] = DEFAULT_IGNORE_LASER_COLOR
 
+        if self._laser_color_classifier_combo.get():
+            self._preferences[configurator.LASER_COLOR_CLASSIFIER] = self._laser_color_classifier_combo.get()
+        else:
+            self._preferences[configurator.LASER_COLOR_CLASSIFIER] = DEFAULT_LASER_COLOR_CLASSIFIER
+
         self._preferences[configurator.USE_VIRTUAL_MAGAZINE] = self._virtual_magazine_state.get()
         if self._virtual_magazine_state.get() == True:
             if self._virtual_magazine_spinbox.get():
@@ -162,6 +242,12 @@ class PreferencesEditor():
 
         self._config_parser.set("ShootOFF", configurator.DETECTION_RATE, 
             str(self._preferences[configurator.DETECTION_RATE]))
+        self._config_parser.set("ShootOFF", configurator.DISPLAY_RATE,
+            str(self._preferences[configurator.DISPLAY_RATE]))
+        self._config_parser.set("ShootOFF", configurator.FRAME_DRIVEN_DETECTION,
+            str(self._preferences[configurator.FRAME_DRIVEN_DETECTION]))
+        self._config_parser.set("ShootOFF", configurator.BACKGROUND_SUBTRACTION,
+            str(self._preferences[configurator.BACKGROUND_SUBTRACTION]))
         self._config_parser.set("ShootOFF", configurator.LASER_INTENSITY,
             str(self._preferences[configurator.LASER_INTENSITY]))
         self._config_parser.set("ShootOFF", configurator.MARKER_RADIUS,
@@ -170,6 +256,8 @@ class PreferencesEditor():
             str(self._preferences[configurator.VIDCAM]))
         self._config_parser.set("ShootOFF", configurator.IGNORE_LASER_COLOR,
             self._preferences[configurator.IGNORE_LASER_COLOR])
+        self._config_parser.set("ShootOFF", configurator.LASER_COLOR_CLASSIFIER,
+            self._preferences[configurator.LASER_COLOR_CLASSIFIER])
         self._config_parser.set("ShootOFF", configurator.USE_VIRTUAL_MAGAZINE,
              str(self._preferences[configurator.USE_VIRTUAL_MAGAZINE]))
         self._config_parser.set("ShootOFF", configurator.VIRTUAL_MAGAZINE,
@@ -184,6 +272,9 @@ class PreferencesEditor():
 
         self._window.destroy()
 
+        if self._notify_saved is not None:
+            self._notify_saved()
+
     def toggle_malfunctions(self):
         if self._malfunctions_state.get() == True :
             self._malfunction_probability_spinbox.configure(state=Tkinter.NORMAL)
@@ -218,7 +309,19 @@ class PreferencesEditor():
         self._detection_rate_spinbox.grid(column=1, row=0)
 
         ttk.Label(self._frame, 
-            text="Laser Intensity: ").grid(column=0, row=1)
+            text="Display Rate (ms): ").grid(column=0, row=1)
+
+        self._display_rate_spinbox = Tkinter.Spinbox(self._frame, from_=1,
+            to=60000)
+        self._display_rate_spinbox.delete(0, Tkinter.END)
+        self._display_rate_spinbox.insert(0, 
+            self._preferences[configurator.DISPLAY_RATE])
+        self._display_rate_spinbox.config(validate="key",
+            validatecommand=rate_validator)
+        self._display_rate_spinbox.grid(column=1, row=1)
+
+        ttk.Label(self._frame, 
+            text="Laser Intensity: ").grid(column=0, row=2)
 
         self._laser_intensity_spinbox = Tkinter.Spinbox(self._frame, from_=1,
             to=255)
@@ -229,10 +332,10 @@ class PreferencesEditor():
             '%P')
         self._laser_intensity_spinbox.config(validate="key",
             validatecommand=intensity_validator)
-        self._laser_intensity_spinbox.grid(column=1, row=1)
+        self._laser_intensity_spinbox.grid(column=1, row=2)
 
         ttk.Label(self._frame, 
-            text="Marker Radius: ").grid(column=0, row=2)
+            text="Marker Radius: ").grid(column=0, row=3)
 
         self._marker_radius_spinbox = Tkinter.Spinbox(self._frame, from_=1,
             to=20)  
@@ -242,15 +345,23 @@ class PreferencesEditor():
         radius_validator = (self._window.register(self.check_marker_radius),'%P')
         self._marker_radius_spinbox.config(validate="key",
             validatecommand=radius_validator)
-        self._marker_radius_spinbox.grid(column=1, row=2)  
+        self._marker_radius_spinbox.grid(column=1, row=3)  
 
         ttk.Label(self._frame, 
-            text="Ignore Laser Color: ").grid(column=0, row=3)
+            text="Ignore Laser Color: ").grid(column=0, row=4)
 
-        self._ignore_laser_color_combo = ttk.Combobox(self._frame, values=["none", "red", "green"],
+        self._ignore_laser_color_combo = ttk.Combobox(self._frame, values=["none", "red", "green", "blue"],
             state="readonly")
         self._ignore_laser_color_combo.set(self._preferences[configurator.IGNORE_LASER_COLOR])
-        self._ignore_laser_color_combo.grid(column=1, row=3)
+        self._ignore_laser_color_combo.grid(column=1, row=4)
+
+        ttk.Label(self._frame, 
+            text="Laser Color Classifier: ").grid(column=0, row=5)
+
+        self._laser_color_classifier_combo = ttk.Combobox(self._frame,
+            values=["ratio", "hsv", "lookup"], state="readonly")
+        self._laser_color_classifier_combo.set(self._preferences[configurator.LASER_COLOR_CLASSIFIER])
+        self._laser_color_classifier_combo.grid(column=1, row=5)
 
         self._virtual_magazine_state = Tkinter.BooleanVar()
         self._virtual_magazine_state.set(self._preferences[configurator.USE_VIRTUAL_MAGAZINE])   
@@ -258,7 +369,7 @@ class PreferencesEditor():
         self._use_virtual_magazine_button = Tkinter.Checkbutton(self._frame,
             variable=self._virtual_magazine_state, text="Virtual Magazine",
             onvalue=True, offvalue=False,
-            command=self.toggle_virtual_magazine).grid(column=0, row=4)
+            command=self.toggle_virtual_magazine).grid(column=0, row=6)
 
         self._virtual_magazine_spinbox = Tkinter.Spinbox(self._frame, from_=1,
             to=45)  
@@ -268,7 +379,7 @@ class PreferencesEditor():
         virtual_magazine_validator = (self._window.register(self.check_virtual_magazine),'%P')
         self._virtual_magazine_spinbox.config(validate="key",
             validatecommand=virtual_magazine_validator)
-        self._virtual_magazine_spinbox.grid(column=1, row=4)  
+        self._virtual_magazine_spinbox.grid(column=1, row=6)  
         self.toggle_virtual_magazine()
 
         self._malfunctions_state = Tkinter.BooleanVar()
@@ -277,7 +388,7 @@ class PreferencesEditor():
         self._use_malfunctions_button = Tkinter.Checkbutton(self._frame,
             variable=self._malfunctions_state, text="Inject Malfunctions (%)",
             onvalue=True, offvalue=False,
-            command=self.toggle_malfunctions).grid(column=0, row=5)
+            command=self.toggle_malfunctions).grid(column=0, row=7)
 
         self._malfunction_probability_spinbox = Tkinter.Spinbox(self._frame, from_=.1,
             to=99.9, increment=0.1, format="%0.1f")  
@@ -287,15 +398,31 @@ class PreferencesEditor():
         malfunction_probability_validator = (self._window.register(self.check_malfunction_probability),'%P')
         self._malfunction_probability_spinbox.config(validate="key",
             validatecommand=malfunction_probability_validator)
-        self._malfunction_probability_spinbox.grid(column=1, row=5)  
+        self._malfunction_probability_spinbox.grid(column=1, row=7)  
         self.toggle_malfunctions()
 
+        # Frame driven detection only takes effect the next time
+        # ShootOFF starts
+        self._frame_driven_detection_state = Tkinter.BooleanVar()
+        self._frame_driven_detection_state.set(self._preferences[configurator.FRAME_DRIVEN_DETECTION])
+
+        self._frame_driven_detection_button = Tkinter.Checkbutton(self._frame,
+            variable=self._frame_driven_detection_state, text="Detect Shots on Every Frame",
+            onvalue=True, offvalue=False).grid(column=0, row=8, columnspan=2)
+
+        self._background_subtraction_state = Tkinter.BooleanVar()
+        self._background_subtraction_state.set(self._preferences[configurator.BACKGROUND_SUBTRACTION])
+
+        self._background_subtraction_button = Tkinter.Checkbutton(self._frame,
+            variable=self._background_subtraction_state, text="Subtract Background (for Glare)",
+            onvalue=True, offvalue=False).grid(column=0, row=9, columnspan=2)
+
         self._ok_button = ttk.Button(self._frame, text="OK",
             command=self.save_preferences, width=10)
-        self._ok_button.grid(column=0, row=6)
+        self._ok_button.grid(column=0, row=10)
         self._cancel_button = ttk.Button(self._frame, text="Cancel",
             command=self._window.destroy, width=10)
-        self._cancel_button.grid(column=1, row=6)
+        self._cancel_button.grid(column=1, row=10)
 
         # Center this window on its parent
         parent_width = parent.winfo_width()
@@ -345,8 +472,10 @@ class PreferencesEditor():
         except ValueError:
             return True
 
-    def __init__(self, parent, config_parser, preferences):
+    # notifysaved is called once the preferences have been saved
+    def __init__(self, parent, config_parser, preferences, notifysaved=None):
         self._config_parser = config_parser
         self._preferences = preferences
+        self._notify_saved = notifysaved
 
         self.build_gui(parent)
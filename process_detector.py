@@ -0,0 +1,231 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import collections
+import logging
+import multiprocessing
+import numpy
+import Queue
+from shot_detector import ShotDetector, FRAME_WAIT_TIMEOUT
+from threading import Thread
+import time
+
+# Each worker process gets this many shared frame buffers so that the next
+# frame can be copied in while the worker is busy with the previous one
+SLOTS_PER_PROCESS = 2
+
+# How long stop waits for a worker process to exit before giving up on it
+WORKER_JOIN_TIMEOUT = 2 # s
+
+# Tasks are (slot, sequence, timestamp) tuples and results are
+# (slot, sequence, timestamp, candidates, interference) tuples, these are the
+# indexes of each value in those tuples
+SLOT_INDEX = 0
+SEQUENCE_INDEX = 1
+TIMESTAMP_INDEX = 2
+CANDIDATES_INDEX = 3
+INTERFERENCE_INDEX = 4
+
+# Runs in a worker process: finds the laser candidates in every frame it is
+# told about. Frames are read straight out of the shared slots, so the only
+# things that cross the process boundary are the small task and result tuples.
+# The worker starts with a copy of the preferences, whenever they change the
+# new preferences are sent through the preference pipe.
+def _detection_worker(preferences, vidcam, slots, shape, tasks, results,
+    preference_updates):
+
+    detector = ShotDetector(preferences, logging.getLogger("shootoff"), vidcam)
+    frames = [numpy.frombuffer(slot, numpy.uint8).reshape(shape) for slot in slots]
+
+    while True:
+        task = tasks.get()
+
+        # None means the detector is shutting down
+        if task is None:
+            break
+
+        # Only the newest preferences matter if they changed more than once
+        preferences = None
+        while preference_updates.poll():
+            preferences = preference_updates.recv()
+
+        if preferences is not None:
+            detector.update_preferences(preferences)
+
+        candidates = detector.find_candidates(frames[task[SLOT_INDEX]])
+        results.put(task + (candidates, detector.get_interference()))
+
+# A frame driven shot detector that spreads the image work for each frame
+# over a pool of worker processes, so detection isn't limited to the one core
+# the GIL allows. Frames are copied from the ring buffer into shared memory
+# slots, the workers find the laser candidates in them, and the candidates
+# are put back in frame order and run through the pulse tracker here. Shots
+# end up on the shot queue exactly as they do for ShotDetector.
+#
+# Each worker keeps its own background model, so in background subtraction
+# mode the background adapts more slowly the more processes there are.
+class ProcessShotDetector(ShotDetector):
+    def __init__(self, preferences, logger, vidcam=0, shot_queue=None,
+        processes=None):
+
+        ShotDetector.__init__(self, preferences, logger, vidcam, shot_queue)
+
+        if processes is None or processes < 1:
+            processes = multiprocessing.cpu_count()
+        self._process_count = processes
+
+        self._workers = None
+        self._preference_pipes = []
+        self._slots = None
+        self._frames = None
+        self._free_slots = Queue.Queue()
+        self._dispatched = collections.deque()
+        self._tasks = None
+        self._results = None
+        self._collector_thread = None
+
+    def _start_workers(self, shape):
+        frame_size = int(numpy.prod(shape))
+        slot_count = self._process_count * SLOTS_PER_PROCESS
+
+        self._slots = [multiprocessing.RawArray("B", frame_size)
+            for i in range(slot_count)]
+        self._frames = [numpy.frombuffer(slot, numpy.uint8).reshape(shape)
+            for slot in self._slots]
+
+        for slot in range(slot_count):
+            self._free_slots.put(slot)
+
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._workers = []
+        self._preference_pipes = []
+
+        for i in range(self._process_count):
+            # Every worker gets its own pipe because any of them could pick
+            # up a message sent on the task queue. Unlike a queue, whatever
+            # is sent through a pipe can be received as soon as send returns,
+            # so a worker sees new preferences before the next frame's task.
+            preference_updates, preference_pipe = multiprocessing.Pipe(False)
+            self._preference_pipes.append(preference_pipe)
+
+            worker = multiprocessing.Process(target=_detection_worker,
+                args=(self._preferences, self._vidcam, self._slots, shape,
+                    self._tasks, self._results, preference_updates),
+                name="shot_detection_process_%d_%d" % (self._vidcam, i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        self._collector_thread = Thread(target=self._collect_loop,
+            name="shot_collection_thread_%d" % self._vidcam)
+        self._collector_thread.daemon = True
+        self._collector_thread.start()
+
+        self._logger.info("Detecting shots on webcam %d with %d processes.",
+            self._vidcam, self._process_count)
+
+    # Workers get the current preferences and make their classifiers again
+    # before they check their next frame. This is also called when the
+    # preferences are updated.
+    def reload_color_classifier(self):
+        ShotDetector.reload_color_classifier(self)
+
+        for preference_pipe in self._preference_pipes:
+            preference_pipe.send(self._preferences)
+
+    def stop(self):
+        self._shutdown = True
+
+        if self._detection_thread is None:
+            return
+
+        self._detection_thread.join()
+        self._detection_thread = None
+
+        if self._workers is not None:
+            for worker in self._workers:
+                self._tasks.put(None)
+
+            for worker in self._workers:
+                worker.join(WORKER_JOIN_TIMEOUT)
+
+                if worker.is_alive():
+                    worker.terminate()
+
+            self._collector_thread.join()
+            self._workers = None
+
+        self._log_statistics()
+
+    # Called by the detection loop for every frame in order. Instead of
+    # checking the frame here it is handed to the next idle worker.
+    def _detect_frame(self, ring_buffer, sequence):
+        frame = ring_buffer.get(sequence)
+
+        if frame is None:
+            self._missed_frames += 1
+            return
+
+        timestamp, frame = frame
+
+        if self._workers is None:
+            self._start_workers(frame.shape)
+
+        # If every worker is still busy we can't keep up, so drop the frame
+        # rather than fall further behind the camera
+        try:
+            slot = self._free_slots.get_nowait()
+        except Queue.Empty:
+            self._missed_frames += 1
+            return
+
+        numpy.copyto(self._frames[slot], frame)
+
+        # The capture thread may have overwritten the frame while we were
+        # copying it
+        if not ring_buffer.is_valid(sequence):
+            self._free_slots.put(slot)
+            self._missed_frames += 1
+            return
+
+        self._dispatched.append(sequence)
+        self._tasks.put((slot, sequence, timestamp))
+
+    # Collects the workers' results, which can arrive in any order, and
+    # tracks pulses in the order the frames were dispatched in
+    def _collect_loop(self):
+        pending = {}
+
+        while not self._shutdown or self._dispatched:
+            try:
+                result = self._results.get(timeout=FRAME_WAIT_TIMEOUT)
+            except Queue.Empty:
+                if self._shutdown:
+                    break
+                continue
+
+            self._free_slots.put(result[SLOT_INDEX])
+            pending[result[SEQUENCE_INDEX]] = result
+
+            if (result[INTERFERENCE_INDEX] is not None and
+                    self._check_interference):
+                self._check_interference = False
+                self._interference = result[INTERFERENCE_INDEX]
+
+            while self._dispatched and self._dispatched[0] in pending:
+                self._track_result(pending.pop(self._dispatched.popleft()))
+
+    def _track_result(self, result):
+        sequence = result[SEQUENCE_INDEX]
+        timestamp = result[TIMESTAMP_INDEX]
+
+        latency = time.time() - timestamp
+        self._detected_frames += 1
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+        self._last_sequence = sequence
+
+        for shot in self.track_pulses(result[CANDIDATES_INDEX], timestamp):
+            self._shot_queue.put((self._vidcam,) + shot + (timestamp, sequence))
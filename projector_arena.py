@@ -3,7 +3,6 @@
 # found in the LICENSE file.
 
 from canvas_manager import CanvasManager
-from tag_parser import TagParser
 import Tkinter, ttk
 
 ARENA_BORDER_WIDTH = 3
@@ -12,37 +11,30 @@ class ProjectorArena():
     def handle_shot(self, laser_color, x, y):
         hit_region = None
         hit_tags = None
-        regions = self._arena_canvas.find_overlapping(x, y, x, y)
 
-        # If we hit a targert region, run its commands and notify the
-        # loaded plugin of the hit
-        for region in reversed(regions):
-            tags = TagParser.parse_tags(self._arena_canvas.gettags(region))
+        # Hit regions are topmost first
+        hits = self._canvas_manager.hit_test(x, y)
 
-            # If we hit an image on a transparent pixel, ignore the "hit"
-            if "_shape:image" in self._arena_canvas.gettags(region) and self._canvas_manager.is_transparent_pixel(region, x, y):
-                    continue
+        # If we hit a targert region, run its commands and notify the
+        # loaded plugin of the hit, but only for the top most region
+        if hits:
+            region = hits[0].get_region()
+            tags = hits[0].get_tags()
 
-            if "_internal_name" in tags and "command" in tags:
-                self._canvas_manager.execute_region_commands(region, tags["command"], 
+            if "command" in tags:
+                self._canvas_manager.execute_region_commands(region, 
                     self._shootoff.get_protocol_operations())
 
-            if "_internal_name" in tags and self._loaded_training != None:
+            if self._loaded_training != None:
                 hit_region = region
-                hit_tags = TagParser.parse_tags(self._arena_canvas.gettags(region))
-
-            if "_internal_name" in tags:
-                is_hit = True
-                # only run the commands and notify a hit for the top most
-                # region
-                break
+                hit_tags = tags
 
         # Also run commands for all hidden regions that were hit
-        for region in regions:
-            tags = TagParser.parse_tags(self._arena_canvas.gettags(region))
+        for hit in hits:
+            tags = hit.get_tags()
 
-            if "visible" in tags and "command" in tags and tags["visible"].lower() == "false":                
-                self._canvas_manager.execute_region_commands(region, tags["command"], 
+            if hit.is_hidden() and "command" in tags:
+                self._canvas_manager.execute_region_commands(hit.get_region(), 
                     self._shootoff.get_protocol_operations())
      
         return hit_region, hit_tags
@@ -107,19 +99,11 @@ class ProjectorArena():
         return self._arena_canvas.winfo_height()
 
     def add_target_loc(self, name, x, y):
-        target_name = self.add_target(name)
-
-        coords = self._arena_canvas.bbox(target_name)
-
-        x_trans = x - coords[0]
-        y_trans = y - coords[1]
-
-        self._arena_canvas.move(target_name, x_trans, y_trans)
-
-        return target_name
+        return self.add_target(name, (x, y))
 
-    def add_target(self, name):
-        target_name = self._canvas_manager.add_target(name, self._image_regions_images)
+    def add_target(self, name, position=None):
+        target_name = self._canvas_manager.add_target(name, self._image_regions_images,
+            position)
         self._targets.append(target_name)
 
         if len(self._arena_canvas.find_withtag("target_cover")) > 0:
@@ -165,7 +149,7 @@ class ProjectorArena():
             if target == target_name:
                 self._targets.remove(target)
 
-        self._arena_canvas.delete(target_name)
+        self._canvas_manager.delete_target(target_name)
 
     def canvas_delete_target(self, event):
         if (self._selected_target):
@@ -0,0 +1,114 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import math
+
+# Blobs in consecutive frames that are closer than this and the same
+# color are assumed to be the same laser pulse
+MAX_PULSE_DISTANCE = 20 # px
+
+# A pulse is over once it hasn't been seen for this many frames in a row.
+# Allowing one missing frame keeps a flickering laser from turning into
+# several shots.
+PULSE_MISSING_FRAMES = 2
+
+# One laser pulse, which may be lit for many frames. Pulses are created by the
+# detector's thread and are still updated after the shot they belong to has
+# been handed to the Tk loop, so their duration and brightness profile are
+# only final once is_finished returns True.
+class LaserPulse():
+    def __init__(self, laser_color, x, y, peak, timestamp):
+        self._laser_color = laser_color
+        self._x = x
+        self._y = y
+        self._onset = timestamp
+        self._last_seen = timestamp
+        self._brightness_profile = [peak]
+        self._missing_frames = 0
+        self._finished = False
+
+    def get_color(self):
+        return self._laser_color
+
+    def get_coords(self):
+        return (self._x, self._y)
+
+    def get_onset(self):
+        return self._onset
+
+    # Returns how long the laser was lit in seconds, measured between the
+    # timestamps of the first and last frames it was seen in
+    def get_duration(self):
+        return self._last_seen - self._onset
+
+    # Returns the peak intensity of the pulse in every frame it was seen in
+    def get_brightness_profile(self):
+        return list(self._brightness_profile)
+
+    def is_finished(self):
+        return self._finished
+
+    def distance(self, x, y):
+        return math.hypot(self._x - x, self._y - y)
+
+    def _update(self, x, y, peak, timestamp):
+        self._x = x
+        self._y = y
+        self._last_seen = timestamp
+        self._brightness_profile.append(peak)
+        self._missing_frames = 0
+
+    # Returns True if the pulse is over
+    def _missed(self):
+        self._missing_frames += 1
+
+        if self._missing_frames >= PULSE_MISSING_FRAMES:
+            self._finished = True
+
+        return self._finished
+
+# Associates laser blobs across consecutive frames so that a laser that stays
+# lit for several frames is reported as one shot at the time it came on.
+class PulseTracker():
+    def __init__(self):
+        self._active_pulses = []
+
+    # candidates is a list of (laser_color, x, y, peak_intensity) tuples for
+    # every laser seen in a frame grabbed at timestamp. Returns the pulses
+    # that started in this frame.
+    def update(self, candidates, timestamp):
+        new_pulses = []
+        unmatched = list(self._active_pulses)
+
+        for laser_color, x, y, peak in candidates:
+            pulse = self._closest_pulse(unmatched, laser_color, x, y)
+
+            if pulse is None:
+                pulse = LaserPulse(laser_color, x, y, peak, timestamp)
+                new_pulses.append(pulse)
+                self._active_pulses.append(pulse)
+            else:
+                unmatched.remove(pulse)
+                pulse._update(x, y, peak, timestamp)
+
+        for pulse in unmatched:
+            if pulse._missed():
+                self._active_pulses.remove(pulse)
+
+        return new_pulses
+
+    def _closest_pulse(self, pulses, laser_color, x, y):
+        closest = None
+        closest_distance = MAX_PULSE_DISTANCE
+
+        for pulse in pulses:
+            if pulse.get_color() != laser_color:
+                continue
+
+            distance = pulse.distance(x, y)
+            if distance <= closest_distance:
+                closest = pulse
+                closest_distance = distance
+
+        return closest
@@ -0,0 +1,78 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import re
+from tag_parser import TagParser
+
+# Commands are expected to look like command_name(arg0,arg1,...,argN) where
+# the arguments are optional
+COMMAND_PATTERN = re.compile(r'(\w[\w\d_]*)\((.*)\)$')
+
+# Regions' metadata is kept in (raw_tags, parsed_tags, commands) tuples,
+# these are the indexes of each value in those tuples
+RAW_TAGS_INDEX = 0
+PARSED_TAGS_INDEX = 1
+COMMANDS_INDEX = 2
+
+# Turns a region's command tag values into a list of (command, args) tuples
+def compile_commands(command_list):
+    commands = []
+
+    for command in command_list:
+        args = []
+
+        match = COMMAND_PATTERN.match(command)
+        if match:
+            command = match.group(1)
+            args = match.group(2).split(",")
+
+        commands.append((command, args))
+
+    return commands
+
+# Caches the tags of the regions on a canvas so that they are only fetched
+# from Tk and parsed once. Regions are added when targets are drawn and
+# are otherwise parsed the first time they are asked about. Anything that
+# changes a region's tags has to invalidate it.
+class RegionMetadata():
+    def __init__(self, canvas):
+        self._canvas = canvas
+        self._regions = {}
+
+    # parsed_tags can be passed in if the caller already parsed raw_tags
+    def add(self, region, raw_tags, parsed_tags=None):
+        if parsed_tags is None:
+            parsed_tags = TagParser.parse_tags(raw_tags)
+
+        commands = compile_commands(parsed_tags.get("command", []))
+
+        self._regions[region] = (tuple(raw_tags), parsed_tags, commands)
+
+    def _get(self, region):
+        if region not in self._regions:
+            self.add(region, self._canvas.gettags(region))
+
+        return self._regions[region]
+
+    def get_raw_tags(self, region):
+        return self._get(region)[RAW_TAGS_INDEX]
+
+    # Returns the region's tags as parsed by TagParser
+    def get_tags(self, region):
+        return self._get(region)[PARSED_TAGS_INDEX]
+
+    # Returns the region's commands as (command, args) tuples
+    def get_commands(self, region):
+        return self._get(region)[COMMANDS_INDEX]
+
+    def has_tag(self, region, tag):
+        return tag in self._get(region)[RAW_TAGS_INDEX]
+
+    # region can be a single region or a tuple of them
+    def invalidate(self, region):
+        if not isinstance(region, tuple):
+            region = (region,)
+
+        for item in region:
+            self._regions.pop(item, None)
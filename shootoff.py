@@ -4,29 +4,43 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+# This has to come before every other import so that they can be timed
+import startup_profiler
+startup_profiler.enable_if_requested()
+
+from camera_capture import CameraCapture
+import capture_mode_negotiator
+from capture_mode_negotiator import CaptureModeNegotiator
 from canvas_manager import CanvasManager
 import configurator
 from configurator import Configurator
 import cv2
-import glob
-import imp
-import numpy
+import discovery_index
+from discovery_index import DiscoveryIndex
+import intensity_calibrator
+from intensity_calibrator import IntensityCalibrator
+from laser_color import LOOKUP_CLASSIFIER, lookup_table_file
+from laser_color_window import LaserColorWindow
 import os
 from PIL import Image, ImageTk
 import platform
+from process_detector import ProcessShotDetector
+import Queue
 from preferences_editor import PreferencesEditor
 from projector_arena import ProjectorArena
-from projector_calibrator import ProjectorCalibrator
 import random
 from shot import Shot
-from tag_parser import TagParser
-from target_editor import TargetEditor
+from shot_detector import ShotDetector
 import time
+from training_protocols import protocol_operations
 from training_protocols.protocol_operations import ProtocolOperations
 from threading import Thread
 import Tkinter, tkFileDialog, tkMessageBox, ttk
 
-FEED_FPS = 30  # ms
+FEED_REFRESH_RATE = 33  # ms
+SHOT_QUEUE_POLL_RATE = 10 # ms
+CALIBRATION_POLL_RATE = 100 # ms
+CALIBRATION_TEXT = "calibration_text"
 SHOT_MARKER = "shot_marker"
 TARGET_VISIBILTY_MENU_INDEX = 3
 
@@ -35,31 +49,39 @@ PROJECTOR_CALIBRATE_MENU_INDEX = 1
 PROJECTOR_ADD_TARGET_MENU_INDEX = 2
 
 DEFAULT_SHOT_LIST_COLUMNS = ("Time", "Laser")
+MULTI_CAMERA_SHOT_LIST_COLUMNS = DEFAULT_SHOT_LIST_COLUMNS + ("Camera",)
+
+# Extra cameras are (camera, shot_detector, scale) tuples where scale is the
+# (x, y) factor that maps coordinates on the camera's frames to the feed
+CAMERA_INDEX = 0
+DETECTOR_INDEX = 1
+SCALE_INDEX = 2
 
 class MainWindow:
     def refresh_frame(self, *args):
-        rval, self._webcam_frame = self._cv.read()
-
-        if (rval == False):
-            self._refresh_miss_count += 1
-            self._logger.debug ("Missed %d webcam frames. If we miss too many ShootOFF " +
-                "will stop processing shots.", self._refresh_miss_count)
-
-            if self._refresh_miss_count >= 25:
-                tkMessageBox.showerror("Webcam Disconnected", "Missed too many " +
-                    "webcam frames. The camera is probably disconnected so " +
-                    "ShootOFF will stop processing shots.")
-                self._logger.critical("Missed %d webcam frames. The camera is probably " +
-                    "disconnected so ShootOFF will stop processing shots.",
-                    self._refresh_miss_count)
-                self._shutdown = True
-            else:
-                if self._shutdown == False:
-                    self._window.after(FEED_FPS, self.refresh_frame)
+        if self._camera.is_disconnected():
+            tkMessageBox.showerror("Webcam Disconnected", "Missed too many " +
+                "webcam frames. The camera is probably disconnected so " +
+                "ShootOFF will stop processing shots.")
+            self._shutdown = True
+            return
+
+        sequence, timestamp, frame = self._camera.get_latest_frame()
 
+        # The feed is redrawn at the display rate, which can be lower than
+        # the rate shots are detected at, but there is no point in drawing
+        # it faster than the webcam delivers frames
+        refresh_rate = max(self._preferences[configurator.DISPLAY_RATE],
+            self._feed_refresh_rate)
+
+        # Nothing new to show yet
+        if frame is None or sequence == self._displayed_sequence:
+            if self._shutdown == False:
+                self._window.after(refresh_rate, self.refresh_frame)
             return
 
-        self._refresh_miss_count = 0
+        self._displayed_sequence = sequence
+        self._webcam_frame = frame
 
         #OpenCV reads the frame in BGR, but PIL uses RGB, so we if we don't
         #convert it, the colors will be off.
@@ -78,95 +100,118 @@ class MainWindow:
                     self._preferences[configurator.LASER_INTENSITY], 255,
                     cv2.THRESH_BINARY)
 
-        # Show webcam image a Tk image container (note:
-        # if the image isn't stored in an instance variable
-        # it will be garbage collected and not show)
-        self._image = ImageTk.PhotoImage(image=Image.fromarray(webcam_image))
+        self._feed_image = Image.fromarray(webcam_image)
+
+        # The feed is one canvas item showing one Tk image that is updated
+        # in place, which is much cheaper than creating a new image and
+        # canvas item for every frame (note: if the Tk image isn't stored
+        # in an instance variable it will be garbage collected and not show)
+        if self._feed_photoimage is None or self._feed_photoimage_size != self._feed_image.size:
+            self._feed_photoimage = ImageTk.PhotoImage("RGB", self._feed_image.size)
+            self._feed_photoimage_size = self._feed_image.size
+
+            self._webcam_canvas.delete("background")
+            self._feed_item = self._webcam_canvas.create_image(0, 0,
+                image=self._feed_photoimage, anchor=Tkinter.NW, tags=("background"))
+            self._z_order_dirty = True
+
+        self._feed_photoimage.paste(self._feed_image)
+
+        # The feed item is updated in place, so the stacking order only
+        # has to be fixed when something changed it
+        if self._z_order_dirty:
+            self.restack_canvas()
+
+        if self._shutdown == False:
+            self._window.after(refresh_rate, self.refresh_frame)
 
-        # If the target editor doesn't have its own copy of the image
-        # the webcam feed will never update again after the editor opens
-        self._editor_image = ImageTk.PhotoImage(
-            image=Image.fromarray(webcam_image))
+    # Puts the feed at the bottom of the canvas with targets and shot markers
+    # above it, or the targets below it if they are hidden. Anything that
+    # adds a target or changes target visibility has to set _z_order_dirty.
+    # New shot markers and plugin drawings end up on top by themselves.
+    def restack_canvas(self):
+        self._z_order_dirty = False
 
-        self._webcam_canvas.delete("background")
-        webcam_image = self._webcam_canvas.create_image(0, 0, image=self._image,
-            anchor=Tkinter.NW, tags=("background"))
+        if self._feed_item is None:
+            return
 
-        # Drawing the new frame covers up our targets, so
-        # move it to the back if they are supposed to show
         if self._show_targets:
             # Not raising existing targets while lowering the webcam feed
             # will cause hits to stop registering on targets
             for target in self._targets:
                 self._webcam_canvas.tag_raise(target)
             self._webcam_canvas.tag_raise(SHOT_MARKER)
-            self._webcam_canvas.tag_lower(webcam_image)
+            self._webcam_canvas.tag_lower(self._feed_item)
         else:
             # We have to lower canvas then the targets so
             # that anything drawn by plugins will still show
             # but the targets won't
             self._webcam_canvas.tag_raise(SHOT_MARKER)
-            self._webcam_canvas.tag_lower(webcam_image)
+            self._webcam_canvas.tag_lower(self._feed_item)
             for target in self._targets:
                 self._webcam_canvas.tag_lower(target)
 
-        if self._shutdown == False:
-            self._window.after(FEED_FPS, self.refresh_frame)
-
-    def detect_shots(self):
-        if (self._webcam_frame is None):
-            self._window.after(self._preferences[configurator.DETECTION_RATE], self.detect_shots)
-            return
+    # Returns a Tk image of the frame currently shown on the feed or None if
+    # no frame has been shown yet. The target editor gets its own copy
+    # because the feed's image keeps changing.
+    def get_feed_snapshot(self):
+        if self._feed_image is None:
+            return None
 
-        # Makes feed black and white
-        frame_bw = cv2.cvtColor(self._webcam_frame, cv2.cv.CV_BGR2GRAY)
+        return ImageTk.PhotoImage(image=self._feed_image)
 
-        # Threshold the image
-        (thresh, frame_thresh) = cv2.threshold(frame_bw, 
-            self._preferences[configurator.LASER_INTENSITY], 255, cv2.THRESH_BINARY)
+    def detect_shots(self):
+        sequence, timestamp, frame = self._camera.get_latest_frame()
 
-        # Determine if we have a light source or glare on the feed
-        if not self._seen_interference:
-            self.detect_interfence(frame_thresh)
+        if (frame is not None):
+            for laser_color, x, y, pulse in self._shot_detector.detect(frame, timestamp):
+                self.handle_shot(laser_color, x, y, timestamp, pulse)
 
-        # Detect shots by splitting the frame into 9 regions (3 horizontally, and
-        # and 3 vertically -- picture a tic-tac-toe board) and detecting shots in
-        # each region separately
-        frame_height = len(frame_thresh)
-        frame_width = len(frame_thresh[0])
+            self.detect_interfence()
 
-        sub_height = frame_height / 3
-        sub_width = frame_width / 3
+        if self._shutdown == False:
+            self._window.after(self._preferences[configurator.DETECTION_RATE],
+                self.detect_shots)
 
-        for sub_y in range(0, frame_height, sub_height):
-            for sub_x in range(0, frame_width, sub_width):
-                # Find min and max values on the black and white frame
-                min_max = cv2.minMaxLoc(frame_thresh[sub_y:sub_y + sub_height,sub_x:sub_x + sub_width])
-                            
-                # The minimum and maximum are the same if there was
-                # nothing detected
-                if (min_max[0] != min_max[1]):
-                    x = min_max[3][0] + sub_x
-                    y = min_max[3][1] + sub_y
+    # Handles shots found by the frame driven shot detectors, which run on
+    # their own threads and hand us shots through a shared queue
+    def process_detected_shots(self):
+        while not self._shot_queue.empty():
+            vidcam, laser_color, x, y, pulse, timestamp, sequence = \
+                self._shot_queue.get_nowait()
 
-                    laser_color = self.detect_laser_color(x, y)
+            if vidcam in self._extra_cameras:
+                x_scale, y_scale = self._extra_cameras[vidcam][SCALE_INDEX]
+                x *= x_scale
+                y *= y_scale
 
-                    # If we couldn't detect a laser color, it's probably not a
-                    # shot
-                    if (laser_color is not None and
-                        self._preferences[configurator.IGNORE_LASER_COLOR] not in laser_color):
+            self.handle_shot(laser_color, x, y, timestamp, pulse, vidcam)
 
-                        self.handle_shot(laser_color, x, y)
+        self.detect_interfence()
 
         if self._shutdown == False:
-            self._window.after(self._preferences[configurator.DETECTION_RATE],
-                self.detect_shots)
-
-    def handle_shot(self, laser_color, x, y):	
+            self._window.after(SHOT_QUEUE_POLL_RATE, self.process_detected_shots)
+
+    # shot_time is the time the shot was seen by the camera, if it's not
+    # known the shot is assumed to have happened now. pulse is the
+    # LaserPulse the shot came from if it was detected on the feed and
+    # vidcam is the camera that saw it.
+    #
+    # Targets and the projector arena are only positioned on the primary
+    # camera's feed, so shots from extra cameras are never hit tested. They
+    # are added to the shot list and passed to the loaded protocol as misses.
+    # Every camera is its own lane, so each one has its own virtual magazine
+    # and shot timer.
+    def handle_shot(self, laser_color, x, y, shot_time=None, pulse=None, vidcam=None):	
         if (self._pause_shot_detection):
             return 
 
-        if self.update_virtual_magazine():
+        extra_camera = vidcam in self._extra_cameras
+
+        if vidcam is None:
+            vidcam = self._preferences[configurator.VIDCAM]
+
+        if self.update_virtual_magazine(vidcam):
             return
 
         if self.malfunction():
@@ -178,7 +223,7 @@ class MainWindow:
 
         # If the projector is calibrated and the shot is in the
         # projector's bounding box, tell the projector arena
-        if self._projector_calibrated:
+        if self._projector_calibrated and not extra_camera:
             bbox = self._projector_calibrator.get_projected_bbox()
             x_scale = float(self._projector_arena.arena_width()) / float(bbox[2] - bbox[0])
             y_scale = float(self._projector_arena.arena_height()) / float(bbox[3] - bbox[1])
@@ -187,7 +232,7 @@ class MainWindow:
                 hit_projector_region, projector_region_tags = self._projector_arena.handle_shot(laser_color, 
                     (x - bbox[0])*x_scale, (y - bbox[1])*y_scale)
         # This makes sure click to shoot can be used for the projector too
-        if self._preferences[configurator.DEBUG]:
+        if self._preferences[configurator.DEBUG] and not extra_camera:
             frame_height = len(self._webcam_frame)
             frame_width = len(self._webcam_frame[0])
             x_scale = float(self._projector_arena.arena_width()) / float(frame_width)
@@ -195,29 +240,40 @@ class MainWindow:
             hit_projector_region, projector_region_tags = self._projector_arena.handle_shot(laser_color, 
                     (x)*x_scale, (y)*y_scale)
       
-        # Start the shot timer if it has not been started yet,
+        if shot_time is None:
+            shot_time = time.time()
+
+        # Start the camera's shot timer if it has not been started yet,
         # otherwise get the time offset
-        if self._shot_timer_start is None:
-            self._shot_timer_start = time.time()
+        if vidcam not in self._shot_timer_starts:
+            self._shot_timer_starts[vidcam] = shot_time
         else:
-            timestamp = time.time() - self._shot_timer_start
+            timestamp = shot_time - self._shot_timer_starts[vidcam]
 
         tree_item = None
 
         if "green" in laser_color:
-            tree_item = self._shot_timer_tree.insert("", "end",
-                values=[timestamp, "green"])
+            values = [timestamp, "green"]
         else:
-            tree_item = self._shot_timer_tree.insert("", "end",
-                values=[timestamp, laser_color])
+            values = [timestamp, laser_color]
+
+        if self._extra_cameras:
+            values.append(vidcam)
+
+        tree_item = self._shot_timer_tree.insert("", "end", values=values)
         self._shot_timer_tree.see(tree_item)
 
         new_shot = Shot((x, y), self._webcam_canvas,
             self._preferences[configurator.MARKER_RADIUS],
-            laser_color, timestamp)
+            laser_color, timestamp, pulse, vidcam, shot_time)
         self._shots.append(new_shot)
         new_shot.draw_marker()
 
+        if extra_camera:
+            if self._loaded_training != None:
+                self._loaded_training.shot_listener(new_shot, tree_item, False)
+            return
+
         if hit_projector_region != None  and self._loaded_training != None:
             self._loaded_training.hit_listener(hit_projector_region, projector_region_tags, 
                 new_shot, tree_item)
@@ -228,18 +284,19 @@ class MainWindow:
         # command tag actions if we did
         self.process_hit(new_shot, tree_item)
 
-    def update_virtual_magazine(self):
+    # Magazines start out full the first time a camera sees a shot
+    def update_virtual_magazine(self, vidcam):
         if self._preferences[configurator.USE_VIRTUAL_MAGAZINE]:
-            if self._virtual_magazine_rounds == -1:
-                self._virtual_magazine_rounds = self._preferences[configurator.VIRTUAL_MAGAZINE]
+            rounds = self._virtual_magazine_rounds.get(vidcam,
+                self._preferences[configurator.VIRTUAL_MAGAZINE])
 
-            if self._virtual_magazine_rounds == 0:
+            if rounds == 0:
                 self._protocol_operations.say("reload")
-                self._virtual_magazine_rounds = self._preferences[configurator.VIRTUAL_MAGAZINE]
+                self._virtual_magazine_rounds[vidcam] = self._preferences[configurator.VIRTUAL_MAGAZINE]
 
                 return True
             else:
-                self._virtual_magazine_rounds -= 1
+                self._virtual_magazine_rounds[vidcam] = rounds - 1
 
         return False
 
@@ -252,60 +309,21 @@ class MainWindow:
 
         return False
 
-    def detect_interfence(self, image_thresh):
-        brightness_hist = cv2.calcHist([image_thresh], [0], None, [256], [0, 255])
-        percent_dark = brightness_hist[0] / image_thresh.size
-
-        # If 99% of thresholded image isn't dark, we probably have
-        # a light source or glare in the image
-        if (percent_dark < .99):
-            # We will only warn about interference once each run
-            self._seen_interference = True
+    def detect_interfence(self):
+        percent_dark = self._shot_detector.get_interference()
 
+        if percent_dark is not None:
             self._logger.warning(
                 "Glare or light source detected. %f of the image is dark." %
                 percent_dark)
 
-            self._show_interference = tkMessageBox.askyesno("Interference Detected", "Bright glare or a light source has been detected on the webcam feed, which will interfere with shot detection. Do you want to see a feed where the interference will be white and everything else will be black for a short period of time?")
+            self._show_interference = tkMessageBox.askyesno("Interference Detected", "Bright glare or a light source has been detected on the webcam feed, which will interfere with shot detection. Turning on background subtraction in the preferences may help. Do you want to see a feed where the interference will be white and everything else will be black for a short period of time?")
 
             if self._show_interference:
                 # calculate the number of times we should show the
                 # interference image (this should be roughly 5 seconds)
-                self._interference_iterations = 2500 / FEED_FPS
-
-    def detect_laser_color(self, x, y):
-        # Get the average color around the coordinates. If
-        # the dominant color is red, it's a red laser, if
-        # it's green it's a green laser, otherwise it's probably
-        # not a laser trainer, so ignore it
-        l = self._webcam_frame.shape[1]
-        h = self._webcam_frame.shape[0]
-        mask = numpy.zeros((h, l, 1), numpy.uint8)
-        cv2.circle(mask, (x, y), 10, (255, 255, 555), -1)
-        mean_color = cv2.mean(self._webcam_frame, mask)
-
-        # Remember that self._webcam_frame is in BGR
-        r = mean_color[2]
-        g = mean_color[1]
-        b = mean_color[0]
-
-        # We only detect a color if the largest component is at least
-        # 2% bigger than the other components. This is based on the
-        # heuristic that noise tends to have color values that are very
-        # similar
-        if (g == 0 or b == 0): 
-            return None
-
-        if (r / g) > 1.02 and (r / b) > 1.02:
-            return "red"
-
-        if (r == 0 or b == 0): 
-            return None
-
-        if (g / r) > 1.02 and (g / b) > 1.02:
-            return "green2"
-
-        return None
+                self._interference_iterations = 2500 / max(
+                    self._preferences[configurator.DISPLAY_RATE], self._feed_refresh_rate)
 
     def process_hit(self, shot, shot_list_item):
         is_hit = False
@@ -313,35 +331,31 @@ class MainWindow:
         x = shot.get_coords()[0]
         y = shot.get_coords()[1]
 
-        regions = self._webcam_canvas.find_overlapping(x, y, x, y)
+        # Hit regions are topmost first
+        hits = self._canvas_manager.hit_test(x, y)
 
         # If we hit a targert region, run its commands and notify the
         # loaded plugin of the hit
-        for region in reversed(regions):
-            tags = TagParser.parse_tags(self._webcam_canvas.gettags(region))
+        if hits:
+            region = hits[0].get_region()
+            tags = hits[0].get_tags()
 
-            # If we hit an image on a transparent pixel, ignore the "hit"
-            if "_shape:image" in self._webcam_canvas.gettags(region) and self._canvas_manager.is_transparent_pixel(region, x, y):
-                    continue
+            if "command" in tags:
+                self._canvas_manager.execute_region_commands(region, self._protocol_operations)
 
-            if "_internal_name" in tags and "command" in tags:
-                self._canvas_manager.execute_region_commands(region, tags["command"], self._protocol_operations)
-
-            if "_internal_name" in tags and self._loaded_training != None:
+            if self._loaded_training != None:
                 self._loaded_training.hit_listener(region, tags, shot, shot_list_item)
 
-            if "_internal_name" in tags:
-                is_hit = True
-                # only run the commands and notify a hit for the top most
-                # region
-                break
+            # only run the commands and notify a hit for the top most
+            # region
+            is_hit = True
 
         # Also run commands for all hidden regions that were hit
-        for region in regions:
-            tags = TagParser.parse_tags(self._webcam_canvas.gettags(region))
+        for hit in hits:
+            tags = hit.get_tags()
 
-            if "visible" in tags and "command" in tags and tags["visible"].lower() == "false":                
-                self._canvas_manager.execute_region_commands(region, tags["command"], self._protocol_operations)
+            if hit.is_hidden() and "command" in tags:
+                self._canvas_manager.execute_region_commands(hit.get_region(), self._protocol_operations)
 
         if self._loaded_training != None:
             self._loaded_training.shot_listener(shot, shot_list_item, is_hit)   
@@ -349,17 +363,29 @@ class MainWindow:
     def get_protocol_operations(self):
         return self._protocol_operations
 
+    # The target editor is only imported the first time it is opened
+    def _make_target_editor(self, target=None):
+        from target_editor import TargetEditor
+
+        # Before the first frame arrives targets are drawn on a black
+        # background the size of the feed
+        feed_snapshot = self.get_feed_snapshot()
+        if feed_snapshot is None:
+            feed_snapshot = ImageTk.PhotoImage(Image.new("RGB", self._feed_dimensions))
+
+        TargetEditor(self._frame, feed_snapshot, target,
+                     self.new_target_listener)
+
     def open_target_editor(self):
-        TargetEditor(self._frame, self._editor_image,
-                     notifynewfunc=self.new_target_listener)
+        self._make_target_editor()
 
     def add_target(self, name):
         target_name = self._canvas_manager.add_target(name, self._image_regions_images)
         self._targets.append(target_name)
+        self._z_order_dirty = True
 
     def edit_target(self, name):
-        TargetEditor(self._frame, self._editor_image, name,
-                     self.new_target_listener)
+        self._make_target_editor(name)
 
     def new_target_listener(self, target_file, is_animated):
         (root, ext) = os.path.splitext(os.path.basename(target_file))
@@ -392,6 +418,7 @@ class MainWindow:
                 label="Hide Targets")
 
         self._show_targets = not self._show_targets
+        self._z_order_dirty = True
 
     def pause_shot_detection(self, pause):
         self._pause_shot_detection = pause
@@ -400,7 +427,7 @@ class MainWindow:
         self._webcam_canvas.delete(SHOT_MARKER)
         self._shots = []
 
-        self._shot_timer_start = None
+        self._shot_timer_starts = {}
         shot_entries = self._shot_timer_tree.get_children()
         for shot in shot_entries: 
             if self._shot_timer_tree.exists(shot):
@@ -418,7 +445,7 @@ class MainWindow:
             self._loaded_training.reset(targets)
 
         if self._preferences[configurator.USE_VIRTUAL_MAGAZINE]:
-            self._virtual_magazine_rounds = self._preferences[configurator.VIRTUAL_MAGAZINE]
+            self._virtual_magazine_rounds = {}
 
         if self.get_projector_arena().is_visible():
             self._projector_arena.reset()
@@ -430,8 +457,18 @@ class MainWindow:
         if self._protocol_operations:
             self._protocol_operations.destroy()
 
+        protocol_operations.close_audio()
+
         self._shutdown = True
-        self._cv.release()
+        if self._intensity_calibrator is not None:
+            self._intensity_calibrator.stop()
+        self._shot_detector.stop()
+        self._camera.stop()
+
+        for extra_camera in self._extra_cameras.values():
+            extra_camera[DETECTOR_INDEX].stop()
+            extra_camera[CAMERA_INDEX].stop()
+
         self._window.quit()
 
     def canvas_click_red(self, event):
@@ -467,7 +504,7 @@ class MainWindow:
             for target in self._targets:
                 if target == self._selected_target:
                     self._targets.remove(target)
-            event.widget.delete(self._selected_target)
+            self._canvas_manager.delete_target(self._selected_target)
             self._selected_target = ""
 
     def cancel_training(self):
@@ -477,7 +514,9 @@ class MainWindow:
             self._loaded_training = None
             self._projector_arena.set_training_protocol(self._loaded_training)
 
-    def load_training(self, plugin):
+    # location is the directory of the training protocol, which is only
+    # imported once it is selected
+    def load_training(self, location):
         targets = self._canvas_manager.aggregate_targets(self._targets)
         targets.extend(self._projector_arena.aggregate_targets())
 
@@ -488,14 +527,123 @@ class MainWindow:
             self._protocol_operations.destroy()
 
         self._protocol_operations = ProtocolOperations(self._webcam_canvas, self)
-        self._loaded_training = imp.load_module("__init__", *plugin).load(
+        self._protocol_operations.preload_sounds()
+        self._loaded_training = discovery_index.load_protocol(location).load(
             self._window, self._protocol_operations, targets)
 
         self._projector_arena.set_training_protocol(self._loaded_training)
 
+    def calibrate_laser_intensity(self):
+        if self._intensity_calibrator is not None:
+            return
+
+        if not tkMessageBox.askokcancel("Calibrate Laser Intensity",
+            "Make sure no laser is on the webcam feed and click OK. After a few " +
+            "seconds you will be asked to fire %d shots." %
+            intensity_calibrator.CALIBRATION_SHOTS):
+            return
+
+        # The lookup classifier learns what each laser looks like to this
+        # camera from the calibration shots, so it needs to know which
+        # laser is being fired
+        self._calibration_laser_color = None
+        collect_color_samples = (self._preferences[configurator.LASER_COLOR_CLASSIFIER] ==
+            LOOKUP_CLASSIFIER)
+
+        if collect_color_samples:
+            self.ask_calibration_laser_color()
+            if self._calibration_laser_color is None:
+                return
+
+        self.pause_shot_detection(True)
+
+        self._intensity_calibrator = IntensityCalibrator(
+            self._camera.get_ring_buffer(), self._logger, collect_color_samples)
+        self._intensity_calibrator.start()
+
+        self._webcam_canvas.create_text(1, 1, anchor="nw", fill="white",
+            tags=(CALIBRATION_TEXT))
+        self.check_laser_intensity_calibration()
+
+    def ask_calibration_laser_color(self):
+        laser_color_window = LaserColorWindow(self._window,
+            self.set_calibration_laser_color)
+        self._window.wait_window(laser_color_window.get_window())
+
+    def set_calibration_laser_color(self, color):
+        self._calibration_laser_color = color
+
+    def check_laser_intensity_calibration(self):
+        state = self._intensity_calibrator.get_state()
+
+        if state == intensity_calibrator.SAMPLING_IDLE:
+            self._webcam_canvas.itemconfig(CALIBRATION_TEXT,
+                text="Calibrating laser intensity...\nKeep the laser off")
+        elif state == intensity_calibrator.WAITING_FOR_SHOTS:
+            self._webcam_canvas.itemconfig(CALIBRATION_TEXT,
+                text="Calibrating laser intensity...\nFire %d shots (%d seen)" %
+                (intensity_calibrator.CALIBRATION_SHOTS,
+                self._intensity_calibrator.get_shot_count()))
+        else:
+            self._intensity_calibrator.stop()
+            self._webcam_canvas.delete(CALIBRATION_TEXT)
+            self.pause_shot_detection(False)
+
+            if state == intensity_calibrator.FINISHED:
+                threshold = self._intensity_calibrator.get_threshold()
+                self._preferences[configurator.LASER_INTENSITY] = threshold
+                self._config_parser.set("ShootOFF", configurator.LASER_INTENSITY,
+                    str(threshold))
+
+                with open("settings.conf", "w") as config_file:
+                    self._config_parser.write(config_file)
+
+                self.update_detector_preferences()
+
+                message = "The laser intensity has been set to %d." % threshold
+
+                color_samples = self._intensity_calibrator.get_color_samples()
+                if (color_samples and self._shot_detector.train_color_lookup_table(
+                    self._calibration_laser_color, color_samples)):
+
+                    message += " The color of your laser was learned as well."
+
+                tkMessageBox.showinfo("Laser Intensity Calibrated", message)
+            else:
+                tkMessageBox.showerror("Couldn't Calibrate Laser Intensity",
+                    self._intensity_calibrator.get_failure())
+
+            self._intensity_calibrator = None
+            return
+
+        if self._shutdown == False:
+            self._window.after(CALIBRATION_POLL_RATE,
+                self.check_laser_intensity_calibration)
+
     def edit_preferences(self):
+        self._edited_color_classifier = self._preferences[configurator.LASER_COLOR_CLASSIFIER]
         preferences_editor = PreferencesEditor(self._window, self._config_parser,
-                                               self._preferences)
+                                               self._preferences, self.preferences_saved)
+
+    def preferences_saved(self):
+        self.update_detector_preferences()
+
+        color_classifier = self._preferences[configurator.LASER_COLOR_CLASSIFIER]
+        if (color_classifier != self._edited_color_classifier and
+            color_classifier == LOOKUP_CLASSIFIER and
+            not os.path.isfile(lookup_table_file(
+                self._preferences[configurator.VIDCAM]))):
+
+            tkMessageBox.showinfo("Laser Color Lookup Table",
+                "The lookup classifier has to learn what your laser looks " +
+                "like to your webcam. Calibrate the laser intensity to teach " +
+                "it, until then the ratio classifier is used.")
+
+    # Shot detectors keep their own copy of the preferences
+    def update_detector_preferences(self):
+        self._shot_detector.update_preferences(self._preferences)
+        for extra_camera in self._extra_cameras.values():
+            extra_camera[DETECTOR_INDEX].update_preferences(self._preferences)
 
     def which(self, program):
         def is_exe(fpath):
@@ -566,7 +714,8 @@ class MainWindow:
         self._webcam_canvas.focus_set()
 
     def configure_default_shot_list_columns(self):
-        self.configure_shot_list_columns(DEFAULT_SHOT_LIST_COLUMNS, [50, 50])
+        self.configure_shot_list_columns(self._default_shot_list_columns,
+            [50] * len(self._default_shot_list_columns))
 
     def add_shot_list_columns(self, id_list):
         current_columns = self._shot_timer_tree.cget("columns")
@@ -580,13 +729,13 @@ class MainWindow:
 
     # This method removes all but the default columns for the shot list
     def revert_shot_list_columns(self):
-        self._shot_timer_tree.configure(columns=DEFAULT_SHOT_LIST_COLUMNS)
+        self._shot_timer_tree.configure(columns=self._default_shot_list_columns)
         self.configure_default_shot_list_columns()
 
         shot_entries = self._shot_timer_tree.get_children()
         for shot in shot_entries:
             current_values = self._shot_timer_tree.item(shot, "values")
-            default_values = current_values[0:len(DEFAULT_SHOT_LIST_COLUMNS)]
+            default_values = current_values[0:len(self._default_shot_list_columns)]
             self._shot_timer_tree.item(shot, values=default_values)
 
         self.resize_shot_list()
@@ -610,6 +759,12 @@ class MainWindow:
         self.toggle_projector_menus(True)
 
     def calibrate_projector(self):
+        # The calibrator is only imported the first time the projector
+        # is calibrated
+        if self._projector_calibrator is None:
+            from projector_calibrator import ProjectorCalibrator
+            self._projector_calibrator = ProjectorCalibrator()
+
         self._calibrate_projector = not self._calibrate_projector
 
         self._projector_arena.calibrate(self._calibrate_projector)
@@ -689,6 +844,7 @@ class MainWindow:
         self._frame.pack()
 
         # Create the container for our webcam image
+        self._feed_dimensions = (int(feed_dimensions[0]), int(feed_dimensions[1]))
         self._webcam_canvas = Tkinter.Canvas(self._frame,
             width=feed_dimensions[0]-1, height=feed_dimensions[1]-1)
         self._webcam_canvas.grid(row=0, column=0)
@@ -710,7 +866,7 @@ class MainWindow:
         # Create the shot timer tree
         self._shot_timer_tree = ttk.Treeview(self._frame, selectmode="extended",
                                              show="headings")
-        self.add_shot_list_columns(DEFAULT_SHOT_LIST_COLUMNS)
+        self.add_shot_list_columns(self._default_shot_list_columns)
         self.configure_default_shot_list_columns()
 
         tree_scrolly = ttk.Scrollbar(self._frame, orient=Tkinter.VERTICAL,
@@ -734,6 +890,8 @@ class MainWindow:
 
         file_menu = Tkinter.Menu(menu_bar, tearoff=False)
         file_menu.add_command(label="Preferences", command=self.edit_preferences)
+        file_menu.add_command(label="Calibrate Laser Intensity...",
+            command=self.calibrate_laser_intensity)
         file_menu.add_command(label="Save Feed Image...", command=self.save_feed_image)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.quit)
@@ -776,14 +934,14 @@ class MainWindow:
             state=Tkinter.DISABLED)
         menu_bar.add_cascade(label="Projector", menu=self._projector_menu)
 
+        # Keep what the menus found for the next start
+        self._discovery_index.save()
+
     def callback_factory(self, func, name):
         return lambda: func(name)
 
     def create_target_list_menu(self, menu, name, func, include_animated=False):
-        targets = glob.glob("targets/*.target")
-        
-        if include_animated:
-            targets.extend(glob.glob("animated_targets/*.target"))
+        targets = self._discovery_index.get_targets(include_animated)
 
         target_list_menu = Tkinter.Menu(menu, tearoff=False)
 
@@ -797,73 +955,89 @@ class MainWindow:
         return target_list_menu
 
     def create_training_list(self, menu, func):
-        protocols_dir = "training_protocols"
-
-        plugin_candidates = os.listdir(protocols_dir)
-        for candidate in plugin_candidates:
-            plugin_location = os.path.join(protocols_dir, candidate)
-            if (not os.path.isdir(plugin_location) or
-                not "__init__.py" in os.listdir(plugin_location)):
-                continue
-            plugin_info = imp.find_module("__init__", [plugin_location])
-            training_info = imp.load_module("__init__", *plugin_info).get_info()
+        for plugin_location, training_info in self._discovery_index.get_protocols():
             menu.add_radiobutton(label=training_info["name"],
-                command=self.callback_factory(self.load_training, plugin_info),
+                command=self.callback_factory(func, plugin_location),
                 variable=self._training_selection, value=training_info["name"])
 
     def __init__(self, config):
         self._shots = []
         self._targets = []
         self._image_regions_images = {}
-        self._refresh_miss_count = 0
         self._show_targets = True
         self._selected_target = ""
         self._loaded_training = None
-        self._seen_interference = False
         self._show_interference = False
         self._webcam_frame = None
+        self._displayed_sequence = -1
+        self._feed_refresh_rate = FEED_REFRESH_RATE
+        self._feed_image = None
+        self._feed_photoimage = None
+        self._feed_photoimage_size = None
+        self._feed_item = None
+        self._z_order_dirty = True
         self._config_parser = config.get_config_parser()
         self._preferences = config.get_preferences()
-        self._shot_timer_start = None
+        self._shot_timer_starts = {}
         self._previous_shot_time_selection = None
         self._logger = config.get_logger()
-        self._virtual_magazine_rounds = -1
-        self._projector_calibrator = ProjectorCalibrator()
+        self._shot_queue = Queue.Queue()
+        self._shot_detector = self.make_shot_detector(
+            self._preferences[configurator.VIDCAM])
+        self._extra_cameras = {}
+        self._default_shot_list_columns = DEFAULT_SHOT_LIST_COLUMNS
+        self._virtual_magazine_rounds = {}
+        self._projector_calibrator = None
         self._calibrate_projector = False
         self._projector_calibrated = False
+        self._intensity_calibrator = None
+        self._calibration_laser_color = None
+        self._discovery_index = DiscoveryIndex()
 
-        self._cv = cv2.VideoCapture(self._preferences[configurator.VIDCAM])
+        self._camera = CameraCapture(self._preferences[configurator.VIDCAM],
+            self._logger)
 
-        if self._cv.isOpened():
-            width = self._cv.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)
-            height = self._cv.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)
+        if self._camera.is_opened():
+            negotiator = CaptureModeNegotiator(self._camera, self._logger)
+            mode = negotiator.negotiate(self._preferences[configurator.PROBE_CAMERA])
 
-            # If the resolution is too low, try to force it higher.
-            # Some users have drivers that default to extremely low
-            # resolutions and opencv doesn't currently make it easy
-            # to enumerate valid resolutions and switch to them
-            if width < 640 and height < 480:
-                self._logger.info("Webcam resolution is current low (%dx%d), " +
-                                 "attempting to increase it to 640x480", width, height)
-                self._cv.set(cv2.cv.CV_CAP_PROP_FRAME_WIDTH, 640)
-                self._cv.set(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT, 480)
-                width = self._cv.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)
-                height = self._cv.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)
+            width = self._camera.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)
+            height = self._camera.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)
 
             self._logger.debug("Webcam resolution is %dx%d", width, height)
+            startup_profiler.mark("open camera")
+
+            self.open_extra_cameras((width, height))
+            if self._extra_cameras:
+                self._default_shot_list_columns = MULTI_CAMERA_SHOT_LIST_COLUMNS
+            startup_profiler.mark("open extra cameras")
+
             self.build_gui((width, height))
             self._protocol_operations = ProtocolOperations(self._webcam_canvas, self)
+            startup_profiler.mark("build gui")
+
+            if mode is not None:
+                fps = mode[capture_mode_negotiator.FPS_INDEX]
+            else:
+                fps = self._camera.get(cv2.cv.CV_CAP_PROP_FPS)
 
-            fps = self._cv.get(cv2.cv.CV_CAP_PROP_FPS)
             if fps <= 0:
                 self._logger.info("Couldn't get webcam FPS, defaulting to 30.")
             else:
-                FEED_FPS = fps
+                # There is no point in refreshing the feed faster than
+                # the webcam delivers frames
+                self._feed_refresh_rate = max(int(1000 / fps), 1)
                 self._logger.info("Feed FPS set to %d.", fps)
 
             # Webcam related threads will end when this is true
             self._shutdown = False
 
+            # Frames are read on the capture thread, everything else
+            # just looks at the latest frame it published
+            self._camera.start()
+            for extra_camera in self._extra_cameras.values():
+                extra_camera[CAMERA_INDEX].start()
+
             #Start the refresh loop that shows the webcam feed
             self._refresh_thread = Thread(target=self.refresh_frame,
                                           name="refresh_thread")
@@ -871,9 +1045,28 @@ class MainWindow:
 
             #Start the shot detection loop
             self._pause_shot_detection = False
-            self._shot_detection_thread = Thread(target=self.detect_shots,
-                                                 name="shot_detection_thread")
-            self._shot_detection_thread.start()
+            frame_driven = (self._preferences[configurator.FRAME_DRIVEN_DETECTION] or
+                self._preferences[configurator.DETECTION_PROCESSES] > 0)
+
+            if frame_driven:
+                self._shot_detector.start(self._camera.get_ring_buffer())
+            else:
+                self._shot_detection_thread = Thread(target=self.detect_shots,
+                                                     name="shot_detection_thread")
+                self._shot_detection_thread.start()
+
+            # Extra cameras always use frame driven detection so that each
+            # one gets its own detection thread instead of competing for
+            # the Tk loop
+            for extra_camera in self._extra_cameras.values():
+                extra_camera[DETECTOR_INDEX].start(
+                    extra_camera[CAMERA_INDEX].get_ring_buffer())
+
+            if frame_driven or self._extra_cameras:
+                self._window.after(SHOT_QUEUE_POLL_RATE,
+                    self.process_detected_shots)
+
+            startup_profiler.mark("start capture and detection")
         else:
             tkMessageBox.showwarning("Open Video Camera",
                 "Cannot open this vidcam (%d)\n" % self._preferences[configurator.VIDCAM])
@@ -885,6 +1078,46 @@ class MainWindow:
                 "because there is no webcam or we cannot connect to it.")
             self._shutdown = True
 
+    # Detection runs in worker processes if there are any, otherwise on
+    # threads in this process
+    def make_shot_detector(self, vidcam):
+        if self._preferences[configurator.DETECTION_PROCESSES] > 0:
+            return ProcessShotDetector(self._preferences, self._logger, vidcam,
+                self._shot_queue, self._preferences[configurator.DETECTION_PROCESSES])
+        else:
+            return ShotDetector(self._preferences, self._logger, vidcam,
+                self._shot_queue)
+
+    # Opens every extra camera in the preferences, each gets its own capture
+    # thread and shot detector. Shots from all cameras are shown on the
+    # primary camera's feed, scaled to its dimensions, but extra cameras
+    # don't see the primary camera's targets so their shots are only
+    # recorded, never scored (see handle_shot).
+    def open_extra_cameras(self, feed_dimensions):
+        for vidcam in self._preferences[configurator.EXTRA_VIDCAMS]:
+            if vidcam == self._preferences[configurator.VIDCAM] or vidcam in self._extra_cameras:
+                continue
+
+            camera = CameraCapture(vidcam, self._logger)
+
+            if not camera.is_opened():
+                self._logger.warning("Cannot open extra vidcam (%d), shots on " +
+                    "it won't be detected.", vidcam)
+                continue
+
+            CaptureModeNegotiator(camera, self._logger).negotiate(
+                self._preferences[configurator.PROBE_CAMERA])
+
+            width = camera.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)
+            height = camera.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)
+            scale = (float(feed_dimensions[0]) / width, float(feed_dimensions[1]) / height)
+
+            self._logger.debug("Extra webcam %d resolution is %dx%d", vidcam,
+                width, height)
+
+            detector = self.make_shot_detector(vidcam)
+            self._extra_cameras[vidcam] = (camera, detector, scale)
+
     def main(self):
         if not self._shutdown:
             Tkinter.mainloop()
@@ -897,7 +1130,9 @@ if __name__ == "__main__":
     logger = config.get_logger()
 
     logger.debug(preferences)
+    startup_profiler.mark("configuration")
 
     # Start the main window
     mainWindow = MainWindow(config)
+    startup_profiler.report(logger)
     mainWindow.main()
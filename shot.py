@@ -8,15 +8,24 @@ class Shot:
     # Use the default color and radius for the
     # shot marker. Create a new shoot at coord
     # (a tuple representing the coordinate of 
-    # laser on the webcam feed). The timestamp
+    # laser on the webcam feed, which may be
+    # sub-pixel floats). The timestamp
     # is the shot timer's time stamp when the
-    # shot was detected.
-    def __init__(self, coord, canvas, marker_radius=2, marker_color="green2", timestamp=0):
+    # shot was detected. The pulse is the LaserPulse
+    # the shot was detected from (None for clicked
+    # shots) and vidcam is the camera that saw it.
+    # capture_time is the time (as returned by
+    # time.time()) the shot was seen by the camera.
+    def __init__(self, coord, canvas, marker_radius=2, marker_color="green2", timestamp=0,
+        pulse=None, vidcam=0, capture_time=None):
         self._marker_color = marker_color
         self._marker_radius = marker_radius
         self._coord = coord
         self._canvas = canvas
         self._timestamp = timestamp
+        self._pulse = pulse
+        self._vidcam = vidcam
+        self._capture_time = capture_time
         self._canvas_id = None
         self._is_selected = False
 
@@ -40,6 +49,27 @@ class Shot:
     def get_timestamp(self):
         return self._timestamp
 
+    def get_camera(self):
+        return self._vidcam
+
+    def get_capture_time(self):
+        return self._capture_time
+
+    # Returns how long the laser was on in seconds. This keeps
+    # growing until the laser turns off (see LaserPulse).
+    def get_pulse_duration(self):
+        if self._pulse is None:
+            return 0
+
+        return self._pulse.get_duration()
+
+    # Returns the laser's peak intensity in each frame it was seen in
+    def get_pulse_profile(self):
+        if self._pulse is None:
+            return []
+
+        return self._pulse.get_brightness_profile()
+
     def draw_marker(self):
         x = self._coord[0]
         y = self._coord[1]
@@ -0,0 +1,508 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import configurator
+import cv2
+import laser_color
+from laser_color import make_classifier
+import numpy
+from pulse_tracker import PulseTracker
+import Queue
+from threading import Thread
+import time
+
+# How long the frame driven detector waits for a new frame before checking
+# if it should shut down
+FRAME_WAIT_TIMEOUT = .5 # s
+
+# How often the frame driven detector logs its statistics
+STATISTICS_INTERVAL = 10 # s
+
+# Bright spots outside of this range aren't considered to be laser
+# shots (e.g. a lamp or a reflection off of the target)
+MIN_BLOB_AREA = 1 # px
+MAX_BLOB_AREA = 2500 # px
+
+# Blobs are returned by find_blobs as tuples, these are the indexes
+# of each value in those tuples
+BLOB_X_INDEX = 0
+BLOB_Y_INDEX = 1
+BLOB_AREA_INDEX = 2
+BLOB_PEAK_INDEX = 3
+
+# Radius of the circle around a shot that is averaged to find
+# the laser's color
+COLOR_SAMPLE_RADIUS = 10 # px
+
+# In background subtraction mode a pixel is a laser if it is this much
+# brighter than the background model, which is a moving average of the
+# frames that adapts at the learning rate
+BACKGROUND_DELTA = 40
+BACKGROUND_LEARNING_RATE = .05
+
+# OpenCV 2.4 doesn't have connected component labeling, so we fall
+# back to finding contours when it isn't available
+HAS_CONNECTED_COMPONENTS = hasattr(cv2, "connectedComponentsWithStats")
+
+# Holds the buffers used on the detection hot path so that they are allocated
+# once per camera resolution instead of once per frame. OpenCV writes into
+# them through its dst parameters.
+class DetectionContext():
+    def __init__(self):
+        self._shape = None
+        self.gray = None
+        self.thresh = None
+        self.scratch = None
+        self.background = None
+        self.background_gray = None
+        self.delta = None
+        self.labels = None
+
+        # The color sample mask only depends on the sample radius, so
+        # it never has to be reallocated
+        size = COLOR_SAMPLE_RADIUS * 2 + 1
+        self._sample_mask = numpy.zeros((size, size), numpy.uint8)
+        cv2.circle(self._sample_mask, (COLOR_SAMPLE_RADIUS, COLOR_SAMPLE_RADIUS),
+            COLOR_SAMPLE_RADIUS, 255, -1)
+
+    # Make sure the buffers match frame's resolution
+    def prepare(self, frame):
+        shape = frame.shape[:2]
+
+        if shape != self._shape:
+            self._shape = shape
+            self.gray = numpy.empty(shape, numpy.uint8)
+            self.thresh = numpy.empty(shape, numpy.uint8)
+            self.scratch = numpy.empty(shape, numpy.uint8)
+            self.background = None
+            self.background_gray = numpy.empty(shape, numpy.uint8)
+            self.delta = numpy.empty(shape, numpy.uint8)
+            self.labels = numpy.empty(shape, numpy.int32)
+
+    # Returns a (roi, mask) tuple where roi is the window of frame around
+    # (x, y) that holds the color sample circle and mask selects the circle's
+    # pixels in that window, or None if (x, y) is outside of the frame.
+    # Only the pixels in the circle's bounding box are touched.
+    def get_sample_window(self, frame, x, y):
+        height, width = frame.shape[:2]
+        r = COLOR_SAMPLE_RADIUS
+
+        left = max(x - r, 0)
+        top = max(y - r, 0)
+        right = min(x + r + 1, width)
+        bottom = min(y + r + 1, height)
+
+        if left >= right or top >= bottom:
+            return None
+
+        # Clip the mask the same way the window was clipped at the
+        # edges of the frame
+        mask = self._sample_mask[top - (y - r):bottom - (y - r),
+            left - (x - r):right - (x - r)]
+
+        return (frame[top:bottom, left:right], mask)
+
+# Finds laser shots in webcam frames. The detector can either be polled with
+# single frames from the Tk loop (detect) or it can run on its own thread and
+# push every frame the camera captures through detect exactly once (start).
+# In the latter case detected shots are put on a queue as
+# (vidcam, laser_color, x, y, pulse, timestamp, sequence) tuples where vidcam
+# is the camera the shot was seen by, timestamp is the time the frame was
+# grabbed, and sequence is the frame's sequence number. Detectors for
+# different cameras can share one queue.
+#
+# Lasers are tracked from frame to frame, so a laser that stays on for a
+# while is only reported once, in the frame it came on in.
+#
+# The detector keeps its own copy of the preferences, update_preferences has
+# to be called when they change.
+class ShotDetector():
+    def __init__(self, preferences, logger, vidcam=0, shot_queue=None):
+        self._preferences = dict(preferences)
+        self._logger = logger
+        self._vidcam = vidcam
+        self._interference = None
+        self._check_interference = True
+
+        if shot_queue is None:
+            shot_queue = Queue.Queue()
+        self._shot_queue = shot_queue
+        self._shutdown = False
+        self._detection_thread = None
+        self._context = DetectionContext()
+        self._frame_copy = None
+        self._pulse_tracker = PulseTracker()
+        self._color_classifier = make_classifier(
+            preferences[configurator.LASER_COLOR_CLASSIFIER], vidcam)
+        self._reset_statistics()
+
+    # Returns a list of (laser_color, x, y, pulse) tuples for every laser
+    # pulse that started in frame. timestamp is the time frame was grabbed.
+    def detect(self, frame, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        return self.track_pulses(self.find_candidates(frame), timestamp)
+
+    # Feeds the lasers seen in a frame grabbed at timestamp to the pulse
+    # tracker and returns (laser_color, x, y, pulse) tuples for the pulses
+    # that started in it. Frames have to be tracked in the order they were
+    # grabbed in.
+    def track_pulses(self, candidates, timestamp):
+        shots = []
+        for pulse in self._pulse_tracker.update(candidates, timestamp):
+            x, y = pulse.get_coords()
+            shots.append((pulse.get_color(), x, y, pulse))
+
+        return shots
+
+    # Returns a list of (laser_color, x, y, peak_intensity) tuples for every
+    # laser seen in frame. This only looks at the one frame (apart from
+    # updating the background model), so frames can be checked in any order.
+    def find_candidates(self, frame):
+        candidates = []
+        self._context.prepare(frame)
+
+        # Makes feed black and white
+        frame_bw = cv2.cvtColor(frame, cv2.cv.CV_BGR2GRAY, self._context.gray)
+
+        if self._preferences[configurator.BACKGROUND_SUBTRACTION]:
+            frame_intensity, frame_thresh = self._subtract_background(frame_bw)
+
+            # The first frame only seeds the background
+            if frame_intensity is None:
+                return []
+        else:
+            # Threshold the image
+            (thresh, frame_thresh) = cv2.threshold(frame_bw,
+                self._preferences[configurator.LASER_INTENSITY], 255, cv2.THRESH_BINARY,
+                self._context.thresh)
+            frame_intensity = frame_bw
+
+            # Determine if we have a light source or glare on the feed
+            if self._check_interference:
+                self._detect_interference(frame_thresh)
+
+        # Every bright blob that is the right size is a shot candidate,
+        # so more than one shooter can hit the same area at once
+        for blob in self.find_blobs(frame_intensity, frame_thresh):
+            x = blob[BLOB_X_INDEX]
+            y = blob[BLOB_Y_INDEX]
+
+            laser_color = self.detect_laser_color(frame, x, y)
+
+            # If we couldn't detect a laser color, it's probably not a
+            # shot
+            if (laser_color is not None and
+                self._preferences[configurator.IGNORE_LASER_COLOR] not in laser_color):
+
+                candidates.append((laser_color, x, y, blob[BLOB_PEAK_INDEX]))
+
+        return candidates
+
+    # Compares the grayscale frame to a running average of past frames and
+    # returns a (delta, delta_thresh) tuple where delta is how much brighter
+    # each pixel is than the background and delta_thresh marks the pixels
+    # that are at least BACKGROUND_DELTA brighter. Steady light sources and
+    # glare become part of the background, so they don't hide lasers the way
+    # they do with a fixed threshold. Returns (None, None) for the first frame.
+    def _subtract_background(self, frame_bw):
+        context = self._context
+
+        if context.background is None:
+            context.background = frame_bw.astype(numpy.float32)
+            return (None, None)
+
+        cv2.convertScaleAbs(context.background, context.background_gray)
+        cv2.subtract(frame_bw, context.background_gray, context.delta)
+
+        cv2.threshold(context.delta, BACKGROUND_DELTA, 255, cv2.THRESH_BINARY,
+            context.thresh)
+
+        # Don't learn the lasers themselves, otherwise a laser that stays
+        # on fades into the background
+        cv2.bitwise_not(context.thresh, context.scratch)
+        cv2.accumulateWeighted(frame_bw, context.background,
+            BACKGROUND_LEARNING_RATE, context.scratch)
+
+        return (context.delta, context.thresh)
+
+    # Finds every connected bright area in the thresholded frame in a single
+    # pass and returns a list of (x, y, area, peak_intensity) tuples for the
+    # ones that are between MIN_BLOB_AREA and MAX_BLOB_AREA pixels. x and y
+    # are the blob's sub-pixel, intensity weighted centroid and peak_intensity
+    # is the brightest value in frame_bw (the grayscale frame or, when
+    # subtracting the background, the difference from the background) in
+    # the blob.
+    def find_blobs(self, frame_bw, frame_thresh):
+        if HAS_CONNECTED_COMPONENTS:
+            (count, labels, stats, centroids) = cv2.connectedComponentsWithStats(
+                frame_thresh, connectivity=8)
+
+            # Label 0 is the dark background
+            areas = stats[1:, cv2.CC_STAT_AREA]
+            boxes = stats[1:, :4]
+            centroids = centroids[1:]
+        else:
+            # findContours overwrites the image it is given
+            numpy.copyto(self._context.scratch, frame_thresh)
+            contours, hierarchy = cv2.findContours(self._context.scratch,
+                cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2:]
+
+            if len(contours) == 0:
+                return []
+
+            # Fill each contour with its own label, then count the bright
+            # pixels with each label in one pass. Counting the pixels in each
+            # blob's bounding box instead would also count pixels of any
+            # other blob whose box overlaps it.
+            labels = self._context.labels
+            labels.fill(0)
+            for i in range(len(contours)):
+                cv2.drawContours(labels, contours, i, i + 1, -1)
+
+            areas = numpy.bincount(labels[frame_thresh > 0],
+                minlength=len(contours) + 1)[1:]
+
+            boxes = numpy.array([cv2.boundingRect(c) for c in contours])
+            centroids = boxes[:, :2] + (boxes[:, 2:4] - 1) / 2.0
+
+        keep = numpy.flatnonzero((areas >= MIN_BLOB_AREA) & (areas <= MAX_BLOB_AREA))
+
+        blobs = []
+        for i in keep:
+            x, y, w, h = boxes[i]
+            area = areas[i]
+            centroid = centroids[i]
+            roi = frame_bw[y:y + h, x:x + w]
+
+            # Another blob can reach into this one's bounding box, so only
+            # the bright pixels with this blob's label count
+            roi_thresh = numpy.where(labels[y:y + h, x:x + w] == i + 1,
+                frame_thresh[y:y + h, x:x + w], 0).astype(numpy.uint8)
+            peak = roi[roi_thresh > 0].max()
+
+            centroid_x, centroid_y = self._weighted_centroid(roi, roi_thresh)
+            if centroid_x is None:
+                centroid_x = centroid[0]
+                centroid_y = centroid[1]
+            else:
+                centroid_x += x
+                centroid_y += y
+
+            blobs.append((float(centroid_x), float(centroid_y), int(area), int(peak)))
+
+        return blobs
+
+    # Returns the intensity weighted centroid of the bright pixels in roi
+    # relative to its top left corner or (None, None) if there aren't any.
+    # A saturated laser dot has a flat top, so weighting every pixel in the
+    # blob (rather than taking the brightest pixel) keeps the shot in the
+    # middle of the dot instead of at its top left edge.
+    def _weighted_centroid(self, roi, roi_thresh):
+        moments = cv2.moments(cv2.bitwise_and(roi, roi_thresh))
+
+        if moments["m00"] == 0:
+            return (None, None)
+
+        return (moments["m10"] / moments["m00"], moments["m01"] / moments["m00"])
+
+    def _detect_interference(self, image_thresh):
+        brightness_hist = cv2.calcHist([image_thresh], [0], None, [256], [0, 255])
+        percent_dark = brightness_hist[0] / image_thresh.size
+
+        # If 99% of thresholded image isn't dark, we probably have
+        # a light source or glare in the image
+        if (percent_dark < .99):
+            # We will only warn about interference once each run
+            self._check_interference = False
+            self._interference = percent_dark
+
+    # Returns the percentage of the thresholded frame that was dark the first
+    # time interference was seen or None if there hasn't been any. The value is
+    # only returned once so that the user is only warned once.
+    def get_interference(self):
+        interference = self._interference
+        self._interference = None
+        return interference
+
+    def detect_laser_color(self, frame, x, y):
+        # Classify the color around the coordinates. If it looks
+        # like a laser we know about return its color, otherwise
+        # it's probably not a laser trainer, so ignore it
+        window = self._context.get_sample_window(frame,
+            int(round(x)), int(round(y)))
+        if window is None:
+            return None
+
+        color, confidence = self._color_classifier.classify(*window)
+
+        if color is None or confidence < self._color_classifier.get_min_confidence():
+            return None
+
+        return color
+
+    # Adds (frame, x, y) samples of shots from a laser of the given color to
+    # this camera's color lookup table, saves it, and starts using it if the
+    # lookup classifier is selected
+    def train_color_lookup_table(self, color, samples):
+        classifier = laser_color.LookupClassifier(
+            laser_color.lookup_table_file(self._vidcam))
+
+        for frame, x, y in samples:
+            window = self._context.get_sample_window(frame, x, y)
+            if window is not None:
+                classifier.train(color, *window)
+
+        if not classifier.is_trained():
+            return False
+
+        classifier.save(laser_color.lookup_table_file(self._vidcam))
+        self.reload_color_classifier()
+
+        self._logger.info("Trained the laser color lookup table for webcam %d " +
+            "on %d %s shots.", self._vidcam, len(samples), color)
+
+        return True
+
+    # Starts detecting with new preferences. The color classifier is made
+    # again in case it is one of the preferences that changed.
+    def update_preferences(self, preferences):
+        if (preferences[configurator.BACKGROUND_SUBTRACTION] !=
+            self._preferences[configurator.BACKGROUND_SUBTRACTION]):
+
+            # Don't pick up a background that was learned before
+            # subtraction was last turned off
+            self._context.background = None
+
+        self._preferences = dict(preferences)
+        self.reload_color_classifier()
+
+    # Makes the color classifier again so that it picks up a retrained
+    # lookup table
+    def reload_color_classifier(self):
+        self._color_classifier = make_classifier(
+            self._preferences[configurator.LASER_COLOR_CLASSIFIER], self._vidcam)
+
+    def get_shot_queue(self):
+        return self._shot_queue
+
+    # Start detecting shots on every frame published to ring_buffer
+    def start(self, ring_buffer):
+        self._shutdown = False
+        self._detection_thread = Thread(target=self._detection_loop,
+            args=(ring_buffer,), name="shot_detection_thread_%d" % self._vidcam)
+        self._detection_thread.daemon = True
+        self._detection_thread.start()
+
+    def stop(self):
+        self._shutdown = True
+
+        if self._detection_thread is not None:
+            self._detection_thread.join()
+            self._detection_thread = None
+            self._log_statistics()
+
+    def _detection_loop(self, ring_buffer):
+        next_sequence = -1
+        last_report = time.time()
+
+        while not self._shutdown:
+            latest_sequence = ring_buffer.wait_for(max(next_sequence, 0),
+                FRAME_WAIT_TIMEOUT)
+
+            if latest_sequence < 0 or latest_sequence < next_sequence:
+                continue
+
+            # Start with whatever frame is current when detection starts
+            if next_sequence < 0:
+                next_sequence = latest_sequence
+
+            # If the camera lapped us, skip ahead to the oldest frame that is
+            # still in the ring and count everything in between as missed
+            oldest_sequence = latest_sequence - ring_buffer.get_size() + 1
+            if next_sequence < oldest_sequence:
+                self._missed_frames += oldest_sequence - next_sequence
+                next_sequence = oldest_sequence
+
+            self._detect_frame(ring_buffer, next_sequence)
+            next_sequence += 1
+
+            if time.time() - last_report >= STATISTICS_INTERVAL:
+                self._log_statistics()
+                last_report = time.time()
+
+    def _detect_frame(self, ring_buffer, sequence):
+        frame = ring_buffer.get(sequence)
+
+        if frame is None:
+            self._missed_frames += 1
+            return
+
+        timestamp, frame = frame
+
+        if self._frame_copy is None or self._frame_copy.shape != frame.shape:
+            self._frame_copy = numpy.empty(frame.shape, numpy.uint8)
+
+        numpy.copyto(self._frame_copy, frame)
+
+        # The capture thread may have overwritten the frame while we were
+        # copying it. This has to be checked before the frame is detected,
+        # otherwise the pulse tracker and the background model would have
+        # already learned from a frame whose shots are thrown away.
+        if not ring_buffer.is_valid(sequence):
+            self._missed_frames += 1
+            return
+
+        shots = self.detect(self._frame_copy, timestamp)
+
+        latency = time.time() - timestamp
+        self._detected_frames += 1
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+        self._last_sequence = sequence
+
+        for shot in shots:
+            self._shot_queue.put((self._vidcam,) + shot + (timestamp, sequence))
+
+    def _reset_statistics(self):
+        self._detected_frames = 0
+        self._missed_frames = 0
+        self._total_latency = 0
+        self._max_latency = 0
+        self._last_sequence = -1
+
+    # Returns a dictionary describing how well the frame driven detector
+    # is keeping up with the camera. Latencies are in seconds and are
+    # measured from the time a frame was grabbed.
+    def get_statistics(self):
+        total_frames = self._detected_frames + self._missed_frames
+        statistics = {}
+
+        statistics["detected_frames"] = self._detected_frames
+        statistics["missed_frames"] = self._missed_frames
+        statistics["last_sequence"] = self._last_sequence
+        statistics["max_latency"] = self._max_latency
+
+        if total_frames > 0:
+            statistics["miss_rate"] = float(self._missed_frames) / total_frames
+        else:
+            statistics["miss_rate"] = 0
+
+        if self._detected_frames > 0:
+            statistics["mean_latency"] = self._total_latency / self._detected_frames
+        else:
+            statistics["mean_latency"] = 0
+
+        return statistics
+
+    def _log_statistics(self):
+        statistics = self.get_statistics()
+
+        self._logger.info("Shot detection for webcam %d checked %d frames (up to " +
+            "frame %d) and missed %d (%.1f%%). Mean latency was %.1f ms, max " +
+            "latency was %.1f ms.", self._vidcam, statistics["detected_frames"],
+            statistics["last_sequence"], statistics["missed_frames"],
+            statistics["miss_rate"] * 100,
+            statistics["mean_latency"] * 1000, statistics["max_latency"] * 1000)
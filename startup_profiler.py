@@ -0,0 +1,98 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Times how long ShootOFF takes to start when it is run with
+# --profile-startup. Imports have to be timed before anything else is
+# imported, so the flag is looked for in sys.argv directly instead of
+# waiting for Configurator to parse it.
+
+import __builtin__
+import sys
+import time
+
+PROFILE_STARTUP_FLAG = "--profile-startup"
+
+# Imports that take less time than this aren't reported
+MIN_REPORTED_IMPORT_TIME = .001 # s
+
+_enabled = False
+_original_import = None
+_import_depth = 0
+_start_time = None
+_last_mark_time = None
+
+# Seconds spent in imports done by ShootOFF itself (including everything they
+# import in turn) by module name and in each stage of startup, in order
+_import_times = {}
+_stage_times = []
+
+def enable_if_requested():
+    if PROFILE_STARTUP_FLAG in sys.argv:
+        enable()
+
+def is_enabled():
+    return _enabled
+
+def enable():
+    global _enabled, _original_import, _start_time, _last_mark_time
+
+    if _enabled:
+        return
+
+    _enabled = True
+    _start_time = time.time()
+    _last_mark_time = _start_time
+    _original_import = __builtin__.__import__
+    __builtin__.__import__ = _timed_import
+
+# Only the outermost import is timed so that the time spent importing a
+# module's dependencies is counted as part of that module
+def _timed_import(name, *args, **kwargs):
+    global _import_depth
+
+    if _import_depth > 0:
+        _import_depth += 1
+        try:
+            return _original_import(name, *args, **kwargs)
+        finally:
+            _import_depth -= 1
+
+    _import_depth += 1
+    start = time.time()
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        _import_depth -= 1
+        _import_times[name] = _import_times.get(name, 0) + time.time() - start
+
+# Records how long it has been since the last stage ended
+def mark(stage):
+    global _last_mark_time
+
+    if not _enabled:
+        return
+
+    now = time.time()
+    _stage_times.append((stage, now - _last_mark_time))
+    _last_mark_time = now
+
+# Logs the timing breakdown and stops timing imports
+def report(logger):
+    if not _enabled:
+        return
+
+    __builtin__.__import__ = _original_import
+
+    logger.info("Startup took %.3fs", time.time() - _start_time)
+
+    logger.info("Imports:")
+    for name, seconds in sorted(_import_times.items(), key=lambda t: t[1], reverse=True):
+        if seconds < MIN_REPORTED_IMPORT_TIME:
+            break
+
+        logger.info("    %-40s %.3fs", name, seconds)
+
+    logger.info("Stages (including imports done during them):")
+    for stage, seconds in _stage_times:
+        logger.info("    %-40s %.3fs", stage, seconds)
@@ -409,6 +409,7 @@ class TargetEditor():
         tags = self._target_canvas.gettags(self._selected_region)
         self._target_canvas.itemconfig(self._selected_region, 
             tags=tags + new_tag_list)
+        self._canvas_manager.get_metadata().invalidate(self._selected_region)
 
     def build_gui(self, parent, webcam_image):
         # Create the main window
@@ -588,8 +589,7 @@ class TargetEditor():
         if target is not None:
             target_pickler = TargetPickler()
             (region_object, self._regions) = target_pickler.load(
-                target, self._target_canvas, self._canvas_manager, 
-                self._image_regions_images)
+                target, self._target_canvas, self._canvas_manager)
 
         self._notify_new_target = notifynewfunc
 
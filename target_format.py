@@ -0,0 +1,234 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Reads and writes ShootOFF target files. Targets are stored as JSON that
+# looks like this:
+#
+# {"format":"ShootOFF Target","version":1,"regions":[
+#     {"tags":["_shape:oval","_internal_name:target"],"coords":[0.0,0.0,50.0,50.0],"fill":"red"},
+#     {"tags":["_shape:image","_path:..."],"coords":[25.0,25.0]}]}
+#
+# Targets used to be pickled lists of region dictionaries. Those files can
+# still be read, but only plain data is unpickled from them, and they can be
+# converted by running this module with their paths as arguments.
+
+import collections
+import cPickle
+from cStringIO import StringIO
+import json
+import os
+import sys
+from threading import RLock
+
+FORMAT_NAME = "ShootOFF Target"
+FORMAT_VERSION = 1
+
+# The fields of a target file and of each of its regions as
+# (name, type, required) tuples
+TARGET_SCHEMA = (
+    ("format", basestring, True),
+    ("version", int, True),
+    ("regions", list, True),
+)
+
+REGION_SCHEMA = (
+    ("tags", list, True),
+    ("coords", list, True),
+    ("fill", basestring, False),
+)
+
+# Cached targets are (mtime, regions) tuples, these are the indexes of
+# each value in those tuples
+MTIME_INDEX = 0
+REGIONS_INDEX = 1
+
+class TargetFormatError(Exception):
+    pass
+
+def _check_fields(value, schema, name):
+    if not isinstance(value, dict):
+        raise TargetFormatError("%s is not an object" % name)
+
+    for field, field_type, required in schema:
+        if field not in value:
+            if required:
+                raise TargetFormatError("%s is missing %s" % (name, field))
+            continue
+
+        if not isinstance(value[field], field_type):
+            raise TargetFormatError("%s has an invalid %s" % (name, field))
+
+# Raises TargetFormatError if region isn't a valid target region
+def validate_region(region, name="region"):
+    _check_fields(region, REGION_SCHEMA, name)
+
+    shape = None
+    for tag in region["tags"]:
+        if not isinstance(tag, basestring):
+            raise TargetFormatError("%s has a tag that isn't a string" % name)
+
+        if tag.startswith("_shape:"):
+            shape = tag.split(":", 1)[1]
+
+    if shape is None:
+        raise TargetFormatError("%s has no _shape tag" % name)
+
+    coords = region["coords"]
+    if (len(coords) < 2 or len(coords) % 2 != 0 or
+        not all(isinstance(c, (int, long, float)) for c in coords)):
+
+        raise TargetFormatError("%s has invalid coords" % name)
+
+    if shape != "image" and "fill" not in region:
+        raise TargetFormatError("%s is missing fill" % name)
+
+# Raises TargetFormatError if target isn't a valid target file's contents
+def validate_target(target):
+    _check_fields(target, TARGET_SCHEMA, "target")
+
+    if target["format"] != FORMAT_NAME:
+        raise TargetFormatError("not a ShootOFF target")
+
+    if target["version"] > FORMAT_VERSION:
+        raise TargetFormatError("target format version %d is newer than %d" %
+            (target["version"], FORMAT_VERSION))
+
+    for i, region in enumerate(target["regions"]):
+        validate_region(region, "region %d" % i)
+
+# Targets that were pickled only contain lists, tuples, dictionaries,
+# strings, and numbers. Refusing to look up any globals means unpickling
+# them can't run any code.
+def _load_pickled_regions(data):
+    unpickler = cPickle.Unpickler(StringIO(data))
+    unpickler.find_global = None
+
+    try:
+        regions = unpickler.load()
+    except (cPickle.UnpicklingError, EOFError, ValueError, IndexError,
+        TypeError, AttributeError) as e:
+
+        raise TargetFormatError("invalid pickled target: %s" % e)
+
+    if not isinstance(regions, list):
+        raise TargetFormatError("pickled target is not a list of regions")
+
+    for region in regions:
+        if isinstance(region, dict) and isinstance(region.get("tags"), tuple):
+            region["tags"] = list(region["tags"])
+
+    return regions
+
+def is_legacy_target(path):
+    with open(path, "rb") as target_file:
+        return not target_file.read().lstrip().startswith("{")
+
+# Returns the validated list of regions in a target file. Every region is a
+# dictionary with its tags as a tuple, its coords as a list, and its fill
+# color unless it is an image.
+def read_target(path):
+    with open(path, "rb") as target_file:
+        data = target_file.read()
+
+    if data.lstrip().startswith("{"):
+        try:
+            target = json.loads(data)
+        except ValueError as e:
+            raise TargetFormatError("invalid target %s: %s" % (path, e))
+    else:
+        target = {"format": FORMAT_NAME, "version": FORMAT_VERSION,
+            "regions": _load_pickled_regions(data)}
+
+    validate_target(target)
+
+    regions = target["regions"]
+    for region in regions:
+        region["tags"] = tuple(region["tags"])
+
+    return regions
+
+def write_target(path, regions):
+    # Ordered so that the format and version are at the top of the file
+    target = collections.OrderedDict((("format", FORMAT_NAME),
+        ("version", FORMAT_VERSION), ("regions", [])))
+
+    for region in regions:
+        region = dict(region)
+        region["tags"] = list(region["tags"])
+        region["coords"] = list(region["coords"])
+        target["regions"].append(region)
+
+    validate_target(target)
+
+    with open(path, "wb") as target_file:
+        json.dump(target, target_file, separators=(",", ":"))
+
+# Rewrites a pickled target in the current format. The converted target is
+# written to output_path or over the original file if it isn't given.
+def convert_target(path, output_path=None):
+    if output_path is None:
+        output_path = path
+
+    write_target(output_path, read_target(path))
+
+# Keeps the regions of every target that has been loaded so that targets that
+# are added over and over again are only read and parsed once. A cached
+# target is read again if its file was modified since it was cached.
+#
+# The cached regions are shared by everyone who loads the target, so they
+# must not be modified.
+class TargetCache():
+    def __init__(self):
+        self._lock = RLock()
+        self._targets = {}
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def get(self, path):
+        key = self._key(path)
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            cached = self._targets.get(key)
+            if cached is not None and cached[MTIME_INDEX] == mtime:
+                return cached[REGIONS_INDEX]
+
+        regions = read_target(path)
+
+        with self._lock:
+            self._targets[key] = (mtime, regions)
+
+        return regions
+
+    # Has to be called when a target is saved in case the file system doesn't
+    # record modification times precisely enough to notice the change
+    def invalidate(self, path):
+        with self._lock:
+            self._targets.pop(self._key(path), None)
+
+_shared_cache = None
+
+def get_shared_cache():
+    global _shared_cache
+
+    if _shared_cache is None:
+        _shared_cache = TargetCache()
+
+    return _shared_cache
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "usage: %s target_file..." % sys.argv[0]
+        sys.exit(1)
+
+    for target_path in sys.argv[1:]:
+        try:
+            if is_legacy_target(target_path):
+                convert_target(target_path)
+                print "Converted %s" % target_path
+            else:
+                print "%s is already in the current format" % target_path
+        except (IOError, TargetFormatError) as e:
+            print "Failed to convert %s: %s" % (target_path, e)
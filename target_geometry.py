@@ -0,0 +1,230 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import math
+
+RECTANGLE = "rectangle"
+OVAL = "oval"
+POLYGON = "polygon"
+IMAGE = "image"
+
+# Target shapes that are drawn as canvas polygons
+POLYGON_SHAPES = ("triangle", "aqt3", "aqt4", "aqt5", "freeform_polygon")
+
+# Width and height of the grid cells regions are indexed in
+GRID_CELL_SIZE = 64 # px
+
+# Returns the kind of geometry used for a region with the given _shape tag
+def shape_kind(shape):
+    if shape in POLYGON_SHAPES:
+        return POLYGON
+
+    return shape
+
+# The outline of one target region. coords are the region's canvas coordinates
+# except for images, whose coords are their bounding box (x1, y1, x2, y2).
+# Images can have a mask, a 2D array of booleans that is True for every
+# opaque pixel in the image that is currently shown; pixels outside of the
+# mask never hit.
+class RegionGeometry():
+    def __init__(self, region, kind, coords, tags, mask=None):
+        self._region = region
+        self._kind = kind
+        self._tags = tags
+        self._mask = mask
+        self.set_coords(coords)
+
+    def get_region(self):
+        return self._region
+
+    def get_kind(self):
+        return self._kind
+
+    def get_coords(self):
+        return self._coords
+
+    # Returns the region's parsed tags
+    def get_tags(self):
+        return self._tags
+
+    def get_bbox(self):
+        return self._bbox
+
+    def set_coords(self, coords):
+        self._coords = list(coords)
+        xs = self._coords[::2]
+        ys = self._coords[1::2]
+        self._bbox = (min(xs), min(ys), max(xs), max(ys))
+
+    def set_mask(self, mask):
+        self._mask = mask
+
+    def is_hidden(self):
+        return "visible" in self._tags and self._tags["visible"].lower() == "false"
+
+    def contains(self, x, y):
+        x1, y1, x2, y2 = self._bbox
+
+        if x < x1 or x > x2 or y < y1 or y > y2:
+            return False
+
+        if self._kind == OVAL:
+            return self._oval_contains(x, y)
+        elif self._kind == POLYGON:
+            return self._polygon_contains(x, y)
+        elif self._kind == IMAGE:
+            return self._image_contains(x, y)
+
+        return True
+
+    def _oval_contains(self, x, y):
+        x1, y1, x2, y2 = self._bbox
+        radius_x = (x2 - x1) / 2.0
+        radius_y = (y2 - y1) / 2.0
+
+        if radius_x == 0 or radius_y == 0:
+            return False
+
+        dx = (x - (x1 + radius_x)) / radius_x
+        dy = (y - (y1 + radius_y)) / radius_y
+        return dx * dx + dy * dy <= 1
+
+    # Even-odd ray casting, which is how Tk fills polygons
+    def _polygon_contains(self, x, y):
+        xs = self._coords[::2]
+        ys = self._coords[1::2]
+        inside = False
+        j = len(xs) - 1
+
+        for i in range(len(xs)):
+            if (ys[i] > y) != (ys[j] > y):
+                crossing = xs[i] + (y - ys[i]) * (xs[j] - xs[i]) / float(ys[j] - ys[i])
+                if x < crossing:
+                    inside = not inside
+            j = i
+
+        return inside
+
+    def _image_contains(self, x, y):
+        if self._mask is None:
+            return True
+
+        column = int(x - self._bbox[0])
+        row = int(y - self._bbox[1])
+
+        if row >= len(self._mask) or column >= len(self._mask[0]):
+            return False
+
+        return bool(self._mask[row][column])
+
+# Keeps the geometry of every target region on a canvas in a uniform grid so
+# that the regions under a shot can be found without asking Tk for every
+# region. Nothing in here touches Tk, so hit tests can run on any thread as
+# long as the index isn't being updated at the same time.
+#
+# Targets are raised, lowered, and put above or below the background in too
+# many places for the index to keep track of how they are stacked, so the
+# caller passes the canvas's display list (canvas.find_all()) to hit_test.
+class TargetGeometryIndex():
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self._cell_size = cell_size
+        self._regions = {}
+        self._cells = {}
+
+    def add(self, region, kind, coords, tags, mask=None):
+        if region in self._regions:
+            self.remove(region)
+
+        geometry = RegionGeometry(region, kind, coords, tags, mask)
+        self._regions[region] = geometry
+        self._insert(geometry)
+
+        return geometry
+
+    def remove(self, region):
+        geometry = self._regions.pop(region, None)
+
+        if geometry is not None:
+            self._discard(geometry)
+
+    # Removes every region that belongs to the target with the given
+    # _internal_name tag
+    def remove_target(self, target_name):
+        internal_name = target_name.split(":", 1)[-1]
+
+        for region, geometry in self._regions.items():
+            if geometry.get_tags().get("_internal_name") == internal_name:
+                self.remove(region)
+
+    # Swaps a region for a new one with the same tags, which is what happens
+    # when Tk items are converted to other shapes
+    def replace(self, old_region, new_region, kind, coords):
+        old_geometry = self._regions.pop(old_region, None)
+        if old_geometry is None:
+            return
+
+        self._discard(old_geometry)
+        geometry = RegionGeometry(new_region, kind, coords,
+            old_geometry.get_tags())
+        self._regions[new_region] = geometry
+        self._insert(geometry)
+
+    # Call this whenever a region moves or changes size
+    def update_coords(self, region, coords):
+        geometry = self._regions.get(region)
+        if geometry is None:
+            return
+
+        self._discard(geometry)
+        geometry.set_coords(coords)
+        self._insert(geometry)
+
+    def set_mask(self, region, mask):
+        if region in self._regions:
+            self._regions[region].set_mask(mask)
+
+    def get(self, region):
+        return self._regions.get(region)
+
+    def __contains__(self, region):
+        return region in self._regions
+
+    # Returns the geometry of every region that contains (x, y), topmost
+    # region first. display_list is every item on the canvas from the
+    # bottom of the stack to the top.
+    def hit_test(self, x, y, display_list):
+        cell = (int(math.floor(x / self._cell_size)),
+            int(math.floor(y / self._cell_size)))
+
+        hits = [geometry for geometry in self._cells.get(cell, ())
+            if geometry.contains(x, y)]
+
+        if len(hits) > 1:
+            stacking = dict((item, z) for z, item in enumerate(display_list))
+            hits.sort(key=lambda geometry: stacking.get(geometry.get_region(), -1),
+                reverse=True)
+
+        return hits
+
+    def _cell_range(self, geometry):
+        x1, y1, x2, y2 = geometry.get_bbox()
+        size = self._cell_size
+
+        for cell_x in range(int(math.floor(x1 / size)), int(math.floor(x2 / size)) + 1):
+            for cell_y in range(int(math.floor(y1 / size)), int(math.floor(y2 / size)) + 1):
+                yield (cell_x, cell_y)
+
+    def _insert(self, geometry):
+        for cell in self._cell_range(geometry):
+            self._cells.setdefault(cell, set()).add(geometry)
+
+    def _discard(self, geometry):
+        for cell in self._cell_range(geometry):
+            members = self._cells.get(cell)
+            if members is None:
+                continue
+
+            members.discard(geometry)
+            if not members:
+                del self._cells[cell]
@@ -3,10 +3,13 @@
 # found in the LICENSE file.
 
 import canvas_manager
-import pickle
 from PIL import Image, ImageTk
-from tag_parser import TagParser
+import target_format
+import target_template
 
+# Targets are saved in the format described in target_format. They are
+# loaded through the shared target cache and compiled into templates, so a
+# target that is added repeatedly is only read and parsed once
 class TargetPickler():
     def save(self, target_file, region_list, canvas):
         region_object = []
@@ -24,88 +27,18 @@ class TargetPickler():
                     "coords":region_coords,
                     "fill":region_fill})
 
-        target = open(target_file, 'wb')
-        pickle.dump(region_object, target, pickle.HIGHEST_PROTOCOL)
-        target.close()
+        target_format.write_target(target_file, region_object)
+        target_format.get_shared_cache().invalidate(target_file)
 
     # the target_name is set on every region in a target
     # and should be unique for the webcam feed so that
-    # multiple instances of a target can exist
-    def load(self, target_file, canvas, canvas_manager, internal_target_name="_internal_name:target"):
+    # multiple instances of a target can exist. If position
+    # is given, the top left corner of the target is put there
+    def load(self, target_file, canvas, canvas_manager, internal_target_name="_internal_name:target",
+        position=None):
 
-        target = open(target_file, 'rb')
-        region_object = pickle.load(target)
-        target.close()
+        template = target_template.get_template(target_file)
+        regions = template.instantiate(canvas, canvas_manager,
+            internal_target_name, position)
 
-        regions = self._draw_target(region_object, canvas, canvas_manager,
-                    internal_target_name)
-                
-        return (region_object, regions)
-
-    def _draw_target(self, region_object, canvas, _canvas_manager, internal_target_name):
-        regions = []
-
-        for region in region_object:
-            shape = 0
-            raw_tags = region["tags"]
-    
-            # Get rid of the default internal name otherwise every target
-            # will have it and selection won't work
-            raw_tags = tuple([value for value in raw_tags if value != "_internal_name:target"])
-
-            raw_tags += (internal_target_name,)
-            parsed_tags = TagParser.parse_tags(raw_tags)	
-
-            if parsed_tags["_shape"] == "image":
-                shape = canvas.create_image(region["coords"], image=None, 
-                            tags=raw_tags)
-
-                image = _canvas_manager.cache_image_frames(shape, parsed_tags["_path"])
-                canvas.itemconfig(shape, image=image)
-
-                _canvas_manager.animate(shape, image)
-
-            if parsed_tags["_shape"] == "rectangle":
-                shape = canvas.create_rectangle(region["coords"],
-                    fill=region["fill"], stipple="gray25",
-                    tags=raw_tags)
-
-            if parsed_tags["_shape"] == "oval":
-                shape = canvas.create_oval(region["coords"],
-                    fill=region["fill"], stipple="gray25",
-                    tags=raw_tags)
-
-            if parsed_tags["_shape"] == "triangle":
-                shape = canvas.create_polygon(region["coords"],
-                    fill=region["fill"], outline="black",
-                    stipple="gray25", tags=raw_tags)
-
-            if parsed_tags["_shape"] == "aqt3":
-                shape = canvas.create_polygon(region["coords"],
-                    fill=region["fill"], outline="black",
-                    stipple="gray25", tags=raw_tags)
-                
-            if parsed_tags["_shape"] == "aqt4":
-                shape = canvas.create_polygon(region["coords"],
-                    fill=region["fill"], outline="black",
-                    stipple="gray25", tags=raw_tags)
-
-            if parsed_tags["_shape"] == "aqt5":
-                shape = canvas.create_polygon(region["coords"],
-                    fill=region["fill"], outline="black",
-                    stipple="gray25", tags=raw_tags)
-
-            if parsed_tags["_shape"] == "freeform_polygon":
-                shape = canvas.create_polygon(region["coords"],
-                    fill=region["fill"], outline="black",
-                    stipple="gray25", tags=raw_tags)
-
-            if "visible" in parsed_tags and parsed_tags["visible"].lower() == "false":
-                canvas.tag_lower(shape, "background")
-            else:
-                canvas.tag_raise(shape, "background")
-
-            if shape != 0:
-                regions.append(shape)
-
-        return regions
+        return (template.get_regions(), regions)
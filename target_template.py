@@ -0,0 +1,186 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import image_frame_cache
+import os
+from tag_parser import TagParser
+import target_format
+import target_geometry
+from threading import RLock
+
+# The canvas method each kind of region is created with and the options it
+# is created with
+CREATE_METHODS = {
+    target_geometry.RECTANGLE: ("create_rectangle", {"stipple": "gray25"}),
+    target_geometry.OVAL: ("create_oval", {"stipple": "gray25"}),
+    target_geometry.POLYGON: ("create_polygon", {"outline": "black",
+        "stipple": "gray25"}),
+    target_geometry.IMAGE: ("create_image", {"image": None}),
+}
+
+# Region templates are (create_method, coords, options, raw_tags,
+# parsed_tags, hidden) tuples, these are the indexes of each value in
+# those tuples
+CREATE_METHOD_INDEX = 0
+COORDS_INDEX = 1
+OPTIONS_INDEX = 2
+RAW_TAGS_INDEX = 3
+PARSED_TAGS_INDEX = 4
+HIDDEN_INDEX = 5
+
+# A target with everything that is the same for every copy of it worked out
+# ahead of time: how each region is drawn, its parsed tags, and whether it
+# goes above or below the background. Instantiating the template only has
+# to create the canvas items and stack them.
+class TargetTemplate():
+    def __init__(self, regions):
+        self._regions = regions
+        self._region_templates = []
+        self._bbox = None
+
+        for region in regions:
+            # Get rid of the default internal name otherwise every target
+            # will have it and selection won't work
+            raw_tags = tuple([value for value in region["tags"]
+                if value != "_internal_name:target"])
+            parsed_tags = TagParser.parse_tags(raw_tags)
+
+            kind = target_geometry.shape_kind(parsed_tags["_shape"])
+            if kind not in CREATE_METHODS:
+                continue
+
+            create_method, options = CREATE_METHODS[kind]
+            options = dict(options)
+            if "fill" in region:
+                options["fill"] = region["fill"]
+
+            hidden = ("visible" in parsed_tags and
+                parsed_tags["visible"].lower() == "false")
+
+            self._region_templates.append((create_method,
+                tuple(region["coords"]), options, raw_tags, parsed_tags, hidden))
+
+    # Returns the regions the template was compiled from
+    def get_regions(self):
+        return self._regions
+
+    # Returns the (x1, y1, x2, y2) box around every region of the target
+    # as it is drawn without being moved or scaled
+    def get_bbox(self):
+        if self._bbox is None:
+            xs = []
+            ys = []
+
+            for template in self._region_templates:
+                coords = template[COORDS_INDEX]
+
+                # Images are drawn centered on their coords
+                if template[CREATE_METHOD_INDEX] == "create_image":
+                    width, height = self._image_size(template)
+                    xs.extend((coords[0] - width / 2, coords[0] + width / 2))
+                    ys.extend((coords[1] - height / 2, coords[1] + height / 2))
+                else:
+                    xs.extend(coords[::2])
+                    ys.extend(coords[1::2])
+
+            if xs:
+                self._bbox = (min(xs), min(ys), max(xs), max(ys))
+            else:
+                self._bbox = (0, 0, 0, 0)
+
+        return self._bbox
+
+    def _image_size(self, template):
+        path = template[PARSED_TAGS_INDEX]["_path"]
+        return image_frame_cache.get_shared_cache().get(path).get_frame(0).size
+
+    # Draws a copy of the target on canvas and returns its regions. Every
+    # region is tagged with internal_target_name. The target is scaled by
+    # scale and, if position is given, moved so that the top left corner of
+    # its bounding box is at position.
+    def instantiate(self, canvas, canvas_manager, internal_target_name,
+        position=None, scale=1.0):
+
+        internal_name = internal_target_name.split(":", 1)[1]
+        transform = None
+
+        if position is not None or scale != 1.0:
+            origin_x, origin_y = self.get_bbox()[:2]
+            x, y = origin_x, origin_y
+            if position is not None:
+                x, y = position
+
+            transform = (origin_x, origin_y, x, y)
+
+        regions = []
+        hidden_regions = []
+
+        for template in self._region_templates:
+            coords = template[COORDS_INDEX]
+            if transform is not None:
+                coords = self._transform(coords, transform, scale)
+
+            raw_tags = template[RAW_TAGS_INDEX] + (internal_target_name,)
+            parsed_tags = dict(template[PARSED_TAGS_INDEX])
+            parsed_tags["_internal_name"] = internal_name
+
+            shape = getattr(canvas, template[CREATE_METHOD_INDEX])(coords,
+                tags=raw_tags, **template[OPTIONS_INDEX])
+
+            if template[CREATE_METHOD_INDEX] == "create_image":
+                width = height = None
+                if scale != 1.0:
+                    width, height = self._image_size(template)
+                    width = max(int(width * scale), 1)
+                    height = max(int(height * scale), 1)
+
+                image = canvas_manager.cache_image_frames(shape,
+                    parsed_tags["_path"], width, height)
+                canvas.itemconfig(shape, image=image)
+
+                canvas_manager.animate(shape, image)
+
+            canvas_manager.get_metadata().add(shape, raw_tags, parsed_tags)
+            regions.append(shape)
+
+            if template[HIDDEN_INDEX]:
+                hidden_regions.append(shape)
+
+        # Raising every region at once keeps them in the order they are in
+        # the target file, then hidden regions go below the background
+        if regions:
+            canvas.tag_raise(internal_target_name, "background")
+
+        for region in hidden_regions:
+            canvas.tag_lower(region, "background")
+
+        return regions
+
+    def _transform(self, coords, transform, scale):
+        origin_x, origin_y, x, y = transform
+        transformed = []
+
+        for i in range(0, len(coords), 2):
+            transformed.append(x + (coords[i] - origin_x) * scale)
+            transformed.append(y + (coords[i + 1] - origin_y) * scale)
+
+        return transformed
+
+_templates = {}
+_templates_lock = RLock()
+
+# Returns the template for a target file. Templates are rebuilt whenever the
+# target cache reads the file again.
+def get_template(path):
+    regions = target_format.get_shared_cache().get(path)
+    key = os.path.normcase(os.path.abspath(path))
+
+    with _templates_lock:
+        template = _templates.get(key)
+
+        if template is None or template.get_regions() is not regions:
+            template = TargetTemplate(regions)
+            _templates[key] = template
+
+        return template
@@ -0,0 +1,69 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+from camera_capture import FrameRingBuffer
+import configurator
+import logging
+import numpy
+from process_detector import ProcessShotDetector
+import Queue
+import time
+import unittest
+
+PREFERENCES = {
+    configurator.LASER_COLOR_CLASSIFIER: "ratio",
+    configurator.LASER_INTENSITY: 230,
+    configurator.BACKGROUND_SUBTRACTION: False,
+    configurator.IGNORE_LASER_COLOR: "none",
+}
+
+# How long to wait for the workers to get through a frame
+DETECTION_TIMEOUT = 10 # s
+
+class TestProcessShotDetector(unittest.TestCase):
+    def setUp(self):
+        self._ring = FrameRingBuffer()
+        self._detector = ProcessShotDetector(PREFERENCES,
+            logging.getLogger("shootoff"), processes=1)
+        self._detector.start(self._ring)
+
+        # A red laser that is about 180 bright in grayscale
+        self._frame = numpy.zeros((120, 160, 3), numpy.uint8)
+        self._frame[60:65, 80:85] = (150, 150, 255)
+
+    def tearDown(self):
+        self._detector.stop()
+
+    def _publish(self, sequence):
+        buffer = self._ring.begin_write(sequence, self._frame.shape)
+        numpy.copyto(buffer, self._frame)
+        self._ring.publish(sequence, buffer, time.time())
+
+    def _wait_for_detected_frames(self, count):
+        start = time.time()
+
+        while self._detector.get_statistics()["detected_frames"] < count:
+            self.assertLess(time.time() - start, DETECTION_TIMEOUT)
+            time.sleep(.01)
+
+    def test_workers_use_new_laser_intensity(self):
+        self._publish(0)
+        self._wait_for_detected_frames(1)
+        self.assertTrue(self._detector.get_shot_queue().empty())
+
+        preferences = dict(PREFERENCES)
+        preferences[configurator.LASER_INTENSITY] = 170
+        self._detector.update_preferences(preferences)
+
+        self._publish(1)
+
+        try:
+            shot = self._detector.get_shot_queue().get(timeout=DETECTION_TIMEOUT)
+        except Queue.Empty:
+            self.fail("The worker kept using the old laser intensity")
+
+        self.assertEqual(shot[1], "red")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import configurator
+import logging
+import numpy
+import shot_detector
+from shot_detector import ShotDetector, BLOB_AREA_INDEX
+import unittest
+
+PREFERENCES = {
+    configurator.LASER_COLOR_CLASSIFIER: "ratio",
+    configurator.LASER_INTENSITY: 230,
+    configurator.BACKGROUND_SUBTRACTION: False,
+    configurator.IGNORE_LASER_COLOR: "none",
+}
+
+class TestFindBlobs(unittest.TestCase):
+    def setUp(self):
+        self._has_connected_components = shot_detector.HAS_CONNECTED_COMPONENTS
+        self._detector = ShotDetector(PREFERENCES, logging.getLogger("shootoff"))
+
+    def tearDown(self):
+        shot_detector.HAS_CONNECTED_COMPONENTS = self._has_connected_components
+
+    # An L shaped blob with a small square blob inside its bounding box
+    def _overlapping_blobs(self):
+        frame_thresh = numpy.zeros((50, 50), numpy.uint8)
+        frame_thresh[10:31, 10:13] = 255
+        frame_thresh[28:31, 10:31] = 255
+        frame_thresh[15:18, 20:23] = 255
+
+        return frame_thresh
+
+    def _find_areas(self, frame_thresh):
+        self._detector._context.prepare(frame_thresh)
+        blobs = self._detector.find_blobs(frame_thresh, frame_thresh)
+
+        return sorted(blob[BLOB_AREA_INDEX] for blob in blobs)
+
+    def test_contour_areas_ignore_overlapping_boxes(self):
+        shot_detector.HAS_CONNECTED_COMPONENTS = False
+
+        self.assertEqual(self._find_areas(self._overlapping_blobs()), [9, 117])
+
+    def test_contour_centroid_ignores_overlapping_boxes(self):
+        shot_detector.HAS_CONNECTED_COMPONENTS = False
+        frame_thresh = self._overlapping_blobs()
+
+        self._detector._context.prepare(frame_thresh)
+        blobs = self._detector.find_blobs(frame_thresh, frame_thresh)
+        square = [blob for blob in blobs if blob[BLOB_AREA_INDEX] == 9][0]
+
+        self.assertAlmostEqual(square[0], 21)
+        self.assertAlmostEqual(square[1], 16)
+
+    def test_contours_match_connected_components(self):
+        if not self._has_connected_components:
+            self.skipTest("OpenCV doesn't have connected component labeling")
+
+        frame_thresh = self._overlapping_blobs()
+        areas = self._find_areas(frame_thresh)
+
+        shot_detector.HAS_CONNECTED_COMPONENTS = False
+        self.assertEqual(self._find_areas(frame_thresh), areas)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import target_format
+import target_geometry
+from target_geometry import TargetGeometryIndex
+import tempfile
+import unittest
+
+BACKGROUND = 1
+
+class TestHitTestStacking(unittest.TestCase):
+    def setUp(self):
+        self._index = TargetGeometryIndex()
+        self._index.add(2, target_geometry.RECTANGLE, (0, 0, 100, 100),
+            {"_shape": "rectangle"})
+        self._index.add(3, target_geometry.RECTANGLE, (50, 50, 150, 150),
+            {"_shape": "rectangle"})
+
+    def _topmost(self, display_list):
+        return self._index.hit_test(75, 75, display_list)[0].get_region()
+
+    # New targets are put just above the background, below older targets
+    def test_newer_region_drawn_underneath(self):
+        self.assertEqual(self._topmost((BACKGROUND, 3, 2)), 2)
+
+    def test_newer_region_raised_to_top(self):
+        self.assertEqual(self._topmost((BACKGROUND, 2, 3)), 3)
+
+    def test_every_hit_is_returned(self):
+        hits = self._index.hit_test(75, 75, (BACKGROUND, 3, 2))
+        self.assertEqual([hit.get_region() for hit in hits], [2, 3])
+
+class TestProjectorArenaHitTest(unittest.TestCase):
+    def setUp(self):
+        import Tkinter
+
+        try:
+            self._root = Tkinter.Tk()
+        except Tkinter.TclError as e:
+            self.skipTest("Tk can't open a display: %s" % e)
+
+        from canvas_manager import CanvasManager
+
+        # Laid out the way ProjectorArena sets up its canvas
+        self._canvas = Tkinter.Canvas(self._root, width=600, height=480)
+        self._canvas.create_rectangle(0, 0, 600, 480, fill="gray15",
+            outline="gray15", tags=("background"))
+        self._canvas_manager = CanvasManager(self._canvas, {})
+
+        self._target_dir = tempfile.mkdtemp()
+        self._target_file = os.path.join(self._target_dir, "square.target")
+        target_format.write_target(self._target_file, [{"fill": "red",
+            "tags": ("_shape:rectangle", "_internal_name:target"),
+            "coords": (0, 0, 100, 100)}])
+
+    def tearDown(self):
+        self._root.destroy()
+        shutil.rmtree(self._target_dir)
+
+    def test_overlapping_targets_hit_the_one_drawn_on_top(self):
+        self._canvas_manager.add_target(self._target_file, {}, (0, 0))
+        self._canvas_manager.add_target(self._target_file, {}, (50, 50))
+
+        drawn_on_top = self._canvas.find_overlapping(75, 75, 75, 75)[-1]
+        hits = self._canvas_manager.hit_test(75, 75)
+
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(hits[0].get_region(), drawn_on_top)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,239 @@
+# Copyright (c) 2015 phrack. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import glob
+import logging
+import numpy
+import pyaudio
+from threading import Event, RLock
+import time
+import wave
+
+# Every sound is converted to this format when it is loaded so that they can
+# all be mixed into one output stream
+SAMPLE_RATE = 44100 # Hz
+CHANNELS = 2
+
+# Smaller buffers start sounds sooner but need the mixer to keep up
+FRAMES_PER_BUFFER = 256
+
+# Sounds that are loaded when the mixer starts
+SOUNDS_GLOB = "sounds/*.wav"
+
+# Returns the samples of a wav file as a (frames, CHANNELS) array of floats
+# in [-1, 1] at SAMPLE_RATE
+def read_wav(path):
+    wav = wave.open(path, "rb")
+    try:
+        sample_width = wav.getsampwidth()
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    finally:
+        wav.close()
+
+    if sample_width == 1:
+        samples = (numpy.frombuffer(frames, numpy.uint8).astype(numpy.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = numpy.frombuffer(frames, numpy.int16).astype(numpy.float32) / 32768
+    elif sample_width == 4:
+        samples = numpy.frombuffer(frames, numpy.int32).astype(numpy.float32) / 2147483648
+    else:
+        raise ValueError("%s has an unsupported sample width (%d)" %
+            (path, sample_width))
+
+    samples = samples.reshape(-1, channels)
+
+    if channels == 1:
+        samples = numpy.repeat(samples, CHANNELS, axis=1)
+    else:
+        samples = samples[:, :CHANNELS]
+
+    # Resampling linearly is good enough for beeps and clangs
+    if rate != SAMPLE_RATE and len(samples) > 0:
+        length = int(len(samples) * SAMPLE_RATE / rate)
+        positions = numpy.linspace(0, len(samples) - 1, length)
+        original_positions = numpy.arange(len(samples))
+        samples = numpy.column_stack([numpy.interp(positions, original_positions,
+            samples[:, channel]) for channel in range(CHANNELS)])
+
+    return numpy.ascontiguousarray(samples, numpy.float32)
+
+# A sound that was started on the mixer
+class PlayingSound():
+    def __init__(self, samples):
+        self._samples = samples
+        self._position = 0
+        self._start_time = None
+        self._started = Event()
+        self._stopped = False
+
+    # Returns the time (as returned by time.time()) that the sound's first
+    # sample reached the audio device or None if it hasn't yet
+    def get_start_time(self):
+        return self._start_time
+
+    # Waits for the sound to be mixed into the output and returns its start
+    # time. Returns None if the wait timed out or the sound was stopped
+    # before it started.
+    def wait_for_start(self, timeout=None):
+        self._started.wait(timeout)
+        return self._start_time
+
+    def stop(self):
+        self._stopped = True
+        self._started.set()
+
+    def is_finished(self):
+        return self._stopped or self._position >= len(self._samples)
+
+    # Adds the sound's next samples to buffer, which starts playing at
+    # buffer_start_time
+    def _mix(self, buffer, buffer_start_time):
+        chunk = self._samples[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] += chunk
+
+        if self._position == 0:
+            self._start_time = buffer_start_time
+            self._started.set()
+
+        self._position += len(chunk)
+
+# Plays sounds through a single output stream that stays open for as long as
+# ShootOFF runs. PortAudio calls the mixer from its own audio thread whenever
+# the device needs more samples, so sounds start at the next buffer instead
+# of waiting for a stream to be opened, and sounds that overlap are mixed
+# together. Sounds are decoded once and kept in memory.
+class AudioMixer():
+    def __init__(self, sounds_glob=SOUNDS_GLOB):
+        self._logger = logging.getLogger("shootoff")
+        self._lock = RLock()
+        self._sounds_lock = RLock()
+        self._sounds = {}
+        self._playing = []
+        self._latency = 0
+
+        for sound_file in glob.glob(sounds_glob):
+            self.load(sound_file)
+
+        self._pyaudio = pyaudio.PyAudio()
+        try:
+            self._stream = self._pyaudio.open(format=pyaudio.paFloat32,
+                channels=CHANNELS, rate=SAMPLE_RATE, output=True,
+                frames_per_buffer=FRAMES_PER_BUFFER,
+                stream_callback=self._mix_callback)
+        except:
+            self._pyaudio.terminate()
+            raise
+
+        self._latency = self._stream.get_output_latency()
+        self._stream.start_stream()
+
+        self._logger.debug("Audio mixer started with %.1fms of output latency",
+            self._latency * 1000)
+
+    # Decodes a sound so that it can be played without touching the disk and
+    # returns its samples or None if it can't be decoded. Sounds that can't
+    # be decoded are only tried once. This has its own lock so that the
+    # mixer is never kept waiting while a sound is read.
+    def load(self, sound_file):
+        with self._sounds_lock:
+            if sound_file not in self._sounds:
+                try:
+                    self._sounds[sound_file] = read_wav(sound_file)
+                except (IOError, EOFError, wave.Error, ValueError) as e:
+                    self._logger.warning("Couldn't load %s, it won't be played: %s",
+                        sound_file, e)
+                    self._sounds[sound_file] = None
+
+            return self._sounds[sound_file]
+
+    # Starts playing a sound and returns its PlayingSound or None if the
+    # sound can't be played
+    def play(self, sound_file):
+        samples = self.load(sound_file)
+        if samples is None:
+            return None
+
+        sound = PlayingSound(samples)
+
+        with self._lock:
+            self._playing.append(sound)
+
+        return sound
+
+    def stop_all(self):
+        with self._lock:
+            for sound in self._playing:
+                sound.stop()
+            self._playing = []
+
+    def close(self):
+        self.stop_all()
+        self._stream.stop_stream()
+        self._stream.close()
+        self._pyaudio.terminate()
+
+    # Returns the time.time() at which the next buffer will reach the device
+    def _buffer_start_time(self, time_info):
+        now = time.time()
+        dac_time = time_info.get("output_buffer_dac_time", 0)
+        current_time = time_info.get("current_time", 0)
+
+        if dac_time > 0 and current_time > 0 and dac_time >= current_time:
+            return now + dac_time - current_time
+
+        # Some host APIs don't report stream times, so fall back to the
+        # latency the stream was opened with
+        return now + self._latency
+
+    def _mix_callback(self, in_data, frame_count, time_info, status):
+        buffer = numpy.zeros((frame_count, CHANNELS), numpy.float32)
+        buffer_start_time = self._buffer_start_time(time_info)
+
+        with self._lock:
+            for sound in self._playing:
+                if not sound.is_finished():
+                    sound._mix(buffer, buffer_start_time)
+
+            self._playing = [sound for sound in self._playing
+                if not sound.is_finished()]
+
+        numpy.clip(buffer, -1, 1, buffer)
+
+        return (buffer.tostring(), pyaudio.paContinue)
+
+_shared_mixer = None
+_shared_mixer_failed = False
+_shared_mixer_lock = RLock()
+
+# Returns the mixer every protocol plays sounds through, starting it the first
+# time it is asked for, or None if there is no audio device to play on
+def get_shared_mixer():
+    global _shared_mixer, _shared_mixer_failed
+
+    with _shared_mixer_lock:
+        if _shared_mixer is None and not _shared_mixer_failed:
+            try:
+                _shared_mixer = AudioMixer()
+            except IOError as e:
+                _shared_mixer_failed = True
+                logging.getLogger("shootoff").warning(
+                    "Couldn't open an audio output stream, sounds won't be played: %s", e)
+
+        return _shared_mixer
+
+# Stops every sound playing on the shared mixer if it was started
+def stop_shared_sounds():
+    with _shared_mixer_lock:
+        if _shared_mixer is not None:
+            _shared_mixer.stop_all()
+
+def close_shared_mixer():
+    global _shared_mixer
+
+    with _shared_mixer_lock:
+        if _shared_mixer is not None:
+            _shared_mixer.close()
+            _shared_mixer = None
@@ -2,20 +2,13 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-import pyaudio
-import pyttsx
-from threading import Thread
+import sys
+from threading import Lock, Thread
 from training_protocols.timer_interval_window import TimerIntervalWindow
-import wave
 
 LARGEST_REGION = 0
 BOUNDING_BOX = 1
 
-SAMPWIDTH_INDEX = 0
-NCHANNELS_INDEX = 1
-FRAMERATE_INDEX = 2
-DATA_INDEX = 3
-
 # This class hold shootoff functions that should be exposed to training protocol
 # plugins. Each instance of a plugin has its own instance of this class.
 class ProtocolOperations():
@@ -27,14 +20,24 @@ class ProtocolOperations():
         self._plugin_canvas_artifacts.append(self._feed_text)
         self._added_columns = ()
         self._added_column_widths = []
-        self._sound_cache = {}
         self._tiw = None
         self._destroy = False
+        self._tts_engine = None
+        self._tts_engine_lock = Lock()
+
+    # The text-to-speech engine is only started the first time something
+    # is said because most protocols never say anything
+    def _get_tts_engine(self):
+        with self._tts_engine_lock:
+            if self._tts_engine is None:
+                import pyttsx
+
+                self._tts_engine = pyttsx.init()
+                # slow down the wpm rate otherwise they speek to fast
+                self._tts_engine.setProperty("rate", 150)
+                self._tts_engine.startLoop(False)
 
-        self._tts_engine = pyttsx.init()
-        # slow down the wpm rate otherwise they speek to fast
-        self._tts_engine.setProperty("rate", 150)
-        self._tts_engine.startLoop(False)
+            return self._tts_engine
 
     # Shows a popup window that lets the user set the interval for a random start 
     # delay in seconds. Notify interval points to a function that gets the min
@@ -109,6 +112,12 @@ class ProtocolOperations():
 
     def destroy(self):
         self._destroy = True
+
+        # Stop anything the protocol is still playing
+        audio_mixer = sys.modules.get("training_protocols.audio_mixer")
+        if audio_mixer is not None:
+            audio_mixer.stop_shared_sounds()
+
         if (self._tiw is not None):
             self._tiw.destroy()
 
@@ -119,10 +128,11 @@ class ProtocolOperations():
         # if it does, otherwise we just end the loop (better to get a CLI
         # error message than the actual behavior of not ending the loop,
         # which is weird sound artifacts).
-        if hasattr(self._tts_engine, "_inLoop") and self._tts_engine._inLoop:
-            self._tts_engine.endLoop()
-        elif not hasattr(self._tts_engine, "_inLoop"):
-            self._tts_engine.endLoop()
+        if self._tts_engine is not None:
+            if hasattr(self._tts_engine, "_inLoop") and self._tts_engine._inLoop:
+                self._tts_engine.endLoop()
+            elif not hasattr(self._tts_engine, "_inLoop"):
+                self._tts_engine.endLoop()
         self.clear_canvas()
         self.clear_protocol_shot_list_columns()
         self.pause_shot_detection(False)
@@ -144,6 +154,10 @@ class ProtocolOperations():
 
     # Use text-to-speech to say message outloud
     def say(self, message):
+        # Start the engine on the caller's thread like it used to be
+        # when it was started with the protocol
+        self._get_tts_engine()
+
         # if we don't do this on another thread we have to wait until
         # the message has finished being communicated to do anything
         # (i.e. shootoff freezes)  
@@ -173,12 +187,6 @@ class ProtocolOperations():
     def clear_protocol_shot_list_columns(self):
         self._shootoff.revert_shot_list_columns()
 
-    def _cache_sound(self):
-        wavs = glob.glob("sounds/*.wav")
-        
-        for wav in wavs:
-            self._add_wav_cache(wav)
-
     # Returns true of the projector arena is open, false otherwise
     def projector_arena_visible(self):
         return self._shootoff.get_projector_arena().is_visible()
@@ -207,50 +215,35 @@ class ProtocolOperations():
         arena = self._shootoff.get_projector_arena()
         return (arena.arena_width(), arena.arena_height())
 
-    # Play the sound in sound_files
+    # Play the sound in sound_file. Sounds play through one audio stream that
+    # is shared by every protocol, so this returns right away and sounds that
+    # overlap are mixed together. Returns a PlayingSound whose
+    # wait_for_start() gives the time the sound's first sample reached the
+    # audio device, or None if no sound will be played.
     def play_sound(self, sound_file):
-        # if we don't do this on a nother thread we have to wait until
-        # the message has finished being communicated to do anything
-        # (i.e. shootoff freezes)  
-        self._play_sound_thread = Thread(target=self._play_sound, 
-            args=(sound_file,), name="play_sound_thread")
-        self._play_sound_thread.start()  
-
-    def _play_sound(self, *args):
         if self._destroy:
-            return
+            return None
 
-        sound_file = args[0]  
-        if sound_file not in self._sound_cache:
-            self._add_wav_cache(sound_file)
-
-        # initialize the sound file and stream  
-        p = pyaudio.PyAudio()  
-        stream = p.open(format = p.get_format_from_width(self._sound_cache[sound_file][SAMPWIDTH_INDEX]),  
-                        channels = self._sound_cache[sound_file][NCHANNELS_INDEX],  
-                        rate = self._sound_cache[sound_file][FRAMERATE_INDEX],
-                        output = True)  
-
-        # play the sound file
-        for data in self._sound_cache[sound_file][DATA_INDEX]:
-            if self._destroy:
-                break
-            stream.write(data) 
-
-        # clean up
-        stream.stop_stream()  
-        stream.close()  
-        p.terminate() 
-
-    def _add_wav_cache(self, sound_file):
-        chunk = 1024
-        
-        f = wave.open(sound_file,"rb")
-        
-        self._sound_cache[sound_file] = (f.getsampwidth(), f.getnchannels(), 
-            f.getframerate(), [])
+        mixer = self._get_mixer()
+        if mixer is None:
+            return None
+
+        return mixer.play(sound_file)
+
+    # Starts the audio mixer, which loads every sound in sounds/, on another
+    # thread so that the first sound a protocol plays isn't delayed by it
+    def preload_sounds(self):
+        Thread(target=self._get_mixer, name="preload_sounds_thread").start()
+
+    # The audio backend is only loaded once a protocol needs it
+    def _get_mixer(self):
+        from training_protocols import audio_mixer
+
+        return audio_mixer.get_shared_mixer()
+
+# Closes the audio stream if a protocol opened it
+def close_audio():
+    audio_mixer = sys.modules.get("training_protocols.audio_mixer")
 
-        data = f.readframes(chunk)   
-        while data != '':  
-            self._sound_cache[sound_file][DATA_INDEX].append(data)
-            data = f.readframes(chunk) 
+    if audio_mixer is not None:
+        audio_mixer.close_shared_mixer()
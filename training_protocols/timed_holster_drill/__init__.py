@@ -8,6 +8,10 @@ from threading import Thread
 import time
 from training_protocols.ITrainingProtocol import ITrainingProtocol 
 
+# How long to wait for the beep to reach the speakers before falling back to
+# timing from when it was started
+BEEP_START_TIMEOUT = .5 # s
+
 class TimedHolsterDrill(ITrainingProtocol):
     def __init__(self, main_window, protocol_operations, targets):
         self._operations = protocol_operations
@@ -16,6 +20,7 @@ class TimedHolsterDrill(ITrainingProtocol):
         self._operations.pause_shot_detection(True)    
 
         self._repeat_protocol = True
+        self._beep_time = None
         self._parent = main_window
         self._operations.get_delayed_start_interval(self._parent, self.update_interval)
 
@@ -44,15 +49,33 @@ class TimedHolsterDrill(ITrainingProtocol):
         self._wait_event.wait(random_delay)
 
         if self._repeat_protocol:
-            self._operations.play_sound("sounds/beep.wav")
+            # Shots aren't timed until we know when this beep started
+            self._beep_time = None
+            beep = self._operations.play_sound("sounds/beep.wav")
             self._operations.pause_shot_detection(False)
-            self._beep_time = time.time()
+
+            # Draw times start when the shooter could actually hear the beep
+            beep_time = None
+            if beep is not None:
+                beep_time = beep.wait_for_start(BEEP_START_TIMEOUT)
+            if beep_time is None:
+                beep_time = time.time()
+
+            self._beep_time = beep_time
             self.random_delay()
 
     def shot_listener(self, shot, shot_list_item, is_hit):
-        # Calculate difference between beep time and current time and
-        # add it to the list
-        draw_shot_length = time.time() - self._beep_time
+        beep_time = self._beep_time
+        shot_time = shot.get_capture_time()
+
+        # Shots that came in before the beep's start time was known or that
+        # were fired before the beep aren't draws
+        if beep_time is None or shot_time is None or shot_time < beep_time:
+            return
+
+        # The draw time is measured from when the camera saw the shot, so
+        # detection and processing delays don't count against the shooter
+        draw_shot_length = shot_time - beep_time
         self._operations.append_shot_item_values(shot_list_item, (draw_shot_length,))
 
     def hit_listener(self, region, tags, shot, shot_list_item):